@@ -133,7 +133,7 @@ class AwardList(Resource):
         db.session.close()
 
         # Delete standings cache because awards can change scores
-        clear_standings()
+        clear_standings(rebuild=False)
 
         return {"success": True, "data": response.data}
 
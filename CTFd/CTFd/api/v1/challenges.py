@@ -7,7 +7,7 @@ from sqlalchemy.sql import and_
 from CTFd.api.v1.helpers.request import validate_args
 from CTFd.api.v1.helpers.schemas import sqlalchemy_to_pydantic
 from CTFd.api.v1.schemas import APIDetailedSuccessResponse, APIListSuccessResponse
-from CTFd.cache import clear_challenges, clear_standings
+from CTFd.cache import clear_challenges, clear_solve, clear_standings
 from CTFd.constants import RawEnum
 from CTFd.models import ChallengeFiles as ChallengeFilesModel
 from CTFd.models import Challenges
@@ -621,11 +621,16 @@ class ChallengeAttempt(Resource):
             status, message = chal_class.attempt(challenge, request)
             if status:  # The challenge plugin says the input is right
                 if ctftime() or current_user.is_admin():
+                    value = challenge.value
                     chal_class.solve(
                         user=user, team=team, challenge=challenge, request=request
                     )
-                    clear_standings()
-                    clear_challenges()
+                    clear_solve(
+                        user=user,
+                        team=team,
+                        challenge=challenge,
+                        value_changed=challenge.value != value,
+                    )
 
                 log(
                     "submissions",
@@ -641,11 +646,10 @@ class ChallengeAttempt(Resource):
                 }
             else:  # The challenge plugin says the input is wrong
                 if ctftime() or current_user.is_admin():
+                    # A fail doesn't change any score, solve count or place so no cached data goes
                     chal_class.fail(
                         user=user, team=team, challenge=challenge, request=request
                     )
-                    clear_standings()
-                    clear_challenges()
 
                 log(
                     "submissions",
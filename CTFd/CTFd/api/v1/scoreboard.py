@@ -1,18 +1,25 @@
 from collections import defaultdict
 
+from flask import abort, request
 from flask_restx import Namespace, Resource
 from sqlalchemy import select
 
 from CTFd.cache import cache, make_cache_key
-from CTFd.models import Awards, Solves, Users, db
+from CTFd.models import Users, db
 from CTFd.utils import get_config
-from CTFd.utils.dates import isoformat, unix_time_to_utc
+from CTFd.utils.decorators import admins_only
 from CTFd.utils.decorators.visibility import (
     check_account_visibility,
     check_score_visibility,
 )
 from CTFd.utils.modes import TEAMS_MODE, generate_account_url, get_mode_as_word
-from CTFd.utils.scores import get_standings, get_user_standings
+from CTFd.utils.scores import get_standings, get_timelines, get_user_standings
+from CTFd.utils.scores.snapshots import (
+    diff_snapshot,
+    get_frozen_snapshot,
+    get_snapshot,
+    get_snapshot_times,
+)
 
 scoreboard_namespace = Namespace(
     "scoreboard", description="Endpoint to retrieve scores"
@@ -87,57 +94,59 @@ class ScoreboardDetail(Resource):
         response = {}
 
         standings = get_standings(count=count)
+        timelines = get_timelines([standing.account_id for standing in standings])
 
-        team_ids = [team.account_id for team in standings]
-
-        solves = Solves.query.filter(Solves.account_id.in_(team_ids))
-        awards = Awards.query.filter(Awards.account_id.in_(team_ids))
-
-        freeze = get_config("freeze")
-
-        if freeze:
-            solves = solves.filter(Solves.date < unix_time_to_utc(freeze))
-            awards = awards.filter(Awards.date < unix_time_to_utc(freeze))
-
-        solves = solves.all()
-        awards = awards.all()
-
-        # Build a mapping of accounts to their solves and awards
-        solves_mapper = defaultdict(list)
-        for solve in solves:
-            solves_mapper[solve.account_id].append(
-                {
-                    "challenge_id": solve.challenge_id,
-                    "account_id": solve.account_id,
-                    "team_id": solve.team_id,
-                    "user_id": solve.user_id,
-                    "value": solve.challenge.value,
-                    "date": isoformat(solve.date),
-                }
-            )
-
-        for award in awards:
-            solves_mapper[award.account_id].append(
-                {
-                    "challenge_id": None,
-                    "account_id": award.account_id,
-                    "team_id": award.team_id,
-                    "user_id": award.user_id,
-                    "value": award.value,
-                    "date": isoformat(award.date),
-                }
-            )
-
-        # Sort all solves by date
-        for team_id in solves_mapper:
-            solves_mapper[team_id] = sorted(
-                solves_mapper[team_id], key=lambda k: k["date"]
-            )
-
-        for i, _team in enumerate(team_ids):
+        for i, standing in enumerate(standings):
             response[i + 1] = {
-                "id": standings[i].account_id,
-                "name": standings[i].name,
-                "solves": solves_mapper.get(standings[i].account_id, []),
+                "id": standing.account_id,
+                "name": standing.name,
+                "solves": [
+                    {
+                        "challenge_id": challenge_id,
+                        "account_id": standing.account_id,
+                        "team_id": team_id,
+                        "user_id": user_id,
+                        "value": value,
+                        "date": date,
+                    }
+                    for challenge_id, user_id, team_id, value, date in timelines[
+                        standing.account_id
+                    ]
+                ],
             }
         return {"success": True, "data": response}
+
+
+@scoreboard_namespace.route("/snapshots")
+class ScoreboardSnapshotList(Resource):
+    @admins_only
+    def get(self):
+        return {
+            "success": True,
+            "data": {
+                "frozen": get_frozen_snapshot() is not None,
+                "snapshots": get_snapshot_times(),
+            },
+        }
+
+
+@scoreboard_namespace.route("/snapshots/diff")
+@scoreboard_namespace.param(
+    "snapshot",
+    "When the snapshot to compare against was taken, the frozen one if left out",
+)
+class ScoreboardSnapshotDiff(Resource):
+    @admins_only
+    def get(self):
+        taken = request.args.get("snapshot", type=int)
+        if taken is None:
+            snapshot = get_frozen_snapshot()
+        else:
+            snapshot = get_snapshot(taken)
+        if snapshot is None:
+            abort(404)
+
+        return {
+            "success": True,
+            "data": {"time": snapshot["time"], "diff": diff_snapshot(snapshot)},
+        }
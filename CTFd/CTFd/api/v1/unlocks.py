@@ -157,7 +157,7 @@ class UnlockList(Resource):
         award = award_schema.load(award)
         db.session.add(award.data)
         db.session.commit()
-        clear_standings()
+        clear_standings(rebuild=False)
 
         response = schema.dump(response.data)
 
@@ -1,5 +1,6 @@
 from functools import lru_cache, wraps
 from time import monotonic_ns
+from uuid import uuid4
 
 from flask import request
 from flask_caching import Cache, make_template_fragment_key
@@ -59,12 +60,15 @@ def clear_config():
     cache.delete_memoized(get_app_config)
 
 
-def clear_standings():
+def clear_standings(rebuild=True):
+    """
+    Drop every cached view of the standings.
+
+    :param rebuild: Also make the scoreboard engine rebuild from the database. Only pass False for
+    changes the engine catches up with on its own, i.e. new solves & awards and challenge value changes.
+    """
     from CTFd.models import Users, Teams
     from CTFd.constants.static import CacheKeys
-    from CTFd.utils.scores import get_standings, get_team_standings, get_user_standings
-    from CTFd.api.v1.scoreboard import ScoreboardDetail, ScoreboardList
-    from CTFd.api import api
     from CTFd.utils.user import (
         get_user_score,
         get_user_place,
@@ -72,10 +76,15 @@ def clear_standings():
         get_team_place,
     )
 
-    # Clear out the bulk standings functions
-    cache.delete_memoized(get_standings)
-    cache.delete_memoized(get_team_standings)
-    cache.delete_memoized(get_user_standings)
+    if rebuild:
+        from CTFd.utils.scores.snapshots import clear_frozen_snapshot
+
+        cache.set(CacheKeys.SCOREBOARD_GENERATION, uuid4().hex, timeout=0)
+        # Admin edits can change the frozen past as well
+        clear_frozen_snapshot()
+
+    # Clear out the bulk standings functions, responses and templates
+    _clear_rankings()
 
     # Clear out the individual helpers for accessing score via the model
     cache.delete_memoized(Users.get_score)
@@ -89,6 +98,19 @@ def clear_standings():
     cache.delete_memoized(get_team_score)
     cache.delete_memoized(get_team_place)
 
+
+def _clear_rankings():
+    from CTFd.constants.static import CacheKeys
+    from CTFd.utils.scores import get_standings, get_team_standings, get_user_standings
+    from CTFd.api.v1.scoreboard import ScoreboardDetail, ScoreboardList
+    from CTFd.api import api
+
+    # Clear out the bulk standings functions and the place indexes built from them
+    cache.delete_memoized(get_standings)
+    cache.delete_memoized(get_team_standings)
+    cache.delete_memoized(get_user_standings)
+    cache.set(CacheKeys.STANDINGS_VERSION, uuid4().hex, timeout=0)
+
     # Clear out HTTP request responses
     cache.delete(make_cache_key(path=api.name + "." + ScoreboardList.endpoint))
     cache.delete(make_cache_key(path=api.name + "." + ScoreboardDetail.endpoint))
@@ -98,6 +120,99 @@ def clear_standings():
     cache.delete(make_template_fragment_key(CacheKeys.PUBLIC_SCOREBOARD_TABLE))
 
 
+def clear_solve(user, challenge, team=None, value_changed=False):
+    """
+    Drop the cached data a new solve affects instead of everything clear_standings() and
+    clear_challenges() would: the solve lists and counts, the solved challenges of the solving
+    members, the score of the solving account and the places of the accounts it moved past.
+    The ranked lists always go.
+
+    :param value_changed: The solve changed the value of the challenge (e.g. a dynamic challenge),
+    which changes the score of everyone who solved it before as well.
+    """
+    if value_changed:
+        clear_standings(rebuild=False)
+        clear_challenges()
+        return
+
+    members = team.members if team is not None else [user]
+    _clear_rankings()
+    clear_solves(user_ids=[member.id for member in members])
+    clear_account_score(user, team=team)
+    clear_places(user, team=team)
+
+
+def clear_solves(user_ids=()):
+    from CTFd.utils.challenges import get_solves_for_challenge_id
+    from CTFd.utils.challenges import get_solve_ids_for_user_id
+    from CTFd.utils.challenges import get_solve_counts_for_challenges
+
+    # Callers pass freeze, admin and the challenge id in too many forms (config values, ids from
+    # URLs) to delete each key, and most of these change with any solve anyway
+    cache.delete_memoized(get_solves_for_challenge_id)
+    cache.delete_memoized(get_solve_counts_for_challenges)
+    for user_id in user_ids:
+        _delete_memoized_id(get_solve_ids_for_user_id, user_id=user_id)
+
+
+def _delete_memoized_id(f, **kwargs):
+    # Memoize keys tell 1 and "1" apart
+    ((name, id_),) = kwargs.items()
+    for key in {id_, str(id_)}:
+        cache.delete_memoized(f, **{name: key})
+
+
+def clear_account_score(user, team=None):
+    from CTFd.utils.user import get_user_score, get_team_score
+
+    # Bound methods drop the cached scores of the instance under any arguments
+    cache.delete_memoized(user.get_score)
+    _delete_memoized_id(get_user_score, user_id=user.id)
+
+    if team is not None:
+        cache.delete_memoized(team.get_score)
+        _delete_memoized_id(get_team_score, team_id=team.id)
+        # Members see the score of their team as their own
+        for member in team.members:
+            _delete_memoized_id(get_user_score, user_id=member.id)
+
+
+def clear_places(user, team=None, window=100):
+    """
+    Drop the places of the accounts whose place changed with the last change to the score of
+    user (and team). Past `window` accounts it's cheaper to drop every place.
+    """
+    from CTFd.models import Users, Teams
+    from CTFd.utils.modes import get_model
+    from CTFd.utils.scores.engine import get_engine
+    from CTFd.utils.user import get_user_place, get_team_place
+
+    engine = get_engine()
+    user_ids = engine.moved("users", user.id)
+    team_ids = engine.moved("teams", team.id) if team is not None else set()
+
+    if len(user_ids) + len(team_ids) > window:
+        cache.delete_memoized(Users.get_place)
+        cache.delete_memoized(Teams.get_place)
+        cache.delete_memoized(get_user_place)
+        cache.delete_memoized(get_team_place)
+        return
+
+    teams_mode = get_model() is Teams
+    if user_ids:
+        for u in Users.query.filter(Users.id.in_(user_ids)):
+            cache.delete_memoized(u.get_place)
+            if not teams_mode:
+                _delete_memoized_id(get_user_place, user_id=u.id)
+    if team_ids:
+        for t in Teams.query.filter(Teams.id.in_(team_ids)):
+            cache.delete_memoized(t.get_place)
+            _delete_memoized_id(get_team_place, team_id=t.id)
+            # Members see the place of their team as their own
+            for member in t.members:
+                _delete_memoized_id(get_user_place, user_id=member.id)
+
+
 def clear_challenges():
     from CTFd.utils.challenges import get_all_challenges
     from CTFd.utils.challenges import get_solves_for_challenge_id
@@ -4,6 +4,8 @@ from CTFd.constants import JinjaEnum, RawEnum
 @JinjaEnum
 class CacheKeys(str, RawEnum):
     PUBLIC_SCOREBOARD_TABLE = "public_scoreboard_table"
+    SCOREBOARD_GENERATION = "scoreboard_generation"
+    STANDINGS_VERSION = "standings_version"
 
 
 # Placeholder object. Not used, just imported to force initialization of any Enums here
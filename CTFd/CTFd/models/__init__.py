@@ -496,24 +496,21 @@ class Users(db.Model):
     @cache.memoize()
     def get_place(self, admin=False, numeric=False):
         """
-        This method is generally a clone of CTFd.scoreboard.get_standings.
-        The point being that models.py must be self-reliant and have little
+        Looks the place up in the place index built from the standings
+        (see CTFd.utils.scores.get_user_places).
+        It's imported here as models.py must be self-reliant and have little
         to no imports within the CTFd application as importing from the
         application itself will result in a circular import.
         """
-        from CTFd.utils.scores import get_user_standings
+        from CTFd.utils.scores import get_user_places
         from CTFd.utils.humanize.numbers import ordinalize
 
-        standings = get_user_standings(admin=admin)
-
-        for i, user in enumerate(standings):
-            if user.user_id == self.id:
-                n = i + 1
-                if numeric:
-                    return n
-                return ordinalize(n)
-        else:
+        n = get_user_places(admin=admin).get(self.id)
+        if n is None:
             return None
+        if numeric:
+            return n
+        return ordinalize(n)
 
 
 class Admins(Users):
@@ -731,24 +728,21 @@ class Teams(db.Model):
     @cache.memoize()
     def get_place(self, admin=False, numeric=False):
         """
-        This method is generally a clone of CTFd.scoreboard.get_standings.
-        The point being that models.py must be self-reliant and have little
+        Looks the place up in the place index built from the standings
+        (see CTFd.utils.scores.get_team_places).
+        It's imported here as models.py must be self-reliant and have little
         to no imports within the CTFd application as importing from the
         application itself will result in a circular import.
         """
-        from CTFd.utils.scores import get_team_standings
+        from CTFd.utils.scores import get_team_places
         from CTFd.utils.humanize.numbers import ordinalize
 
-        standings = get_team_standings(admin=admin)
-
-        for i, team in enumerate(standings):
-            if team.team_id == self.id:
-                n = i + 1
-                if numeric:
-                    return n
-                return ordinalize(n)
-        else:
+        n = get_team_places(admin=admin).get(self.id)
+        if n is None:
             return None
+        if numeric:
+            return n
+        return ordinalize(n)
 
 
 class Submissions(db.Model):
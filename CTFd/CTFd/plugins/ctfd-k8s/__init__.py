@@ -1,8 +1,9 @@
-import fcntl
+import hmac
+import traceback
 import warnings
 
 import requests
-from flask import Blueprint, render_template, session, current_app, request
+from flask import Blueprint, Response, abort, render_template, session, current_app, request
 from flask_apscheduler import APScheduler
 
 from CTFd.api import CTFd_API_v1
@@ -11,25 +12,41 @@ from CTFd.plugins import (
     register_admin_plugin_menu_bar,
 )
 from CTFd.plugins.challenges import CHALLENGE_CLASSES
+from CTFd.plugins.migrations import upgrade
 from CTFd.utils import get_config, set_config
 from CTFd.utils.decorators import admins_only
+from CTFd.utils.user import is_admin
 
 from .api import user_namespace, admin_namespace, AdminContainers
 from .challenge_type import DynamicValueKubernetesChallenge, DynamicKubernetesChallenge
+from .models import ContainerStatus
+from .utils.balloon import Balloon
+from .utils.capacity import Capacity
 from .utils.checks import KubernetesChecks
 from .utils.control import ControlUtil
-from .utils.db import DBContainer
+from .utils.instance_cache import InstanceCache
 from .utils.kubernetes import KubernetesUtils
+from .utils.db import DBContainer
+from .utils.leader import LeaderElection
+from .utils.metrics import Metrics
+from .utils.prepull import Prepull
+from .utils.provision import ProvisionQueue
+from .utils.quota import Quota
+from .utils.readiness import ReadinessTracker
+from .utils.reaper import Reaper
+from .utils.reconciler import Reconciler
 from .utils.exceptions import KubernetesWarning
 from .utils.setup import setup_default_configs
+from .utils.shared import SharedInstance
 from .utils.routers import Router
 
 
 def load(app):
-    # upgrade()
     plugin_name = __name__.split('.')[-1]
     set_config('kubernetes:plugin_name', plugin_name)
     app.db.create_all()
+    # create_all() doesn't add the columns newer releases added to existing tables
+    upgrade(plugin_name=plugin_name)
     if not get_config("kubernetes:setup"):
         setup_default_configs()
 
@@ -76,7 +93,13 @@ def load(app):
             KubernetesUtils.init()
             Router.reset()
             set_config("kubernetes:refresh", "false")
-        return render_template('kubernetes_config.html', errors=errors)
+        prepull, prepull_error = [], None
+        try:
+            prepull = Prepull.get_status()
+        except Exception as e:
+            prepull_error = str(e)
+        return render_template('kubernetes_config.html', errors=errors,
+                               prepull=prepull, prepull_error=prepull_error)
 
     @page_blueprint.route("/admin/containers")
     @admins_only
@@ -89,35 +112,154 @@ def load(app):
                                containers=result['data']['containers'],
                                pages=result['data']['pages'],
                                curr_page=abs(request.args.get("page", 1, type=int)),
-                               curr_page_start=result['data']['page_start'])
+                               curr_page_start=result['data']['page_start'],
+                               reaper=result['data']['reaper'],
+                               reconciler=result['data']['reconciler'])
+
+    @page_blueprint.route("/metrics")
+    def metrics():
+        # prometheus can't log in, so it presents the configured token instead
+        token = get_config("kubernetes:metrics_token")
+        authorization = request.headers.get("Authorization", "")
+        if not is_admin() and not (token and hmac.compare_digest(authorization, f"Bearer {token}")):
+            abort(403)
+        gauges = [
+            ("ctfd_kubernetes_instances", {
+                "challenge": challenge_id,
+                "status": "warm" if pool else ContainerStatus.names.get(status, status),
+            }, count)
+            for (challenge_id, status, pool), count in DBContainer.get_status_counts().items()
+        ]
+        stats = Reaper.get_stats()
+        if stats:
+            gauges.append(("ctfd_kubernetes_reaper_lag_seconds", {}, stats["lag"]))
+            gauges.append(("ctfd_kubernetes_reaper_duration_seconds", {}, stats["duration"]))
+        stats = Reconciler.get_stats()
+        if stats:
+            gauges.append(("ctfd_kubernetes_drift", {"kind": "orphan"}, stats["orphans"]))
+            gauges.append(("ctfd_kubernetes_drift", {"kind": "dead"}, stats["dead"]))
+        return Response(Metrics.render(gauges), mimetype="text/plain; version=0.0.4")
 
     def auto_clean_container():
+        if not LeaderElection.is_leader():
+            return
+        with app.app_context():
+            Reaper.run()
+            ControlUtil.admit_queued()
+
+    def replenish_warm_pools():
+        if not LeaderElection.is_leader():
+            return
+        with app.app_context():
+            ControlUtil.replenish_warm_pools()
+
+    def admit_queued():
+        if not LeaderElection.is_leader():
+            return
+        with app.app_context():
+            ControlUtil.admit_queued()
+
+    def scale_shared():
+        if not LeaderElection.is_leader():
+            return
+        with app.app_context():
+            SharedInstance.scale_all()
+
+    def sync_prepull():
+        if not LeaderElection.is_leader():
+            return
+        with app.app_context():
+            try:
+                Prepull.sync()
+            except Exception:
+                print(traceback.format_exc())
+
+    def refresh_capacity():
+        if not LeaderElection.is_leader():
+            return
+        with app.app_context():
+            try:
+                Capacity.refresh_reserved()
+            except Exception:
+                print(traceback.format_exc())
+
+    def inflate_balloons():
+        if not LeaderElection.is_leader():
+            return
         with app.app_context():
-            results = DBContainer.get_all_expired_container()
-            for r in results:
-                ControlUtil.try_remove_container(r.user_id)
+            try:
+                Balloon.run()
+            except Exception:
+                print(traceback.format_exc())
+
+    def reconcile_instances():
+        if not LeaderElection.is_leader():
+            return
+        with app.app_context():
+            Reconciler.run()
+
+    def reconcile_quota():
+        if not LeaderElection.is_leader():
+            return
+        with app.app_context():
+            Quota.reconcile()
 
     app.register_blueprint(page_blueprint)
 
+    ProvisionQueue.init(app, int(get_config("kubernetes:provision_concurrency", 8)))
+    ReadinessTracker.init(ControlUtil.complete_container, ControlUtil.fail_container)
+    Quota.init(app)
+    Metrics.init(app)
+    Capacity.init(app)
+    Balloon.init(app)
+    InstanceCache.init()
+
     try:
         Router.check_availability()
         KubernetesUtils.init()
     except Exception:
         warnings.warn("Initialization Failed. Please check your configs.", KubernetesWarning)
 
-    try:
-        lock_file = open("/tmp/ctfd_kubernetes.lock", "w")
-        lock_fd = lock_file.fileno()
-        fcntl.lockf(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
-
-        scheduler = APScheduler()
-        scheduler.init_app(app)
-        scheduler.start()
-        scheduler.add_job(
-            id='kubernetes-auto-clean', func=auto_clean_container,
-            trigger="interval", seconds=10
-        )
-
-        print("[CTFd Kubernetes] Started successfully")
-    except IOError:
-        pass
+    # every process schedules the jobs, but only the elected leader runs them
+    LeaderElection.init(app)
+    scheduler = APScheduler()
+    scheduler.init_app(app)
+    scheduler.start()
+    scheduler.add_job(
+        id='kubernetes-auto-clean', func=auto_clean_container,
+        trigger="interval", seconds=10
+    )
+    scheduler.add_job(
+        id='kubernetes-warm-pool', func=replenish_warm_pools,
+        trigger="interval", seconds=10
+    )
+    scheduler.add_job(
+        id='kubernetes-admission', func=admit_queued,
+        trigger="interval", seconds=5
+    )
+    scheduler.add_job(
+        id='kubernetes-shared-scale', func=scale_shared,
+        trigger="interval", seconds=30
+    )
+    scheduler.add_job(
+        id='kubernetes-prepull', func=sync_prepull,
+        trigger="interval", seconds=300
+    )
+    scheduler.add_job(
+        id='kubernetes-capacity', func=refresh_capacity,
+        trigger="interval", seconds=30
+    )
+    scheduler.add_job(
+        id='kubernetes-balloon', func=inflate_balloons,
+        trigger="interval", seconds=60
+    )
+    scheduler.add_job(
+        id='kubernetes-reconcile', func=reconcile_instances,
+        trigger="interval", seconds=60
+    )
+    scheduler.add_job(
+        id='kubernetes-quota-reconcile', func=reconcile_quota,
+        trigger="interval", seconds=60
+    )
+
+    print("[CTFd Kubernetes] Started successfully")
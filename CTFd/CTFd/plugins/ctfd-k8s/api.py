@@ -8,9 +8,13 @@ from CTFd.utils import user as current_user
 from CTFd.utils.decorators import admins_only, authed_only
 
 from .decorators import challenge_visible, frequency_limited
+from .models import ContainerStatus
+from .utils.bulk import BulkOperation
 from .utils.control import ControlUtil
 from .utils.db import DBContainer
-from .utils.routers import Router
+from .utils.instance_cache import InstanceCache
+from .utils.reaper import Reaper
+from .utils.reconciler import Reconciler
 
 admin_namespace = Namespace("ctfd-kubernetes-admin")
 user_namespace = Namespace("ctfd-kubernetes-user")
@@ -44,6 +48,8 @@ class AdminContainers(Resource):
             'total': count,
             'pages': int(count / results_per_page) + (count % results_per_page > 0),
             'page_start': page_start,
+            'reaper': Reaper.get_stats(),
+            'reconciler': Reconciler.get_stats(),
         }}
 
     @staticmethod
@@ -63,6 +69,38 @@ class AdminContainers(Resource):
         return {'success': result, 'message': message}
 
 
+@admin_namespace.route('/container/bulk')
+class AdminBulkContainers(Resource):
+    @staticmethod
+    @admins_only
+    def get():
+        job = BulkOperation.get(request.args.get('job_id'))
+        if job is None:
+            abort(404, 'No such job', success=False)
+        return {'success': True, 'data': job}
+
+    @staticmethod
+    @admins_only
+    def post():
+        data = request.get_json() or {}
+        action = data.get('action')
+        if action not in BulkOperation.actions:
+            abort(400, f'Unknown action {action}', success=False)
+        try:
+            filters = {
+                'challenge_id': int(data['challenge_id']) if data.get('challenge_id') else None,
+                'user_ids': [int(i) for i in data['user_ids']] if data.get('user_ids') is not None else None,
+                'older_than': int(data['older_than']) if data.get('older_than') else None,
+                'node': data.get('node') or None,
+            }
+        except (TypeError, ValueError):
+            abort(400, 'Invalid filter', success=False)
+        if not any(v is not None for v in filters.values()):
+            abort(400, 'At least one filter is required', success=False)
+        job = BulkOperation.start(action, **filters)
+        return {'success': True, 'data': job}
+
+
 @user_namespace.route("/container")
 class UserContainers(Resource):
     @staticmethod
@@ -71,19 +109,23 @@ class UserContainers(Resource):
     def get():
         user_id = current_user.get_current_user().id
         challenge_id = request.args.get('challenge_id')
-        container = DBContainer.get_current_containers(user_id=user_id)
+        container = InstanceCache.get_instance(user_id)
         if not container:
             return {'success': True, 'data': {}}
         timeout = int(get_config("kubernetes:docker_timeout", "3600"))
-        if int(container.challenge_id) != int(challenge_id):
-            return abort(403, f'Container started but not from this challenge ({container.challenge.name})', success=False)
-        return {
-            'success': True,
-            'data': {
-                'user_access': Router.access(container),
-                'remaining_time': timeout - (datetime.now() - container.start_time).seconds,
-            }
+        if int(container['challenge_id']) != int(challenge_id):
+            return abort(403, f'Container started but not from this challenge ({container["challenge_name"]})', success=False)
+        data = {
+            'status': ContainerStatus.names[container['status']],
+            'remaining_time': timeout - (datetime.now() - container['start_time']).seconds,
         }
+        if container['status'] == ContainerStatus.READY:
+            data['user_access'] = InstanceCache.get_access(container)
+        elif container['status'] == ContainerStatus.FAILED:
+            data['message'] = container['message']
+        elif container['status'] == ContainerStatus.QUEUED:
+            data['queue_position'] = DBContainer.get_queue_position(container['id'])
+        return {'success': True, 'data': data}
 
     @staticmethod
     @authed_only
@@ -93,10 +135,6 @@ class UserContainers(Resource):
         user_id = current_user.get_current_user().id
         ControlUtil.try_remove_container(user_id)
 
-        current_count = DBContainer.get_all_alive_container_count()
-        if int(get_config("kubernetes:docker_max_container_count")) <= int(current_count):
-            abort(403, 'Max container count exceed.', success=False)
-
         challenge_id = request.args.get('challenge_id')
         result, message = ControlUtil.try_add_container(
             user_id=user_id,
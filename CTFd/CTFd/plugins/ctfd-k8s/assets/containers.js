@@ -57,30 +57,92 @@ async function renew_container(user_id) {
     return response.success;
 }
 
-$('#containers-renew-button').click(function (e) {
-    let users = $("input[data-user-id]:checked").map(function () {
-        return $(this).data("user-id");
+async function bulk_action(action, filters) {
+    let response = await CTFd.fetch("/api/v1/plugins/ctfd-kubernetes/admin/container/bulk", {
+        method: "POST",
+        credentials: "same-origin",
+        headers: {
+            Accept: "application/json",
+            "Content-Type": "application/json"
+        },
+        body: JSON.stringify(Object.assign({action: action}, filters))
     });
+    response = await response.json();
+    if (!response.success) {
+        CTFd.ui.ezq.ezAlert({title: "Fail", body: response.message, button: "OK"});
+        return;
+    }
+    let job = response.data;
+    let pg = CTFd.ui.ezq.ezProgressBar({width: 0, title: `${action} ${job.total} container(s)`});
+    while (!job.finished) {
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+        response = await CTFd.fetch(
+            "/api/v1/plugins/ctfd-kubernetes/admin/container/bulk?job_id=" + job.id, {
+            method: "GET",
+            credentials: "same-origin",
+            headers: {
+                Accept: "application/json",
+                "Content-Type": "application/json"
+            }
+        });
+        job = (await response.json()).data;
+        CTFd.ui.ezq.ezProgressBar({target: pg, width: job.total ? job.done / job.total * 100 : 100});
+    }
+    location.reload();
+}
+
+function selected_users() {
+    return $("input[data-user-id]:checked").map(function () {
+        return $(this).data("user-id");
+    }).toArray();
+}
+
+function bulk_filters() {
+    return {
+        challenge_id: $("#bulk-challenge-id").val(),
+        older_than: $("#bulk-older-than").val(),
+        node: $("#bulk-node").val()
+    };
+}
+
+$('#containers-renew-button').click(function (e) {
+    let users = selected_users();
     CTFd.ui.ezq.ezQuery({
         title: "Renew Containers",
         body: `Are you sure you want to renew the selected ${users.length} container(s)?`,
-        success: async function () {
-            await Promise.all(users.toArray().map((user) => renew_container(user)));
-            location.reload();
+        success: function () {
+            bulk_action("renew", {user_ids: users});
         }
     });
 });
 
 $('#containers-delete-button').click(function (e) {
-    let users = $("input[data-user-id]:checked").map(function () {
-        return $(this).data("user-id");
-    });
+    let users = selected_users();
     CTFd.ui.ezq.ezQuery({
         title: "Delete Containers",
         body: `Are you sure you want to delete the selected ${users.length} container(s)?`,
-        success: async function () {
-            await Promise.all(users.toArray().map((user) => delete_container(user)));
-            location.reload();
+        success: function () {
+            bulk_action("destroy", {user_ids: users});
+        }
+    });
+});
+
+$('#bulk-renew-button').click(function (e) {
+    CTFd.ui.ezq.ezQuery({
+        title: "Renew Containers",
+        body: "Are you sure you want to renew every container matching the filter?",
+        success: function () {
+            bulk_action("renew", bulk_filters());
+        }
+    });
+});
+
+$('#bulk-delete-button').click(function (e) {
+    CTFd.ui.ezq.ezQuery({
+        title: "Delete Containers",
+        body: "Are you sure you want to delete every container matching the filter?",
+        success: function () {
+            bulk_action("destroy", bulk_filters());
         }
     });
 });
@@ -41,6 +41,7 @@ function loadInfo() {
     }).then(function (response) {
         if (window.t !== undefined) {
             clearInterval(window.t);
+            clearTimeout(window.t);
             window.t = undefined;
         }
         if (response.success) response = response.data;
@@ -49,16 +50,37 @@ function loadInfo() {
             body: response.message,
             button: "OK"
         });
-        if (response.remaining_time === undefined) {
+        if (response.remaining_time === undefined || response.status === 'failed') {
             $('#kubernetes-panel').html('<div class="card" style="width: 100%;">' +
                 '<div class="card-body">' +
                 '<h5 class="card-title">Instance Info</h5>' +
+                '<p id="kubernetes-failed-message" class="card-text text-danger"></p>' +
                 '<button type="button" class="btn btn-primary card-link" id="kubernetes-button-boot" ' +
                 '        onclick="CTFd._internal.challenge.boot()">' +
                 'Launch an instance' +
                 '</button>' +
                 '</div>' +
                 '</div>');
+            if (response.status === 'failed') {
+                $('#kubernetes-failed-message').text('Failed to launch your instance: ' + response.message);
+            }
+        } else if (response.status === 'pending' || response.status === 'scheduling' || response.status === 'queued') {
+            const waiting = response.status === 'queued'
+                ? `The cluster is full, your instance is number ${response.queue_position} in the queue...`
+                : 'Your instance is being created, please wait...';
+            $('#kubernetes-panel').html(
+                `<div class="card" style="width: 100%;">
+                    <div class="card-body">
+                        <h5 class="card-title">Instance Info</h5>
+                        <p class="card-text">${waiting}</p>
+                        <button type="button" class="btn btn-danger card-link" id="kubernetes-button-destroy"
+                                onclick="CTFd._internal.challenge.destroy()">
+                            Cancel
+                        </button>
+                    </div>
+                </div>`
+            );
+            window.t = setTimeout(loadInfo, 3000);
         } else {
             $('#kubernetes-panel').html(
                 `<div class="card" style="width: 100%;">
@@ -223,7 +245,7 @@ CTFd._internal.challenge.boot = function () {
             loadInfo();
             CTFd.ui.ezq.ezAlert({
                 title: "Success",
-                body: "Your instance has been deployed!",
+                body: "Your instance is being deployed!",
                 button: "OK"
             });
         } else {
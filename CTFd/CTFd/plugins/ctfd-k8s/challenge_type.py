@@ -1,4 +1,8 @@
+import hmac
+import traceback
+
 from flask import Blueprint
+from flask_restx import abort
 
 from CTFd.models import (
     db,
@@ -10,6 +14,13 @@ from CTFd.plugins.flags import get_flag_class
 from CTFd.utils import user as current_user
 from .models import KubernetesContainer, DynamicKubernetesChallenge
 from .utils.control import ControlUtil
+from .utils.db import forget_instances
+from .utils.exceptions import KubernetesError
+from .utils.prepull import Prepull
+from .utils.provision import ProvisionQueue
+from .utils.routers import Router
+from .utils.shared import SharedInstance
+from .utils.template import CompiledTemplate, TemplateCache
 
 
 class DynamicValueKubernetesChallenge(BaseChallenge):
@@ -24,6 +35,31 @@ class DynamicValueKubernetesChallenge(BaseChallenge):
     )
     challenge_model = DynamicKubernetesChallenge
 
+    @staticmethod
+    def validate_template(data, challenge=None):
+        if not {"kubernetes_config", "warm_pool_size", "shared"} & set(data):
+            return
+        source = data.get("kubernetes_config", challenge.kubernetes_config if challenge else "")
+        try:
+            template = CompiledTemplate(source)
+        except KubernetesError as e:
+            abort(400, e.message, success=False)
+        if int(data.get("warm_pool_size") or 0) > 0 and not template.can_relabel:
+            abort(400, "Warm pools need a template of Pods, Services, ConfigMaps and Secrets "
+                       "which only uses {id} in labels, annotations and selectors", success=False)
+        shared = data.get("shared", challenge.shared if challenge else 0)
+        if int(shared or 0) and not template.can_share:
+            abort(400, "Shared challenges need exactly one apps/v1 Deployment "
+                       "whose pod template is labelled with chal-id: {id}", success=False)
+
+    @classmethod
+    def create(cls, request):
+        data = request.form or request.get_json()
+        cls.validate_template(data)
+        challenge = super().create(request)
+        ProvisionQueue.submit(Prepull.sync)
+        return challenge
+
     @classmethod
     def read(cls, challenge):
         challenge = DynamicKubernetesChallenge.query.filter_by(id=challenge.id).first()
@@ -51,17 +87,37 @@ class DynamicValueKubernetesChallenge(BaseChallenge):
     @classmethod
     def update(cls, challenge, request):
         data = request.form or request.get_json()
+        cls.validate_template(data, challenge)
+        was_shared = challenge.shared
+        TemplateCache.invalidate(challenge.id)
+        if "connection_format" in data:
+            containers = KubernetesContainer.query.filter_by(challenge_id=challenge.id).all()
+            forget_instances(uuids=[c.uuid for c in containers])
 
         for attr, value in data.items():
             # We need to set these to floats so that the next operations don't operate on strings
             if attr in ("initial", "minimum", "decay"):
                 value = float(value)
+            if attr in ("warm_pool_size", "max_instances", "shared",
+                        "shared_users_per_replica", "shared_max_replicas"):
+                value = int(value or 0)
             setattr(challenge, attr, value)
 
-        if challenge.dynamic_score == 1:
-            return DynamicValueChallenge.calculate_value(challenge)
+        try:
+            if was_shared and not challenge.shared:
+                SharedInstance.teardown(challenge, Router.kinds)
+            elif challenge.shared and SharedInstance.get_replicas(challenge.id):
+                # roll the running deployment over to the new template
+                SharedInstance.apply(challenge, SharedInstance.get_replicas(challenge.id))
+        except Exception:
+            print(traceback.format_exc())
 
-        db.session.commit()
+        if challenge.dynamic_score == 1:
+            challenge = DynamicValueChallenge.calculate_value(challenge)
+        else:
+            db.session.commit()
+        # state and template decide which images the nodes should hold
+        ProvisionQueue.submit(Prepull.sync)
         return challenge
 
     @classmethod
@@ -76,6 +132,12 @@ class DynamicValueKubernetesChallenge(BaseChallenge):
                 if get_flag_class(flag.type).compare(flag, submission):
                     return True, "Correct"
             return False, "Incorrect"
+        elif challenge.shared:
+            # per-player flags are derived, so they stay valid after the session is gone
+            user_id = current_user.get_current_user().id
+            if hmac.compare_digest(SharedInstance.flag_for(challenge.id, user_id), submission):
+                return True, "Correct"
+            return False, "Incorrect"
         else:
             user_id = current_user.get_current_user().id
             q = db.session.query(KubernetesContainer)
@@ -104,6 +166,13 @@ class DynamicValueKubernetesChallenge(BaseChallenge):
         for container in KubernetesContainer.query.filter_by(
             challenge_id=challenge.id
         ).all():
-            ControlUtil.try_remove_container(container.user_id)
+            ControlUtil.destroy_container(container)
+        if challenge.shared:
+            try:
+                SharedInstance.teardown(challenge, Router.kinds)
+            except Exception:
+                print(traceback.format_exc())
+        TemplateCache.invalidate(challenge.id)
         super().delete(challenge)
+        ProvisionQueue.submit(Prepull.sync)
 
@@ -0,0 +1,133 @@
+"""TCP gateway for ctfd-k8s instances.
+
+Players connect to one of two ports and name their instance by its route token:
+
+- on the plain port, the first line sent is "<token>" or "<token>.<domain>",
+  e.g. ``(echo host; cat) | nc host 31337``
+- on the TLS port the token is the first label of the SNI hostname,
+  e.g. ``ncat --ssl host 31338``; TLS is terminated here
+
+The token is looked up in the redis hash the plugin's gateway router maintains
+and the connection is spliced to the instance's service. Only the redis package
+is needed next to the standard library.
+"""
+import asyncio
+import logging
+import os
+import ssl
+import weakref
+
+import redis
+
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379")
+ROUTES_KEY = os.environ.get("ROUTES_KEY", "ctfd_kubernetes-gateway-routes")
+LISTEN_HOST = os.environ.get("LISTEN_HOST", "0.0.0.0")
+PLAIN_PORT = int(os.environ.get("PLAIN_PORT", "31337"))
+TLS_PORT = int(os.environ.get("TLS_PORT", "0"))
+TLS_CERT = os.environ.get("TLS_CERT", "")
+TLS_KEY = os.environ.get("TLS_KEY", "")
+HANDSHAKE_TIMEOUT = float(os.environ.get("HANDSHAKE_TIMEOUT", "10"))
+CONNECT_TIMEOUT = float(os.environ.get("CONNECT_TIMEOUT", "5"))
+BUFFER_SIZE = 65536
+
+log = logging.getLogger("gateway")
+
+
+class Gateway:
+    def __init__(self, lookup):
+        self.lookup = lookup
+        self.server_names = weakref.WeakKeyDictionary()
+
+    async def resolve(self, name):
+        token = name.strip().split(".", 1)[0].lower()
+        if not token or not token.isalnum():
+            return None
+        # redis-py is blocking, keep it off the event loop
+        target = await asyncio.get_running_loop().run_in_executor(None, self.lookup, token)
+        if not target:
+            return None
+        host, _, port = target.rpartition(":")
+        return host, int(port)
+
+    async def handle_plain(self, reader, writer):
+        try:
+            line = await asyncio.wait_for(reader.readuntil(b"\n"), HANDSHAKE_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            writer.close()
+            return
+        await self.forward(line.decode(errors="replace"), reader, writer)
+
+    async def handle_tls(self, reader, writer):
+        ssl_object = writer.get_extra_info("ssl_object")
+        await self.forward(self.server_names.pop(ssl_object, None) or "", reader, writer)
+
+    def sni_callback(self, ssl_object, server_name, context):
+        self.server_names[ssl_object] = server_name or ""
+
+    async def forward(self, name, reader, writer):
+        peer = writer.get_extra_info("peername")
+        try:
+            target = await self.resolve(name)
+        except Exception:
+            log.exception("route lookup failed")
+            target = None
+        if target is None:
+            writer.write(b"no such instance\n")
+            await self.close(writer)
+            return
+        try:
+            upstream_reader, upstream_writer = await asyncio.wait_for(
+                asyncio.open_connection(*target), CONNECT_TIMEOUT
+            )
+        except (OSError, asyncio.TimeoutError):
+            writer.write(b"instance unreachable\n")
+            await self.close(writer)
+            return
+        log.info("%s -> %s:%s", peer, *target)
+        await asyncio.gather(
+            self.pipe(reader, upstream_writer),
+            self.pipe(upstream_reader, writer),
+        )
+
+    async def pipe(self, reader, writer):
+        try:
+            while True:
+                data = await reader.read(BUFFER_SIZE)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            await self.close(writer)
+
+    @staticmethod
+    async def close(writer):
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+    async def serve(self):
+        servers = [await asyncio.start_server(self.handle_plain, LISTEN_HOST, PLAIN_PORT)]
+        if TLS_PORT:
+            context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            context.load_cert_chain(TLS_CERT, TLS_KEY)
+            context.sni_callback = self.sni_callback
+            servers.append(await asyncio.start_server(
+                self.handle_tls, LISTEN_HOST, TLS_PORT, ssl=context
+            ))
+        log.info("listening on %s", ", ".join(str(s.sockets[0].getsockname()) for s in servers))
+        await asyncio.gather(*(s.serve_forever() for s in servers))
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+    asyncio.run(Gateway(lambda token: client.hget(ROUTES_KEY, token)).serve())
+
+
+if __name__ == "__main__":
+    main()
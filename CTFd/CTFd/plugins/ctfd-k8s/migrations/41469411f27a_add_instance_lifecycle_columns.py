@@ -0,0 +1,44 @@
+"""Add instance lifecycle columns
+
+Revision ID: 41469411f27a
+Revises:
+Create Date: 2026-10-18 12:04:11.218830
+
+"""
+
+import sqlalchemy as sa
+
+from CTFd.plugins.migrations import get_all_tables, get_columns_for_table
+
+# revision identifiers, used by Alembic.
+revision = "41469411f27a"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def get_columns():
+    # table -> columns added to it after the first release, with their defaults for existing rows
+    return {
+        "kubernetes_container": [
+            sa.Column("message", sa.Text(), nullable=True),
+            sa.Column("status_time", sa.DateTime(), nullable=True),
+        ],
+    }
+
+
+def upgrade(op=None):
+    tables = get_all_tables(op)
+    for table, columns in get_columns().items():
+        if table not in tables:
+            continue  # created with every column by create_all()
+        existing = get_columns_for_table(op, table, names_only=True)
+        for column in columns:
+            if column.name not in existing:
+                op.add_column(table, column)
+
+
+def downgrade(op=None):
+    for table, columns in get_columns().items():
+        for column in columns:
+            op.drop_column(table, column.name)
@@ -0,0 +1,43 @@
+"""Add the instance limit of a challenge
+
+Revision ID: 5c0e8f61d2a4
+Revises: b7d3e2a90c15
+Create Date: 2026-10-18 12:08:19.044862
+
+"""
+
+import sqlalchemy as sa
+
+from CTFd.plugins.migrations import get_all_tables, get_columns_for_table
+
+# revision identifiers, used by Alembic.
+revision = "5c0e8f61d2a4"
+down_revision = "b7d3e2a90c15"
+branch_labels = None
+depends_on = None
+
+
+def get_columns():
+    # table -> columns added to it after the first release, with their defaults for existing rows
+    return {
+        "dynamic_kubernetes_challenge": [
+            sa.Column("max_instances", sa.Integer(), nullable=True, server_default="0"),
+        ],
+    }
+
+
+def upgrade(op=None):
+    tables = get_all_tables(op)
+    for table, columns in get_columns().items():
+        if table not in tables:
+            continue  # created with every column by create_all()
+        existing = get_columns_for_table(op, table, names_only=True)
+        for column in columns:
+            if column.name not in existing:
+                op.add_column(table, column)
+
+
+def downgrade(op=None):
+    for table, columns in get_columns().items():
+        for column in columns:
+            op.drop_column(table, column.name)
@@ -0,0 +1,57 @@
+"""Add shared instance columns
+
+Revision ID: 9f2b6d0a4e73
+Revises: e1a94c7b3f28
+Create Date: 2026-10-18 12:11:30.918455
+
+"""
+
+import sqlalchemy as sa
+
+from CTFd.plugins.migrations import get_all_tables, get_columns_for_table
+
+# revision identifiers, used by Alembic.
+revision = "9f2b6d0a4e73"
+down_revision = "e1a94c7b3f28"
+branch_labels = None
+depends_on = None
+
+
+def get_columns():
+    # table -> columns added to it after the first release, with their defaults for existing rows
+    return {
+        "kubernetes_container": [
+            sa.Column(
+                "shared", sa.Boolean(), nullable=False, server_default=sa.false()
+            ),
+        ],
+        "dynamic_kubernetes_challenge": [
+            sa.Column("shared", sa.Integer(), nullable=True, server_default="0"),
+            sa.Column(
+                "shared_users_per_replica",
+                sa.Integer(),
+                nullable=True,
+                server_default="50",
+            ),
+            sa.Column(
+                "shared_max_replicas", sa.Integer(), nullable=True, server_default="10"
+            ),
+        ],
+    }
+
+
+def upgrade(op=None):
+    tables = get_all_tables(op)
+    for table, columns in get_columns().items():
+        if table not in tables:
+            continue  # created with every column by create_all()
+        existing = get_columns_for_table(op, table, names_only=True)
+        for column in columns:
+            if column.name not in existing:
+                op.add_column(table, column)
+
+
+def downgrade(op=None):
+    for table, columns in get_columns().items():
+        for column in columns:
+            op.drop_column(table, column.name)
@@ -0,0 +1,43 @@
+"""Add the namespace of an instance
+
+Revision ID: e1a94c7b3f28
+Revises: 5c0e8f61d2a4
+Create Date: 2026-10-18 12:09:57.671203
+
+"""
+
+import sqlalchemy as sa
+
+from CTFd.plugins.migrations import get_all_tables, get_columns_for_table
+
+# revision identifiers, used by Alembic.
+revision = "e1a94c7b3f28"
+down_revision = "5c0e8f61d2a4"
+branch_labels = None
+depends_on = None
+
+
+def get_columns():
+    # table -> columns added to it after the first release, with their defaults for existing rows
+    return {
+        "kubernetes_container": [
+            sa.Column("namespace", sa.String(length=253), nullable=True),
+        ],
+    }
+
+
+def upgrade(op=None):
+    tables = get_all_tables(op)
+    for table, columns in get_columns().items():
+        if table not in tables:
+            continue  # created with every column by create_all()
+        existing = get_columns_for_table(op, table, names_only=True)
+        for column in columns:
+            if column.name not in existing:
+                op.add_column(table, column)
+
+
+def downgrade(op=None):
+    for table, columns in get_columns().items():
+        for column in columns:
+            op.drop_column(table, column.name)
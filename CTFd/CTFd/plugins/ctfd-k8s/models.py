@@ -8,6 +8,20 @@ from CTFd.utils import get_config
 from CTFd.models import db, Challenges
 
 
+class ContainerStatus:
+    READY = 1
+    PENDING = 2  # queued, manifests not applied yet
+    FAILED = 3
+    SCHEDULING = 4  # applied, waiting for the pod to run on a node with an address
+    QUEUED = 5  # waiting for cluster capacity
+    DRAINING = 6  # warm pool instance taken out of the pool, being torn down
+
+    names = {
+        READY: "ready", PENDING: "pending", FAILED: "failed",
+        SCHEDULING: "scheduling", QUEUED: "queued", DRAINING: "draining",
+    }
+
+
 class KubernetesConfig(db.Model):
     key = db.Column(db.String(length=128), primary_key=True)
     value = db.Column(db.Text)
@@ -44,6 +58,11 @@ class DynamicKubernetesChallenge(Challenges):
     memory_limit = db.Column(db.Text, default="128m")
     cpu_limit = db.Column(db.Float, default=0.5)
     dynamic_score = db.Column(db.Integer, default=0)
+    warm_pool_size = db.Column(db.Integer, default=0)
+    max_instances = db.Column(db.Integer, default=0)
+    shared = db.Column(db.Integer, default=0)
+    shared_users_per_replica = db.Column(db.Integer, default=50)
+    shared_max_replicas = db.Column(db.Integer, default=10)
 
     kubernetes_config = db.Column(db.Text, default=0)
     connection_format = db.Column(db.Text, default="nc {host} {port}")
@@ -59,8 +78,12 @@ class KubernetesContainer(db.Model):
     start_time = db.Column(db.DateTime, nullable=False,
                            default=datetime.utcnow)
     renew_count = db.Column(db.Integer, nullable=False, default=0)
-    status = db.Column(db.Integer, default=1)
+    status = db.Column(db.Integer, default=ContainerStatus.READY)
+    message = db.Column(db.Text, nullable=True)
+    status_time = db.Column(db.DateTime, nullable=True)
     uuid = db.Column(db.String(256))
+    namespace = db.Column(db.String(253), nullable=True)
+    shared = db.Column(db.Boolean, nullable=False, default=False)
     host = db.Column(db.Text, nullable=True, default="0.0.0.0")
     ports = db.Column(db.JSON, nullable=True, default=[])
     flag = db.Column(db.String(128), nullable=False)
@@ -78,10 +101,13 @@ class KubernetesContainer(db.Model):
             'kubernetes:template_http_subdomain', '{{ container.uuid }}'
         )).render(container=self)
 
-    def __init__(self, user_id, challenge_id):
+    def __init__(self, user_id, challenge_id, status=ContainerStatus.READY):
+        self.shared = False
         self.user_id = user_id
         self.challenge_id = challenge_id
+        self.status = status
         self.start_time = datetime.now()
+        self.status_time = self.start_time
         self.renew_count = 0
         self.uuid = str(uuid.uuid4())
         self.flag = Template(get_config(
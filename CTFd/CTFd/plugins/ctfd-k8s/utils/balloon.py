@@ -0,0 +1,190 @@
+import logging
+import math
+import time
+import traceback
+from decimal import Decimal
+
+from kubernetes.client.rest import ApiException
+
+from CTFd.cache import cache
+from CTFd.models import Users
+from CTFd.utils import get_config
+
+from .cache import CacheProvider
+from .capacity import Capacity
+from .exceptions import KubernetesError
+from .kubernetes import KubernetesUtils, get_namespace
+from ..models import DynamicKubernetesChallenge
+
+PAUSE_IMAGE = "registry.k8s.io/pause:3.9"
+
+
+class Balloon:
+    # the autoscaler only adds nodes once pods are pending, so ahead of expected demand we run
+    # placeholder pods of negative priority: they make it scale out early, and real instances
+    # preempt them the moment they need the room
+    name = "ctfd-balloon"
+    priority = -10
+    launches_key = "ctfd_kubernetes-launches"
+    state_key = "kubernetes:balloon_state"
+    provider = None
+
+    @staticmethod
+    def init(app):
+        Balloon.provider = CacheProvider(app=app)
+
+    @staticmethod
+    def is_enabled():
+        return get_config("kubernetes:prescale_enabled", "false") == "true"
+
+    @staticmethod
+    def record_launch(challenge_id):
+        if Balloon.provider is None:
+            return
+        try:
+            Balloon.provider.incr_metrics(Balloon.launches_key, {str(challenge_id): 1})
+        except Exception:
+            print(traceback.format_exc())
+
+    @staticmethod
+    def update_rates(state, challenges, now):
+        # launches per second of every challenge, smoothed over the runs of this job
+        totals = Balloon.provider.get_metrics(Balloon.launches_key)
+        last, elapsed = state.get("totals"), now - state.get("time", now)
+        rates = state.get("rates", {})
+        if last is not None and elapsed > 0:
+            for challenge in challenges:
+                key = str(challenge.id)
+                rate = max(0, totals.get(key, 0) - last.get(key, 0)) / elapsed
+                rates[key] = 0.3 * rate + 0.7 * rates.get(key, rate)
+        state.update(totals=totals, time=now, rates=rates)
+        return rates
+
+    @staticmethod
+    def update_releases(state, challenges, now):
+        # when each challenge was first seen visible; the ones around on the first run don't count
+        released = state.get("released")
+        if released is None:
+            released = {str(challenge.id): 0 for challenge in challenges}
+        for challenge in challenges:
+            released.setdefault(str(challenge.id), now)
+        state["released"] = released
+        return released
+
+    @staticmethod
+    def get_demand(state, now=None):
+        # instances expected to be launched within the lead time: the recent launch rate of each
+        # challenge, a share of the players around the CTF start, and of them again for every
+        # challenge released within the lead time
+        now = now or time.time()
+        lead = int(get_config("kubernetes:prescale_lead", "900"))
+        challenges = DynamicKubernetesChallenge.query.filter(
+            DynamicKubernetesChallenge.state == "visible",
+            DynamicKubernetesChallenge.shared != 1,
+        ).all()
+        rates = Balloon.update_rates(state, challenges, now)
+        released = Balloon.update_releases(state, challenges, now)
+        players = Users.query.filter_by(banned=False, hidden=False).count()
+
+        expected = {challenge.id: rates.get(str(challenge.id), 0) * lead for challenge in challenges}
+        start = int(get_config("start") or 0)
+        if challenges and start and start - lead <= now <= start + lead:
+            launches = players * float(get_config("kubernetes:prescale_start_ratio", "0.5"))
+            # spread like the launches seen so far, evenly without any history
+            weights = {challenge.id: rates.get(str(challenge.id), 0) for challenge in challenges}
+            total_weight = sum(weights.values())
+            for challenge in challenges:
+                share = weights[challenge.id] / total_weight if total_weight else 1 / len(challenges)
+                expected[challenge.id] += launches * share
+        for challenge in challenges:
+            if now - released[str(challenge.id)] <= lead:
+                expected[challenge.id] += players * float(get_config("kubernetes:prescale_release_ratio", "0.2"))
+
+        cpu, memory = Decimal(0), Decimal(0)
+        size = (Decimal(0), Decimal(0))
+        for challenge in challenges:
+            c, m = Capacity.get_request(challenge)
+            count = Decimal(str(round(expected[challenge.id], 3)))
+            cpu, memory = cpu + c * count, memory + m * count
+            size = (max(size[0], c), max(size[1], m))
+        return (cpu, memory), size
+
+    @staticmethod
+    def get_replicas(demand, size, used=None, total=None):
+        # a balloon is as big as the biggest instance, so preempting one always makes room
+        dimensions = [(need, balloon) for need, balloon in zip(demand, size) if balloon > 0]
+        if not dimensions:
+            return 0  # no challenge declares limits, nothing to size the balloons by
+        replicas = max(math.ceil(need / balloon) for need, balloon in dimensions)
+        if total is not None:
+            # there is no point in asking for more than the node group can grow to
+            room = (total["cpu"] - used[0], total["memory"] - used[1])
+            replicas = min(replicas, min(
+                max(0, math.floor(free / balloon)) for free, balloon in zip(room, size) if balloon > 0
+            ))
+        return min(replicas, int(get_config("kubernetes:prescale_max_balloons", "20")))
+
+    @staticmethod
+    def get_documents(replicas, size):
+        resources = {}
+        if size[0] > 0:
+            resources["cpu"] = f"{max(1, int(size[0] * 1000))}m"
+        if size[1] > 0:
+            resources["memory"] = str(int(size[1]))
+        return [{
+            "apiVersion": "scheduling.k8s.io/v1",
+            "kind": "PriorityClass",
+            "metadata": {"name": Balloon.name},
+            "value": Balloon.priority,
+            "globalDefault": False,
+            "preemptionPolicy": "Never",
+            "description": "Placeholder pods reserving room for CTFd instances",
+        }, {
+            "apiVersion": "apps/v1",
+            "kind": "Deployment",
+            "metadata": {"name": Balloon.name, "labels": {"app": Balloon.name}},
+            "spec": {
+                "replicas": replicas,
+                "selector": {"matchLabels": {"app": Balloon.name}},
+                "template": {
+                    "metadata": {"labels": {"app": Balloon.name}},
+                    "spec": {
+                        "priorityClassName": Balloon.name,
+                        "terminationGracePeriodSeconds": 0,
+                        "containers": [{
+                            "name": "pause",
+                            "image": PAUSE_IMAGE,
+                            "resources": {"requests": resources, "limits": resources},
+                        }],
+                    },
+                },
+            },
+        }]
+
+    @staticmethod
+    def apply(documents):
+        priority_class, deployment = documents
+        try:
+            # cluster scoped, so it doesn't go through apply_documents
+            KubernetesUtils.get_api("scheduling.k8s.io/v1").create_priority_class(body=priority_class)
+        except ApiException as e:
+            if e.status != 409:
+                raise KubernetesError(f"Kubernetes Apply Error\n{e.reason}\n{e.body}")
+        KubernetesUtils.apply_documents([deployment], get_namespace())
+
+    @staticmethod
+    def run():
+        state = cache.get(Balloon.state_key) or {}
+        if Balloon.is_enabled():
+            demand, size = Balloon.get_demand(state)
+            replicas = Balloon.get_replicas(demand, size, Capacity.get_used(), Capacity.get_total())
+        else:
+            replicas, size = 0, (Decimal(0), Decimal(0))
+        applied = (replicas, str(size[0]), str(size[1]))
+        # applied again while running, in case the deployment was removed behind our back
+        if replicas or applied != tuple(state.get("applied") or (0, "0", "0")):
+            Balloon.apply(Balloon.get_documents(replicas, size))
+            state["applied"] = applied
+            logging.getLogger("kubernetes").info(f"Running {replicas} balloon pods")
+        cache.set(Balloon.state_key, state, timeout=0)
+        return replicas
@@ -0,0 +1,79 @@
+import time
+import traceback
+import uuid
+
+from CTFd.cache import cache
+
+from .control import ControlUtil
+from .db import DBContainer
+from .informer import KubernetesInformer, get_chal_id
+from .kubernetes import get_challenge_id
+from .provision import ProvisionQueue
+from .reaper import Reaper
+
+
+class BulkOperation:
+    # admin actions over many instances run on a provision worker; the admin page
+    # polls the job kept in the cache until it is finished
+    actions = ("destroy", "renew")
+    job_key = "kubernetes:bulk:{}"
+    job_timeout = 3600
+
+    @staticmethod
+    def select(challenge_id=None, user_ids=None, older_than=None, node=None):
+        containers = DBContainer.get_containers_by_filter(
+            challenge_id=challenge_id, user_ids=user_ids, older_than=older_than
+        )
+        if node is not None:
+            with KubernetesInformer.lock:
+                pods = list(KubernetesInformer.pods.objects.values())
+            on_node = {get_chal_id(pod) for pod in pods if pod.spec.node_name == node}
+            containers = [c for c in containers if get_challenge_id(c)[0] in on_node]
+        return containers
+
+    @staticmethod
+    def start(action, **filters):
+        containers = BulkOperation.select(**filters)
+        job = {
+            "id": uuid.uuid4().hex,
+            "action": action,
+            "total": len(containers),
+            "done": 0,
+            "succeeded": 0,
+            "finished": False,
+            "started": time.time(),
+        }
+        BulkOperation._save(job)
+        ProvisionQueue.submit(BulkOperation._run, job["id"], [c.id for c in containers])
+        return job
+
+    @staticmethod
+    def get(job_id):
+        return cache.get(BulkOperation.job_key.format(job_id))
+
+    @staticmethod
+    def _save(job):
+        cache.set(BulkOperation.job_key.format(job["id"]), job, timeout=BulkOperation.job_timeout)
+
+    @staticmethod
+    def _run(job_id, container_ids):
+        job = BulkOperation.get(job_id)
+        # rows may have gone away since they were selected
+        containers = [c for c in map(DBContainer.get_container_by_id, container_ids) if c]
+
+        def progress(count):
+            job["done"] += count
+            BulkOperation._save(job)
+
+        try:
+            if job["action"] == "destroy":
+                job["succeeded"] = len(Reaper.remove(containers, progress))
+                ControlUtil.admit_queued()
+            else:
+                DBContainer.renew_containers(containers)
+                job["succeeded"] = len(containers)
+        except Exception:
+            print(traceback.format_exc())
+        job["done"] = job["total"]
+        job["finished"] = True
+        BulkOperation._save(job)
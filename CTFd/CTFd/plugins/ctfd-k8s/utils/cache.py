@@ -1,12 +1,10 @@
-import ipaddress
+import threading
+import time
 import warnings
 from CTFd.cache import cache
-from CTFd.utils import get_config
 from flask_redis import FlaskRedis
 from redis.exceptions import LockError
 
-from .db import DBContainer
-
 
 class CacheProvider:
     def __init__(self, app, *args, **kwargs):
@@ -16,39 +14,6 @@ class CacheProvider:
             if not hasattr(CacheProvider, 'cache'):
                 CacheProvider.cache = {}
             self.provider = FilesystemCacheProvider(app, *args, **kwargs)
-            self.init_port_sets()
-
-    def init_port_sets(self):
-        self.clear()
-
-        containers = DBContainer.get_all_container()
-        used_port_list = []
-        for container in containers:
-            if container.port != 0:
-                used_port_list.append(container.port)
-        for port in range(int(get_config("kubernetes:frp_direct_port_minimum", 29000)),
-                          int(get_config("kubernetes:frp_direct_port_maximum", 28000)) + 1):
-            if port not in used_port_list:
-                self.add_available_port(port)
-
-        from .docker import get_docker_client
-        client = get_docker_client()
-
-        docker_subnet = get_config("kubernetes:docker_subnet", "174.1.0.0/16")
-        docker_subnet_new_prefix = int(
-            get_config("kubernetes:docker_subnet_new_prefix", "24"))
-
-        exist_networks = []
-        available_networks = []
-
-        for network in client.networks.list(filters={'label': 'prefix'}):
-            exist_networks.append(str(network.attrs['Labels']['prefix']))
-
-        for network in list(ipaddress.ip_network(docker_subnet).subnets(new_prefix=docker_subnet_new_prefix)):
-            if str(network) not in exist_networks:
-                available_networks.append(str(network))
-
-        self.add_available_network_range(*set(available_networks))
 
     def __getattr__(self, name):
         return self.provider.__getattribute__(name)
@@ -104,8 +69,181 @@ class FilesystemCacheProvider:
     def release_lock(self):
         return True
 
+    def acquire_lease(self, name, owner, ttl):
+        # a filesystem cache means a single process anyway
+        return True
+
+    def release_lease(self, name, owner):
+        return True
+
+    admission_rlock = threading.RLock()
+
+    def admission_lock(self):
+        return self.admission_rlock
+
+    # the quota counters are kept in the CTFd cache, guarded by a process-wide lock
+    quota_lock = threading.Lock()
+
+    def reserve_quota(self, key, limits, reservation):
+        with self.quota_lock:
+            usage = cache.get(key) or {}
+            for i, (field, limit) in enumerate(limits, 1):
+                if 0 < limit <= usage.get(field, 0):
+                    return i
+            for field, _ in limits:
+                usage[field] = usage.get(field, 0) + 1
+            cache.set(key, usage, timeout=0)
+            pending = cache.get(key + ":pending") or {}
+            pending[reservation] = time.time()
+            cache.set(key + ":pending", pending, timeout=0)
+            return 0
+
+    def settle_quota(self, key, reservation):
+        with self.quota_lock:
+            pending = cache.get(key + ":pending") or {}
+            if pending.pop(reservation, None) is None:
+                return
+            settled = cache.get(key + ":settled") or {}
+            settled[reservation] = time.time()
+            cache.set(key + ":pending", pending, timeout=0)
+            cache.set(key + ":settled", settled, timeout=0)
+
+    def release_quota(self, key, counts, reservation=None):
+        with self.quota_lock:
+            usage = cache.get(key) or {}
+            for field, count in counts.items():
+                usage[field] = max(0, usage.get(field, 0) - count)
+            cache.set(key, usage, timeout=0)
+            if reservation is not None:
+                pending = cache.get(key + ":pending") or {}
+                pending.pop(reservation, None)
+                cache.set(key + ":pending", pending, timeout=0)
+
+    def reset_quota(self, key, usage, since=None, stale_before=None):
+        with self.quota_lock:
+            pending = {
+                reservation: reserved for reservation, reserved in (cache.get(key + ":pending") or {}).items()
+                if stale_before is not None and reserved >= stale_before
+            }
+            settled = {
+                reservation: at for reservation, at in (cache.get(key + ":settled") or {}).items()
+                if since is not None and at >= since
+            }
+            usage = dict(usage)
+            for reservation in list(pending) + list(settled):
+                for field in reservation.split()[1:]:
+                    usage[field] = usage.get(field, 0) + 1
+            cache.set(key, usage, timeout=0)
+            cache.set(key + ":pending", pending, timeout=0)
+            cache.set(key + ":settled", settled, timeout=0)
+
+    def get_quota(self, key):
+        return cache.get(key) or {}
+
+    def set_route(self, key, token, target):
+        with self.quota_lock:
+            routes = cache.get(key) or {}
+            routes[token] = target
+            cache.set(key, routes, timeout=0)
+
+    def delete_routes(self, key, *tokens):
+        with self.quota_lock:
+            routes = cache.get(key) or {}
+            for token in tokens:
+                routes.pop(token, None)
+            cache.set(key, routes, timeout=0)
+
+    # metrics are recorded from threads without an app context, so they stay in-process
+    metrics = {}
+    metrics_lock = threading.Lock()
+
+    def incr_metrics(self, key, increments):
+        with self.metrics_lock:
+            series = self.metrics.setdefault(key, {})
+            for field, amount in increments.items():
+                series[field] = series.get(field, 0) + amount
+
+    def get_metrics(self, key):
+        with self.metrics_lock:
+            return dict(self.metrics.get(key, {}))
+
 
 class RedisCacheProvider(FlaskRedis):
+    # take the lease if it is free, or extend it if we already hold it
+    ACQUIRE_LEASE = """
+    if redis.call('get', KEYS[1]) == ARGV[1] then
+        return redis.call('pexpire', KEYS[1], ARGV[2])
+    end
+    if redis.call('set', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+        return 1
+    end
+    return 0
+    """
+    # every limit is checked before anything is counted, so a rejected launch holds nothing;
+    # returns the 1-based index of the exhausted limit, or 0 once all of them are reserved
+    # and the reservation is pending in KEYS[2]
+    RESERVE_QUOTA = """
+    local n = (#ARGV - 2) / 2
+    for i = 1, n do
+        local limit = tonumber(ARGV[2 * i + 2])
+        local used = tonumber(redis.call('hget', KEYS[1], ARGV[2 * i + 1]) or '0')
+        if limit > 0 and used >= limit then
+            return i
+        end
+    end
+    for i = 1, n do
+        redis.call('hincrby', KEYS[1], ARGV[2 * i + 1], 1)
+    end
+    redis.call('zadd', KEYS[2], ARGV[2], ARGV[1])
+    return 0
+    """
+    SETTLE_QUOTA = """
+    if redis.call('zrem', KEYS[1], ARGV[1]) == 1 then
+        redis.call('zadd', KEYS[2], ARGV[2], ARGV[1])
+    end
+    return 0
+    """
+    RELEASE_QUOTA = """
+    for i = 1, #ARGV / 2 do
+        local field, count = ARGV[2 * i - 1], tonumber(ARGV[2 * i])
+        local used = tonumber(redis.call('hget', KEYS[1], field) or '0')
+        redis.call('hset', KEYS[1], field, math.max(0, used - count))
+    end
+    return 0
+    """
+    # a reservation is "<token> <field> <field>...", the ones the database can't have seen yet
+    # are counted on top of its usage
+    RESET_QUOTA = """
+    redis.call('zremrangebyscore', KEYS[2], '-inf', '(' .. ARGV[2])
+    redis.call('zremrangebyscore', KEYS[3], '-inf', '(' .. ARGV[1])
+    local usage = {}
+    for i = 3, #ARGV, 2 do
+        usage[ARGV[i]] = tonumber(ARGV[i + 1])
+    end
+    for _, key in ipairs({KEYS[2], KEYS[3]}) do
+        for _, reservation in ipairs(redis.call('zrange', key, 0, -1)) do
+            local token = true
+            for field in string.gmatch(reservation, '%S+') do
+                if not token then
+                    usage[field] = (usage[field] or 0) + 1
+                end
+                token = false
+            end
+        end
+    end
+    redis.call('del', KEYS[1])
+    for field, count in pairs(usage) do
+        redis.call('hset', KEYS[1], field, count)
+    end
+    return 0
+    """
+    RELEASE_LEASE = """
+    if redis.call('get', KEYS[1]) == ARGV[1] then
+        return redis.call('del', KEYS[1])
+    end
+    return 0
+    """
+
     def __init__(self, app, *args, **kwargs):
         super().__init__(app)
         self.key = 'ctfd_kubernetes_lock-' + str(kwargs.get('user_id', 0))
@@ -148,3 +286,60 @@ class RedisCacheProvider(FlaskRedis):
             return True
         except LockError:
             return False
+
+    def acquire_lease(self, name, owner, ttl):
+        script = self.register_script(self.ACQUIRE_LEASE)
+        return script(keys=[name], args=[owner, int(ttl * 1000)]) == 1
+
+    def release_lease(self, name, owner):
+        script = self.register_script(self.RELEASE_LEASE)
+        return script(keys=[name], args=[owner]) == 1
+
+    def admission_lock(self):
+        # raises LockError on enter if the lock can't be had within 5 seconds
+        return self.lock(name="ctfd_kubernetes-admission", timeout=10, blocking_timeout=5)
+
+    def reserve_quota(self, key, limits, reservation):
+        script = self.register_script(self.RESERVE_QUOTA)
+        args = [reservation, time.time()] + [str(v) for field, limit in limits for v in (field, limit)]
+        return int(script(keys=[key, key + ":pending"], args=args))
+
+    def settle_quota(self, key, reservation):
+        script = self.register_script(self.SETTLE_QUOTA)
+        script(keys=[key + ":pending", key + ":settled"], args=[reservation, time.time()])
+
+    def release_quota(self, key, counts, reservation=None):
+        if reservation is not None:
+            self.zrem(key + ":pending", reservation)
+        if not counts:
+            return
+        script = self.register_script(self.RELEASE_QUOTA)
+        script(keys=[key], args=[str(v) for item in counts.items() for v in item])
+
+    def reset_quota(self, key, usage, since=None, stale_before=None):
+        script = self.register_script(self.RESET_QUOTA)
+        args = [
+            "+inf" if since is None else since,
+            "+inf" if stale_before is None else stale_before,
+        ] + [str(v) for item in usage.items() for v in item]
+        script(keys=[key, key + ":pending", key + ":settled"], args=args)
+
+    def get_quota(self, key):
+        return {field.decode(): int(count) for field, count in self.hgetall(key).items()}
+
+    # the gateway reads this hash directly, so it stays plain token -> "host:port"
+    def set_route(self, key, token, target):
+        self.hset(key, token, target)
+
+    def delete_routes(self, key, *tokens):
+        if tokens:
+            self.hdel(key, *tokens)
+
+    def incr_metrics(self, key, increments):
+        pipe = self.pipeline(transaction=False)
+        for field, amount in increments.items():
+            pipe.hincrbyfloat(key, field, amount)
+        pipe.execute()
+
+    def get_metrics(self, key):
+        return {field.decode(): float(value) for field, value in self.hgetall(key).items()}
@@ -0,0 +1,146 @@
+from decimal import Decimal
+
+from kubernetes.utils import parse_quantity
+
+from CTFd.cache import cache
+from CTFd.utils import get_config
+
+from .cache import CacheProvider
+from .db import DBContainer
+from .informer import KubernetesInformer, get_chal_id
+from .kubernetes import KubernetesUtils
+from .resources import get_request
+from .shared import SharedInstance
+from ..models import DynamicKubernetesChallenge
+
+
+def is_schedulable(node):
+    if node.spec is not None and node.spec.unschedulable:
+        return False
+    for condition in (node.status.conditions or []) if node.status else []:
+        if condition.type == "Ready":
+            return condition.status == "True"
+    return False
+
+
+def get_container_request(container, name):
+    requests = (container.resources.requests if container.resources else None) or {}
+    return parse_quantity(requests.get(name, "0"))
+
+
+def get_pod_request(pod):
+    # what the scheduler sets aside for a pod: its containers, or its largest init container
+    # if that asks for more, plus the runtime overhead
+    request = []
+    for name in ("cpu", "memory"):
+        containers = sum((get_container_request(c, name) for c in pod.spec.containers or []), Decimal(0))
+        init = max((get_container_request(c, name) for c in pod.spec.init_containers or []), default=Decimal(0))
+        overhead = parse_quantity((pod.spec.overhead or {}).get(name, "0"))
+        request.append(max(containers, init) + overhead)
+    return tuple(request)
+
+
+class Capacity:
+    FITS = "fits"
+    FULL = "full"
+    NEVER = "never"  # bigger than any single node, waiting won't help
+
+    provider = None
+    reserved_key = "kubernetes:capacity_reserved"
+
+    @staticmethod
+    def init(app):
+        Capacity.provider = CacheProvider(app=app)
+
+    @staticmethod
+    def lock():
+        # admission decisions are serialized cluster-wide so two workers can't both take the last slot
+        return Capacity.provider.admission_lock()
+
+    @staticmethod
+    def get_request(challenge):
+        return get_request(challenge)
+
+    @staticmethod
+    def get_total():
+        nodes = [
+            (parse_quantity(node.status.allocatable.get("cpu", "0")),
+             parse_quantity(node.status.allocatable.get("memory", "0")))
+            for node in KubernetesInformer.get_nodes()
+            if is_schedulable(node) and node.status.allocatable
+        ]
+        if not nodes:
+            return None
+        cpu = sum(n[0] for n in nodes)
+        memory = sum(n[1] for n in nodes)
+        # the node group may still scale out up to max_nodes, assume average sized nodes
+        max_nodes = int(get_config("kubernetes:max_nodes", 0) or 0)
+        if max_nodes > len(nodes):
+            cpu = cpu / len(nodes) * max_nodes
+            memory = memory / len(nodes) * max_nodes
+        return {
+            "nodes": len(nodes),
+            "cpu": cpu,
+            "memory": memory,
+            "largest_cpu": max(n[0] for n in nodes),
+            "largest_memory": max(n[1] for n in nodes),
+        }
+
+    @staticmethod
+    def refresh_reserved():
+        # requests of everything that isn't an instance: system pods, daemonsets, other workloads.
+        # Instances are counted from their rows instead, so admitted launches which aren't
+        # scheduled yet take their room too
+        nodes = {node.metadata.name for node in KubernetesInformer.get_nodes() if is_schedulable(node)}
+        pods = KubernetesUtils.get_api("v1").list_pod_for_all_namespaces(
+            field_selector="status.phase!=Succeeded,status.phase!=Failed"
+        ).items
+        cpu, memory = Decimal(0), Decimal(0)
+        for pod in pods:
+            if get_chal_id(pod) is not None:
+                continue
+            # the balloons (and anything else of negative priority) make way as soon as instances need it
+            if (pod.spec.priority or 0) < 0:
+                continue
+            if pod.spec.node_name and pod.spec.node_name not in nodes:
+                continue  # its node doesn't count towards the total either
+            c, m = get_pod_request(pod)
+            cpu, memory = cpu + c, memory + m
+        cache.set(Capacity.reserved_key, (cpu, memory), timeout=0)
+        return cpu, memory
+
+    @staticmethod
+    def get_reserved():
+        return cache.get(Capacity.reserved_key) or (Decimal(0), Decimal(0))
+
+    @staticmethod
+    def get_used():
+        cpu, memory = Capacity.get_reserved()
+        counts = DBContainer.get_scheduled_counts()
+        # shared deployments take a challenge's request per replica
+        q = DynamicKubernetesChallenge.query.filter(DynamicKubernetesChallenge.shared == 1)
+        for challenge in q.all():
+            replicas = SharedInstance.get_replicas(challenge.id)
+            if replicas:
+                counts[challenge.id] = counts.get(challenge.id, 0) + replicas
+        if not counts:
+            return cpu, memory
+        q = DynamicKubernetesChallenge.query.filter(DynamicKubernetesChallenge.id.in_(counts))
+        for challenge in q.all():
+            c, m = Capacity.get_request(challenge)
+            cpu += c * counts[challenge.id]
+            memory += m * counts[challenge.id]
+        return cpu, memory
+
+    @staticmethod
+    def check(challenge, used=None, total=None):
+        total = total or Capacity.get_total()
+        if total is None:
+            return Capacity.FITS  # no node information (yet), don't hold anything back
+        cpu, memory = Capacity.get_request(challenge)
+        if cpu > total["largest_cpu"] or memory > total["largest_memory"]:
+            return Capacity.NEVER
+        used_cpu, used_memory = used or Capacity.get_used()
+        if used_cpu + cpu > total["cpu"] or used_memory + memory > total["memory"]:
+            return Capacity.FULL
+        return Capacity.FITS
@@ -2,43 +2,246 @@ import datetime
 import traceback
 
 from CTFd.utils import get_config
-from .db import DBContainer, db
-from .kubernetes import KubernetesUtils
+from .balloon import Balloon
+from .capacity import Capacity
+from .db import DBContainer, db, forget_instances
+from .kubernetes import KubernetesUtils, get_challenge_id, make_challenge_id
+from .metrics import PHASE, Metrics
+from .provision import ProvisionQueue
+from .quota import Quota
+from .readiness import ReadinessTracker
 from .routers import Router
+from .shared import SharedInstance
+from ..models import ContainerStatus, DynamicKubernetesChallenge
 
 
 class ControlUtil:
     @staticmethod
     def try_add_container(user_id, challenge_id):
-        container = DBContainer.create_container_record(user_id, challenge_id)
+        challenge = DynamicKubernetesChallenge.query.filter_by(id=challenge_id).first()
+        if challenge is not None and challenge.shared:
+            return ControlUtil.join_shared(user_id, challenge)
+        ok, reservation = Quota.reserve(user_id, challenge_id)
+        if not ok:
+            return False, reservation
+        Balloon.record_launch(challenge_id)
         try:
-            KubernetesUtils.add_container(container)
-        except Exception as e:
-            DBContainer.remove_container_record(user_id)
+            if ControlUtil.try_claim_warm_container(user_id, challenge_id):
+                Quota.settle(reservation)
+                return True, 'Container created'
+            container = DBContainer.create_container_record(
+                user_id, challenge_id, status=ContainerStatus.QUEUED
+            )
+        except Exception:
             print(traceback.format_exc())
-            return False, 'Kubernetes Creation Error'
-        ok, msg = Router.register(container)
-        if not ok:
-            KubernetesUtils.remove_container(container)
-            DBContainer.remove_container_record(user_id)
-            return False, msg
-        return True, 'Container created'
+            Quota.release_reservation(reservation)
+            return False, 'Failed when launching instance, please contact admin!'
+        Quota.settle(reservation)
+        ControlUtil.admit_queued()
+        if container.status == ContainerStatus.QUEUED:
+            return True, 'Container is queued until the cluster has room for it'
+        return True, 'Container is being created'
+
+    @staticmethod
+    def join_shared(user_id, challenge):
+        # players of a shared challenge only get a row with their token and flag,
+        # which neither takes a quota slot nor waits for capacity
+        container = DBContainer.create_container_record(
+            user_id, challenge.id, status=ContainerStatus.PENDING, shared=True,
+            flag=SharedInstance.flag_for(challenge.id, user_id),
+        )
+        ProvisionQueue.submit(ControlUtil.provision_container, container.id)
+        return True, 'Container is being created'
+
+    @staticmethod
+    def admit_queued():
+        # strictly first come first served: stop at the first launch that doesn't fit
+        admitted = []
+        try:
+            with Capacity.lock():
+                total = Capacity.get_total()
+                used_cpu, used_memory = Capacity.get_used()
+                for container in DBContainer.get_queued_containers():
+                    if container.challenge is None:
+                        continue
+                    state = Capacity.check(container.challenge, (used_cpu, used_memory), total)
+                    if state == Capacity.NEVER:
+                        Metrics.failure("unschedulable")
+                        Quota.release(Quota.slots(container))
+                        DBContainer.set_container_status(
+                            container, ContainerStatus.FAILED,
+                            'This challenge needs more resources than any node has'
+                        )
+                        continue
+                    if state == Capacity.FULL:
+                        break
+                    cpu, memory = Capacity.get_request(container.challenge)
+                    used_cpu, used_memory = used_cpu + cpu, used_memory + memory
+                    waited = (datetime.datetime.now() - container.start_time).total_seconds()
+                    DBContainer.admit_queued_container(container)
+                    Metrics.observe(PHASE, waited, phase="queue", challenge=container.challenge_id)
+                    admitted.append(container.id)
+        except Exception:
+            print(traceback.format_exc())
+        for container_id in admitted:
+            ProvisionQueue.submit(ControlUtil.provision_container, container_id)
+
+    @staticmethod
+    def try_claim_warm_container(user_id, challenge_id):
+        container = DBContainer.claim_warm_container(user_id, challenge_id)
+        if not container:
+            return None
+        ProvisionQueue.submit(ControlUtil.replenish_warm_pool, int(challenge_id))
+        _, old_short_id = make_challenge_id(None, container.uuid)
+        try:
+            with Metrics.timer(PHASE, phase="launch", challenge=container.challenge_id):
+                KubernetesUtils.relabel_container(container, old_short_id)
+                Router.register(container)
+        except Exception:
+            print(traceback.format_exc())
+            # failed instances don't hold a slot, the launch falls back to provisioning with it
+            DBContainer.set_container_status(container, ContainerStatus.FAILED, 'Kubernetes Relabel Error')
+            ControlUtil.destroy_container(container)
+            return None
+        return container
+
+    @staticmethod
+    def replenish_warm_pool(challenge_id):
+        challenge = DynamicKubernetesChallenge.query.filter_by(id=challenge_id).first()
+        size = 0
+        if challenge is not None and challenge.state == "visible" and not challenge.shared:
+            size = int(challenge.warm_pool_size or 0)
+        pool = []
+        for container in DBContainer.get_warm_containers(challenge_id):
+            if container.status in (ContainerStatus.FAILED, ContainerStatus.DRAINING):
+                ControlUtil.destroy_container(container)
+            else:
+                pool.append(container)
+        created = []
+        if size > len(pool):
+            with Capacity.lock():
+                # warm instances only take capacity nobody is waiting for
+                if not DBContainer.get_queued_containers():
+                    total = Capacity.get_total()
+                    used_cpu, used_memory = Capacity.get_used()
+                    for _ in range(size - len(pool)):
+                        if Capacity.check(challenge, (used_cpu, used_memory), total) != Capacity.FITS:
+                            break
+                        cpu, memory = Capacity.get_request(challenge)
+                        used_cpu, used_memory = used_cpu + cpu, used_memory + memory
+                        container = DBContainer.create_container_record(
+                            None, challenge_id, status=ContainerStatus.PENDING
+                        )
+                        created.append(container.id)
+        for container_id in created:
+            ProvisionQueue.submit(ControlUtil.provision_container, container_id)
+        # shrink from the newest, least likely to be ready yet; an instance claimed in the
+        # meantime stays with its player
+        for container in pool[size:][::-1]:
+            if DBContainer.drain_warm_container(container.id):
+                ControlUtil.destroy_container(container)
+
+    @staticmethod
+    def replenish_warm_pools():
+        q = DynamicKubernetesChallenge.query.filter(DynamicKubernetesChallenge.warm_pool_size > 0)
+        challenge_ids = {challenge.id for challenge in q.all()}
+        challenge_ids.update(DBContainer.get_warm_pool_challenge_ids())
+        for challenge_id in challenge_ids:
+            ControlUtil.replenish_warm_pool(challenge_id)
+
+    @staticmethod
+    def provision_container(container_id):
+        container = DBContainer.get_container_by_id(container_id)
+        if not container or container.status != ContainerStatus.PENDING:
+            return  # destroyed before we got to it
+        try:
+            with Metrics.timer(PHASE, phase="apply", challenge=container.challenge_id):
+                if container.shared:
+                    SharedInstance.ensure(container.challenge)
+                else:
+                    KubernetesUtils.add_container(container)
+        except Exception:
+            print(traceback.format_exc())
+            ControlUtil.fail_container(container_id, 'Kubernetes Creation Error', 'create_error')
+            return
+        if not DBContainer.get_container_by_id(container_id):
+            KubernetesUtils.remove_container(container, Router.kinds)
+            return
+        DBContainer.set_container_status(container, ContainerStatus.SCHEDULING)
+        chal_id, _ = get_challenge_id(container)
+        ReadinessTracker.track(
+            chal_id, container_id, int(get_config("kubernetes:launch_timeout", "300")),
+            Router.needs_node_address
+        )
+
+    @staticmethod
+    def complete_container(container_id):
+        container = DBContainer.get_container_by_id(container_id)
+        if not container or container.status != ContainerStatus.SCHEDULING:
+            return
+        Metrics.observe(
+            PHASE, (datetime.datetime.now() - container.status_time).total_seconds(),
+            phase="scheduling", challenge=container.challenge_id
+        )
+        try:
+            with Metrics.timer(PHASE, phase="register", challenge=container.challenge_id):
+                ok, msg = Router.register(container)
+        except Exception:
+            db.session.rollback()
+            print(traceback.format_exc())
+            ok, msg = False, 'Kubernetes Creation Error'
+        if ok and not DBContainer.get_container_by_id(container_id):
+            Router.unregister(container)  # destroyed while we were registering it
+        elif ok:
+            DBContainer.set_container_status(container, ContainerStatus.READY)
+            Metrics.observe(
+                PHASE, (container.status_time - container.start_time).total_seconds(),
+                phase="launch", challenge=container.challenge_id
+            )
+        else:
+            ControlUtil.fail_container(container_id, msg, 'register_error')
+
+    @staticmethod
+    def fail_container(container_id, message, reason="other"):
+        # reason is one of metrics.FAILURE_REASONS, message is what the player gets to see
+        container = DBContainer.get_container_by_id(container_id)
+        if not container:
+            return
+        Metrics.failure(reason)
+        try:
+            Router.unregister(container)
+            KubernetesUtils.remove_container(container, Router.kinds)
+        except Exception:
+            print(traceback.format_exc())
+        Quota.release(Quota.slots(container))
+        DBContainer.set_container_status(container, ContainerStatus.FAILED, message)
+        ControlUtil.admit_queued()
 
     @staticmethod
     def try_remove_container(user_id):
         container = DBContainer.get_current_containers(user_id=user_id)
         if not container:
             return False, 'No such container'
+        return ControlUtil.destroy_container(container)
+
+    @staticmethod
+    def destroy_container(container):
         for _ in range(3):  # configurable? as "onerror_retry_cnt"
             try:
-                ok, msg = Router.unregister(container)
-                if not ok:
-                    return False, msg
-                KubernetesUtils.remove_container(container)
-                DBContainer.remove_container_record(user_id)
+                with Metrics.timer(PHASE, phase="teardown", challenge=container.challenge_id):
+                    ok, msg = Router.unregister(container)
+                    if not ok:
+                        return False, msg
+                    ReadinessTracker.untrack(get_challenge_id(container)[0], container.id)
+                    KubernetesUtils.remove_container(container, Router.kinds)
+                slots = Quota.slots(container)
+                DBContainer.remove_container_record_by_id(container.id)
+                Quota.release(slots)
+                ControlUtil.admit_queued()
                 return True, 'Container destroyed'
-            except Exception as e:
+            except Exception:
                 print(traceback.format_exc())
+        Metrics.failure("destroy_error")
         return False, 'Failed when destroying instance, please contact admin!'
 
     @staticmethod
@@ -58,4 +261,5 @@ class ControlUtil:
             return False, 'Invalid container'
         container.renew_count += 1
         db.session.commit()
+        forget_instances(user_ids=[container.user_id])
         return True, 'Container Renewed'
@@ -1,21 +1,110 @@
 import datetime
 
-from CTFd.models import db
+from sqlalchemy import func
+
+from CTFd.cache import cache
+from CTFd.models import db, Users
 from CTFd.utils import get_config
-from ..models import KubernetesContainer, KubernetesRedirectTemplate
+from .kubernetes import get_namespace_for_challenge, pick_namespace
+from ..models import ContainerStatus, KubernetesContainer, KubernetesRedirectTemplate
+
+# what the instance polling endpoint is served from, see utils/instance_cache.py
+INSTANCE_KEY = "kubernetes:instance:{}"
+CONNECTION_KEY = "kubernetes:connection:{}"
+
+
+def forget_instances(user_ids=(), uuids=()):
+    keys = [INSTANCE_KEY.format(user_id) for user_id in user_ids if user_id is not None]
+    keys += [CONNECTION_KEY.format(uuid) for uuid in uuids if uuid is not None]
+    if keys:
+        cache.delete_many(*keys)
 
 
 class DBContainer:
     @staticmethod
-    def create_container_record(user_id, challenge_id):
-        container = KubernetesContainer(user_id=user_id, challenge_id=challenge_id)
+    def create_container_record(user_id, challenge_id, status=ContainerStatus.READY, shared=False, flag=None):
+        container = KubernetesContainer(user_id=user_id, challenge_id=challenge_id, status=status)
+        container.shared = shared
+        if flag is not None:
+            container.flag = flag
+        if shared:
+            container.namespace = get_namespace_for_challenge(challenge_id)
+        else:
+            container.namespace = pick_namespace(user_id, challenge_id, container.uuid)
         db.session.add(container)
         db.session.commit()
+        forget_instances(user_ids=[user_id])
 
         return container
 
+    @staticmethod
+    def get_container_by_id(container_id):
+        q = db.session.query(KubernetesContainer)
+        q = q.filter(KubernetesContainer.id == container_id)
+        return q.first()
+
+    @staticmethod
+    def get_warm_containers(challenge_id):
+        q = db.session.query(KubernetesContainer)
+        q = q.filter(KubernetesContainer.user_id.is_(None))
+        q = q.filter(KubernetesContainer.challenge_id == challenge_id)
+        return q.order_by(KubernetesContainer.id).all()
+
+    @staticmethod
+    def get_warm_pool_challenge_ids():
+        q = db.session.query(KubernetesContainer.challenge_id)
+        q = q.filter(KubernetesContainer.user_id.is_(None))
+        return [challenge_id for challenge_id, in q.distinct()]
+
+    @staticmethod
+    def claim_warm_container(user_id, challenge_id):
+        candidates = [c.id for c in DBContainer.get_warm_containers(challenge_id)
+                      if c.status == ContainerStatus.READY]
+        for container_id in candidates:
+            # compare-and-set on user_id and status, so concurrent launches never get the same
+            # instance and none gets one the pool is shrinking away, see drain_warm_container
+            q = db.session.query(KubernetesContainer)
+            q = q.filter(KubernetesContainer.id == container_id)
+            q = q.filter(KubernetesContainer.user_id.is_(None))
+            q = q.filter(KubernetesContainer.status == ContainerStatus.READY)
+            claimed = q.update({
+                KubernetesContainer.user_id: user_id,
+                KubernetesContainer.start_time: datetime.datetime.now(),
+            }, synchronize_session=False)
+            db.session.commit()
+            if claimed:
+                forget_instances(user_ids=[user_id])
+                container = DBContainer.get_container_by_id(container_id)
+                db.session.refresh(container)
+                return container
+        return None
+
+    @staticmethod
+    def drain_warm_container(container_id):
+        # the other side of claim_warm_container: whichever update lands first has the instance
+        q = db.session.query(KubernetesContainer)
+        q = q.filter(KubernetesContainer.id == container_id)
+        q = q.filter(KubernetesContainer.user_id.is_(None))
+        q = q.filter(KubernetesContainer.status != ContainerStatus.FAILED)
+        drained = q.update({
+            KubernetesContainer.status: ContainerStatus.DRAINING,
+            KubernetesContainer.status_time: datetime.datetime.now(),
+        }, synchronize_session=False)
+        db.session.commit()
+        return bool(drained)
+
+    @staticmethod
+    def set_container_status(container, status, message=None):
+        container.status = status
+        container.message = message
+        container.status_time = datetime.datetime.now()
+        db.session.commit()
+        forget_instances(user_ids=[container.user_id])
+
     @staticmethod
     def get_current_containers(user_id):
+        if user_id is None:
+            return None  # would match the unowned warm pool instances
         q = db.session.query(KubernetesContainer)
         q = q.filter(KubernetesContainer.user_id == user_id)
         return q.first()
@@ -26,11 +115,41 @@ class DBContainer:
         q = q.filter(KubernetesContainer.port == port)
         return q.first()
 
+    @staticmethod
+    def _delete(q, synchronize_session="evaluate"):
+        rows = q.with_entities(KubernetesContainer.user_id, KubernetesContainer.uuid).all()
+        q.delete(synchronize_session=synchronize_session)
+        db.session.commit()
+        forget_instances(user_ids=[r.user_id for r in rows], uuids=[r.uuid for r in rows])
+
     @staticmethod
     def remove_container_record(user_id):
         q = db.session.query(KubernetesContainer)
         q = q.filter(KubernetesContainer.user_id == user_id)
-        q.delete()
+        DBContainer._delete(q)
+
+    @staticmethod
+    def remove_container_record_by_id(container_id):
+        q = db.session.query(KubernetesContainer)
+        q = q.filter(KubernetesContainer.id == container_id)
+        DBContainer._delete(q)
+
+    @staticmethod
+    def remove_container_records(container_ids):
+        if not container_ids:
+            return
+        q = db.session.query(KubernetesContainer)
+        q = q.filter(KubernetesContainer.id.in_(container_ids))
+        DBContainer._delete(q, synchronize_session=False)
+
+    @staticmethod
+    def set_connection_info(uuid, host, ports):
+        q = db.session.query(KubernetesContainer)
+        q = q.filter(KubernetesContainer.uuid == uuid)
+        q.update({
+            KubernetesContainer.host: host,
+            KubernetesContainer.ports: ports,
+        }, synchronize_session=False)
         db.session.commit()
 
     @staticmethod
@@ -38,6 +157,7 @@ class DBContainer:
         timeout = int(get_config("kubernetes:docker_timeout", "3600"))
 
         q = db.session.query(KubernetesContainer)
+        q = q.filter(KubernetesContainer.user_id.isnot(None))
         q = q.filter(
             KubernetesContainer.start_time <
             datetime.datetime.now() - datetime.timedelta(seconds=timeout)
@@ -49,6 +169,7 @@ class DBContainer:
         timeout = int(get_config("kubernetes:docker_timeout", "3600"))
 
         q = db.session.query(KubernetesContainer)
+        q = q.filter(KubernetesContainer.user_id.isnot(None))
         q = q.filter(
             KubernetesContainer.start_time >=
             datetime.datetime.now() - datetime.timedelta(seconds=timeout)
@@ -65,6 +186,7 @@ class DBContainer:
         timeout = int(get_config("kubernetes:docker_timeout", "3600"))
 
         q = db.session.query(KubernetesContainer)
+        q = q.filter(KubernetesContainer.user_id.isnot(None))
         q = q.filter(
             KubernetesContainer.start_time >=
             datetime.datetime.now() - datetime.timedelta(seconds=timeout)
@@ -77,12 +199,118 @@ class DBContainer:
         timeout = int(get_config("kubernetes:docker_timeout", "3600"))
 
         q = db.session.query(KubernetesContainer)
+        q = q.filter(KubernetesContainer.user_id.isnot(None))
         q = q.filter(
             KubernetesContainer.start_time >=
             datetime.datetime.now() - datetime.timedelta(seconds=timeout)
         )
         return q.count()
 
+    @staticmethod
+    def get_containers_by_filter(challenge_id=None, user_ids=None, older_than=None):
+        q = db.session.query(KubernetesContainer)
+        q = q.filter(KubernetesContainer.user_id.isnot(None))
+        if challenge_id is not None:
+            q = q.filter(KubernetesContainer.challenge_id == challenge_id)
+        if user_ids is not None:
+            q = q.filter(KubernetesContainer.user_id.in_(user_ids))
+        if older_than is not None:
+            q = q.filter(
+                KubernetesContainer.start_time <
+                datetime.datetime.now() - datetime.timedelta(seconds=older_than)
+            )
+        return q.order_by(KubernetesContainer.id).all()
+
+    @staticmethod
+    def renew_containers(containers):
+        if not containers:
+            return
+        q = db.session.query(KubernetesContainer)
+        q = q.filter(KubernetesContainer.id.in_([c.id for c in containers]))
+        q.update({
+            KubernetesContainer.start_time: datetime.datetime.now(),
+            KubernetesContainer.renew_count: KubernetesContainer.renew_count + 1,
+        }, synchronize_session=False)
+        db.session.commit()
+        forget_instances(user_ids=[c.user_id for c in containers])
+
+    @staticmethod
+    def get_scheduled_counts():
+        # instances which take (or are about to take) cluster resources, per challenge
+        q = db.session.query(KubernetesContainer.challenge_id, func.count(KubernetesContainer.id))
+        q = q.filter(KubernetesContainer.status.in_(
+            [ContainerStatus.PENDING, ContainerStatus.SCHEDULING, ContainerStatus.READY]
+        ))
+        q = q.filter(KubernetesContainer.shared.is_(False))
+        return dict(q.group_by(KubernetesContainer.challenge_id).all())
+
+    @staticmethod
+    def get_status_counts():
+        # (challenge id, status, warm pool) -> count, for the metrics endpoint
+        q = db.session.query(
+            KubernetesContainer.challenge_id, KubernetesContainer.status,
+            KubernetesContainer.user_id.is_(None), func.count(KubernetesContainer.id)
+        )
+        q = q.group_by(
+            KubernetesContainer.challenge_id, KubernetesContainer.status, KubernetesContainer.user_id.is_(None)
+        )
+        return {(challenge_id, status, bool(pool)): count for challenge_id, status, pool, count in q.all()}
+
+    @staticmethod
+    def get_shared_user_counts():
+        q = db.session.query(KubernetesContainer.challenge_id, func.count(KubernetesContainer.id))
+        q = q.filter(KubernetesContainer.shared.is_(True))
+        q = q.filter(KubernetesContainer.status != ContainerStatus.FAILED)
+        return dict(q.group_by(KubernetesContainer.challenge_id).all())
+
+    @staticmethod
+    def get_shared_containers(challenge_id):
+        q = db.session.query(KubernetesContainer)
+        q = q.filter(KubernetesContainer.shared.is_(True))
+        q = q.filter(KubernetesContainer.challenge_id == challenge_id)
+        return q.all()
+
+    @staticmethod
+    def get_queued_containers():
+        q = db.session.query(KubernetesContainer)
+        q = q.filter(KubernetesContainer.status == ContainerStatus.QUEUED)
+        return q.order_by(KubernetesContainer.id).all()
+
+    @staticmethod
+    def get_queue_position(container_id):
+        q = db.session.query(KubernetesContainer)
+        q = q.filter(KubernetesContainer.status == ContainerStatus.QUEUED)
+        q = q.filter(KubernetesContainer.id <= container_id)
+        return q.count()
+
+    @staticmethod
+    def admit_queued_container(container):
+        container.status = ContainerStatus.PENDING
+        container.status_time = datetime.datetime.now()
+        # the lifetime starts once it actually gets to run
+        container.start_time = container.status_time
+        db.session.commit()
+        forget_instances(user_ids=[container.user_id])
+
+    @staticmethod
+    def get_quota_usage(by_team=False):
+        # instances holding a quota slot: owned, dedicated and not failed
+        q = db.session.query(KubernetesContainer)
+        q = q.filter(KubernetesContainer.user_id.isnot(None))
+        q = q.filter(KubernetesContainer.shared.is_(False))
+        q = q.filter(KubernetesContainer.status != ContainerStatus.FAILED)
+        challenges = q.with_entities(
+            KubernetesContainer.challenge_id, func.count(KubernetesContainer.id)
+        ).group_by(KubernetesContainer.challenge_id).all()
+        teams = []
+        if by_team:
+            teams = q.join(Users, Users.id == KubernetesContainer.user_id).filter(
+                Users.team_id.isnot(None)
+            ).with_entities(
+                Users.team_id, func.count(KubernetesContainer.id)
+            ).group_by(Users.team_id).all()
+        return dict(challenges), dict(teams)
+
 
 class DBRedirectTemplate:
     @staticmethod
@@ -0,0 +1,236 @@
+import threading
+import time
+import traceback
+
+from kubernetes import watch
+from kubernetes.client.rest import ApiException
+
+CHAL_ID_LABEL = "chal-id"
+
+
+def get_chal_id(obj):
+    return (obj.metadata.labels or {}).get(CHAL_ID_LABEL)
+
+
+def get_external_ip(node):
+    if node is None or node.status is None:
+        return None
+    for addr in node.status.addresses or []:
+        if addr.type == "ExternalIP":
+            return addr.address
+    return None
+
+
+class Store:
+    def __init__(self, index_func=None):
+        self.objects = {}
+        self.index = {}
+        self.index_func = index_func
+
+    @staticmethod
+    def key(obj):
+        return obj.metadata.namespace, obj.metadata.name
+
+    def _unindex(self, key):
+        old = self.objects.get(key)
+        if old is None or self.index_func is None:
+            return old
+        value = self.index_func(old)
+        keys = self.index.get(value)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.index[value]
+        return old
+
+    def upsert(self, obj):
+        key = self.key(obj)
+        old = self._unindex(key)
+        self.objects[key] = obj
+        if self.index_func is not None:
+            self.index.setdefault(self.index_func(obj), set()).add(key)
+        return old
+
+    def remove(self, obj):
+        key = self.key(obj)
+        old = self._unindex(key)
+        self.objects.pop(key, None)
+        return old
+
+    def replace(self, objs, namespace=None):
+        # several namespaces may share a store, a relist only replaces its own
+        if namespace is None:
+            self.objects = {}
+            self.index = {}
+        else:
+            for key in [key for key in self.objects if key[0] == namespace]:
+                self._unindex(key)
+                del self.objects[key]
+        for obj in objs:
+            self.upsert(obj)
+
+    def get(self, namespace, name):
+        return self.objects.get((namespace, name))
+
+    def by_index(self, value):
+        return [self.objects[key] for key in self.index.get(value, ())]
+
+
+class Reflector:
+    # list once, then keep the store up to date with a watch resumed from the
+    # last seen resourceVersion; only a 410 Gone forces a full relist
+    watch_timeout = 300
+    retry_interval = 5
+
+    def __init__(self, kind, store, list_func, **kwargs):
+        self.kind = kind
+        self.store = store
+        self.list_func = list_func
+        self.kwargs = kwargs
+        self.resource_version = None
+        self.synced = False
+        self.stopped = False
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.run, name=f"ctfd-kubernetes-informer-{self.kind}", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+
+    def relist(self):
+        result = self.list_func(**self.kwargs)
+        with KubernetesInformer.lock:
+            self.store.replace(result.items, self.kwargs.get("namespace"))
+        self.resource_version = result.metadata.resource_version
+        self.synced = True
+        KubernetesInformer.dispatch(self.kind, "SYNC", None, None)
+
+    def run(self):
+        while not self.stopped:
+            try:
+                if self.resource_version is None:
+                    self.relist()
+                self.watch()
+            except ApiException as e:
+                if e.status == 410:
+                    self.resource_version = None
+                    continue
+                print(traceback.format_exc())
+                time.sleep(self.retry_interval)
+            except Exception:
+                print(traceback.format_exc())
+                time.sleep(self.retry_interval)
+
+    def watch(self):
+        w = watch.Watch()
+        for event in w.stream(
+            self.list_func,
+            resource_version=self.resource_version,
+            timeout_seconds=self.watch_timeout,
+            allow_watch_bookmarks=True,
+            **self.kwargs,
+        ):
+            if self.stopped:
+                w.stop()
+                break
+            event_type, obj = event["type"], event["object"]
+            if event_type == "BOOKMARK":
+                self.resource_version = event["raw_object"]["metadata"]["resourceVersion"]
+                continue
+            with KubernetesInformer.lock:
+                if event_type == "DELETED":
+                    old = self.store.remove(obj)
+                else:
+                    old = self.store.upsert(obj)
+            self.resource_version = obj.metadata.resource_version
+            KubernetesInformer.dispatch(self.kind, event_type, obj, old)
+
+
+class KubernetesInformer:
+    lock = threading.RLock()
+    pods = Store(get_chal_id)
+    services = Store(get_chal_id)
+    nodes = Store()
+    _reflectors = []
+    _handlers = []
+
+    @staticmethod
+    def start(core_v1, namespaces):
+        KubernetesInformer.stop()
+        selector = CHAL_ID_LABEL  # only objects carrying the label at all
+        # one watch per namespace shard keeps every list/watch small
+        KubernetesInformer._reflectors = [Reflector("node", KubernetesInformer.nodes, core_v1.list_node)]
+        for namespace in namespaces:
+            KubernetesInformer._reflectors += [
+                Reflector(
+                    "pod", KubernetesInformer.pods, core_v1.list_namespaced_pod,
+                    namespace=namespace, label_selector=selector,
+                ),
+                Reflector(
+                    "service", KubernetesInformer.services, core_v1.list_namespaced_service,
+                    namespace=namespace, label_selector=selector,
+                ),
+            ]
+        for reflector in KubernetesInformer._reflectors:
+            reflector.start()
+
+    @staticmethod
+    def stop():
+        for reflector in KubernetesInformer._reflectors:
+            reflector.stop()
+        KubernetesInformer._reflectors = []
+
+    @staticmethod
+    def has_synced():
+        reflectors = KubernetesInformer._reflectors
+        return bool(reflectors) and all(r.synced for r in reflectors)
+
+    @staticmethod
+    def add_handler(handler):
+        # handler(kind, event_type, obj, old_obj), called from the watch threads
+        if handler not in KubernetesInformer._handlers:
+            KubernetesInformer._handlers.append(handler)
+
+    @staticmethod
+    def dispatch(kind, event_type, obj, old):
+        for handler in KubernetesInformer._handlers:
+            try:
+                handler(kind, event_type, obj, old)
+            except Exception:
+                print(traceback.format_exc())
+
+    @staticmethod
+    def get_pods(chal_id):
+        with KubernetesInformer.lock:
+            return KubernetesInformer.pods.by_index(chal_id)
+
+    @staticmethod
+    def get_services(chal_id):
+        with KubernetesInformer.lock:
+            return KubernetesInformer.services.by_index(chal_id)
+
+    @staticmethod
+    def get_chal_ids():
+        # chal-id -> (namespaces it has objects in, whether any of them is a pod)
+        result = {}
+        with KubernetesInformer.lock:
+            for store, is_pod in ((KubernetesInformer.pods, True), (KubernetesInformer.services, False)):
+                for chal_id, keys in store.index.items():
+                    namespaces, has_pod = result.get(chal_id, (set(), False))
+                    namespaces.update(namespace for namespace, _ in keys)
+                    result[chal_id] = (namespaces, has_pod or (is_pod and bool(keys)))
+        return result
+
+    @staticmethod
+    def get_nodes():
+        with KubernetesInformer.lock:
+            return list(KubernetesInformer.nodes.objects.values())
+
+    @staticmethod
+    def get_node(name):
+        with KubernetesInformer.lock:
+            return KubernetesInformer.nodes.get(None, name)
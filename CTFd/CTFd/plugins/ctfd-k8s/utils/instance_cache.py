@@ -0,0 +1,116 @@
+from CTFd.cache import cache
+
+from .db import CONNECTION_KEY, INSTANCE_KEY, DBContainer, forget_instances
+from .informer import KubernetesInformer, get_chal_id, get_external_ip
+from .provision import ProvisionQueue
+from .routers import Router
+
+
+def get_phase(pod):
+    return pod.status.phase if pod is not None and pod.status else None
+
+
+def get_uuid(chal_id):
+    # chal ids are "<user id or pool>-<uuid>"
+    return chal_id.split("-", 1)[1] if chal_id and "-" in chal_id else None
+
+
+class InstanceCache:
+    # the challenge modal polls the instance state every few seconds, so the owner's
+    # current instance and its connection string are kept in the cache; every row change
+    # in DBContainer drops them and informer events refresh the connection in place
+    instance_timeout = 60
+    connection_timeout = 86400
+
+    @staticmethod
+    def init():
+        KubernetesInformer.add_handler(InstanceCache.handle_event)
+
+    @staticmethod
+    def get_instance(user_id):
+        key = INSTANCE_KEY.format(user_id)
+        snapshot = cache.get(key)
+        if snapshot is None:
+            container = DBContainer.get_current_containers(user_id=user_id)
+            snapshot = {}
+            if container:
+                snapshot = {
+                    "id": container.id,
+                    "uuid": container.uuid,
+                    "challenge_id": container.challenge_id,
+                    "challenge_name": container.challenge.name,
+                    "status": container.status,
+                    "message": container.message,
+                    "start_time": container.start_time,
+                }
+            cache.set(key, snapshot, timeout=InstanceCache.instance_timeout)
+        return snapshot
+
+    @staticmethod
+    def get_access(snapshot):
+        key = CONNECTION_KEY.format(snapshot["uuid"])
+        connection = cache.get(key)
+        if connection is None:
+            container = DBContainer.get_container_by_id(snapshot["id"])
+            connection = {
+                "format": container.challenge.connection_format,
+                "host": container.host,
+                "ports": container.ports,
+                "token": Router.get_token(container),
+                "access": Router.access(container),
+            }
+            cache.set(key, connection, timeout=InstanceCache.connection_timeout)
+        return connection["access"]
+
+    @staticmethod
+    def refresh(chal_id):
+        # runs on a provision worker, which has the app context the cache needs
+        if Router.name != "k8s":
+            return  # only node ports follow the pod around
+        uuid = get_uuid(chal_id)
+        if chal_id.startswith("shared-"):
+            # too many players to patch one by one, they are rebuilt on their next poll
+            forget_instances(uuids=[c.uuid for c in DBContainer.get_shared_containers(int(uuid))])
+            return
+        key = CONNECTION_KEY.format(uuid)
+        connection = cache.get(key)
+        if connection is None:
+            return  # never looked at, or not registered yet
+        host = None
+        for pod in KubernetesInformer.get_pods(chal_id):
+            if pod.spec.node_name and get_phase(pod) == "Running":
+                host = get_external_ip(KubernetesInformer.get_node(pod.spec.node_name))
+                if host:
+                    break
+        services = KubernetesInformer.get_services(chal_id)
+        ports = [port.node_port for port in services[0].spec.ports] if services else connection["ports"]
+        if host is None or (host, ports) == (connection["host"], connection["ports"]):
+            return
+        connection.update(
+            host=host, ports=ports,
+            access=Router.render_access(connection["format"], host, ports, connection.get("token", "")),
+        )
+        cache.set(key, connection, timeout=InstanceCache.connection_timeout)
+        DBContainer.set_connection_info(uuid, host, ports)
+
+    @staticmethod
+    def handle_event(kind, event_type, obj, old):
+        if obj is None or event_type == "DELETED":
+            return
+        chal_ids = set()
+        if kind == "pod":
+            moved = old is None or old.spec.node_name != obj.spec.node_name
+            started = get_phase(old) != "Running" and get_phase(obj) == "Running"
+            if obj.spec.node_name and (moved or started):
+                chal_ids.add(get_chal_id(obj))
+        elif kind == "service":
+            chal_ids.add(get_chal_id(obj))
+        elif kind == "node" and old is not None and get_external_ip(old) != get_external_ip(obj):
+            with KubernetesInformer.lock:
+                pods = list(KubernetesInformer.pods.objects.values())
+            chal_ids.update(
+                get_chal_id(pod) for pod in pods if pod.spec.node_name == obj.metadata.name
+            )
+        for chal_id in chal_ids:
+            if get_uuid(chal_id):
+                ProvisionQueue.submit(InstanceCache.refresh, chal_id)
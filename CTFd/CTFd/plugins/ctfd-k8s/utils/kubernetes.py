@@ -1,116 +1,258 @@
-import json
-import random
-import uuid
-from collections import OrderedDict
+import logging
+import traceback
 
 from kubernetes import client, config
-import subprocess
-from flask import current_app
+from kubernetes.client.rest import ApiException
 
-from CTFd.utils import get_config, logging
-from CTFd.models import db
+from CTFd.utils import get_config
 
 from ..models import KubernetesContainer
-from .cache import CacheProvider
 from .exceptions import KubernetesError
+from .informer import KubernetesInformer, get_external_ip
+from .metrics import API, PHASE, Metrics
+from .resources import inject_resources
+from .template import TemplateCache, api_class_name, snake_case
 
-from tempfile import NamedTemporaryFile
 from hashlib import sha256
-from contextlib import contextmanager
 
 
-def get_challenge_id(container: KubernetesContainer):
-    chal_id = f"{container.user_id}-{container.uuid}"
+def make_challenge_id(user_id, uuid):
+    # warm pool instances are not owned by anyone yet
+    chal_id = f"{user_id if user_id is not None else 'pool'}-{uuid}"
     short_id = sha256(chal_id.encode()).hexdigest()[:16]
     return chal_id, short_id
 
 
-@contextmanager
-def get_templated_yaml(container: KubernetesContainer):
+def shared_challenge_id(challenge_id):
+    return make_challenge_id("shared", challenge_id)
+
+
+def get_challenge_id(container: KubernetesContainer):
+    if container.shared:
+        return shared_challenge_id(container.challenge_id)
+    return make_challenge_id(container.user_id, container.uuid)
+
+
+def get_templated_documents(container: KubernetesContainer):
     chal_id, short_id = get_challenge_id(container)
-    flag = container.flag
-    with NamedTemporaryFile("w", suffix=".yaml") as tmpf:
-        formatted_yaml = container.challenge.kubernetes_config.format(
-            id=chal_id, short_id=short_id, flag=container.flag
-        )
-        if f"chal-id: '{chal_id}'" not in formatted_yaml:
-            # some sanity check
-            raise KubernetesError(
-                "Kubernetes Config Error\n"
-                "The challenge config must contain templated chal-id as label"
-            )
-        tmpf.write(formatted_yaml)
-        tmpf.flush()
-        yield tmpf
+    documents = TemplateCache.get(container.challenge).render(
+        id=chal_id, short_id=short_id, flag=container.flag
+    )
+    return inject_resources(documents, container.challenge)
+
+
+def get_namespaces():
+    namespaces = (get_config("kubernetes:kubernetes_namespaces") or "").split(",")
+    return [ns.strip() for ns in namespaces if ns.strip()] or [
+        get_config("kubernetes:kubernetes_namespace", "default")
+    ]
+
+
+def pick_namespace(user_id, challenge_id, uuid, shard_by=None):
+    # stable for the lifetime of an instance since the result is stored on its row
+    namespaces = get_namespaces()
+    if (shard_by or get_config("kubernetes:namespace_shard_by", "challenge")) == "user":
+        key = f"user-{user_id}" if user_id is not None else f"pool-{uuid}"
+    else:
+        key = f"challenge-{challenge_id}"
+    return namespaces[int(sha256(key.encode()).hexdigest()[:8], 16) % len(namespaces)]
+
 
+def get_namespace_for_challenge(challenge_id):
+    return pick_namespace(None, challenge_id, None, shard_by="challenge")
 
-def get_namespace():
+
+def get_namespace(container=None):
+    if container is not None and container.namespace:
+        return container.namespace
     return get_config("kubernetes:kubernetes_namespace", "default")
 
 
+class TimedApiClient(client.ApiClient):
+    # every api group goes through call_api, watches excepted since they stay open on purpose
+    def call_api(self, resource_path, method, *args, **kwargs):
+        if kwargs.get("_preload_content", True) is False:
+            return super().call_api(resource_path, method, *args, **kwargs)
+        with Metrics.timer(API, method=method):
+            return super().call_api(resource_path, method, *args, **kwargs)
+
+
 class KubernetesUtils:
+    api_client = None
+    v1 = None
+    _apis = {}
+
     @staticmethod
     def init():
         try:
             config.load_kube_config()
-            KubernetesUtils.v1 = client.CoreV1Api()
-            subprocess.run(["kubectl", "version"], check=True)
+            # one ApiClient (and therefore one urllib3 connection pool) shared by every api group
+            KubernetesUtils.api_client = TimedApiClient()
+            KubernetesUtils._apis = {}
+            KubernetesUtils.v1 = client.CoreV1Api(KubernetesUtils.api_client)
+            client.VersionApi(KubernetesUtils.api_client).get_code()
         except Exception:
             raise KubernetesError("Kubernetes Connection Error\n")
+        KubernetesUtils.ensure_namespaces(get_namespaces())
+        KubernetesInformer.start(KubernetesUtils.v1, get_namespaces())
 
     @staticmethod
-    def add_container(container: KubernetesContainer):
-        chal_id, short_id = get_challenge_id(container)
-        chal_selector = f"chal-id={chal_id}"
-        with get_templated_yaml(container) as tmpf:
-            proc = subprocess.run(
-                ["kubectl", "apply", "-f", tmpf.name, "--namespace", get_namespace()],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-            )
-            if proc.returncode != 0:
-                raise KubernetesError(
-                    "Kubernetes Apply Error\n"
-                    f"{proc.stdout.decode()}\n{proc.stderr.decode()}"
+    def ensure_namespaces(namespaces):
+        for namespace in namespaces:
+            try:
+                KubernetesUtils.v1.create_namespace(
+                    client.V1Namespace(metadata=client.V1ObjectMeta(name=namespace))
                 )
-            services = KubernetesUtils.v1.list_namespaced_service(
-                namespace=get_namespace(), label_selector=chal_selector
-            ).items
-            if len(services) == 0:
+            except ApiException as e:
+                if e.status != 409:
+                    # may lack the permission, the namespace has to be created by hand then
+                    print(f"[CTFd Kubernetes] Failed to create namespace {namespace}: {e.reason}")
+
+    @staticmethod
+    def get_api(api_version):
+        api = KubernetesUtils._apis.get(api_version)
+        if api is None:
+            api_cls = getattr(client, api_class_name(api_version), None)
+            if api_cls is None:
                 raise KubernetesError(
-                    "Kubernetes Service Error\n" "Failed to apply service"
+                    "Kubernetes Config Error\n"
+                    f"Unsupported apiVersion {api_version}"
                 )
-            service = services[0]
-            logging.log(
-                "kubernetes",
-                f"Created {service.metadata.name} {[(p.node_port, p.port, p.target_port) for p in service.spec.ports]}",
+            api = api_cls(KubernetesUtils.api_client)
+            KubernetesUtils._apis[api_version] = api
+        return api
+
+    @staticmethod
+    def _get_method(doc, verb):
+        api = KubernetesUtils.get_api(doc.get("apiVersion", ""))
+        method = getattr(api, f"{verb}_namespaced_{snake_case(doc.get('kind', ''))}", None)
+        if method is None:
+            raise KubernetesError(
+                "Kubernetes Config Error\n"
+                f"Unsupported kind {doc.get('kind')} ({doc.get('apiVersion')})"
+            )
+        return method
+
+    @staticmethod
+    def apply_documents(documents, namespace):
+        results = []
+        for doc in documents:
+            try:
+                results.append(KubernetesUtils._get_method(doc, "create")(namespace=namespace, body=doc))
+            except ApiException as e:
+                if e.status != 409:
+                    raise KubernetesError(f"Kubernetes Apply Error\n{e.reason}\n{e.body}")
+                # already exists, converge it to the template like `kubectl apply`
+                results.append(KubernetesUtils._get_method(doc, "patch")(
+                    name=doc["metadata"]["name"], namespace=namespace, body=doc
+                ))
+        return results
+
+    @staticmethod
+    def delete_kinds(kinds, namespace, label_selector):
+        for api_version, kind in kinds:
+            doc = {"apiVersion": api_version, "kind": kind}
+            try:
+                delete = KubernetesUtils._get_method(doc, "delete_collection")
+                delete(namespace=namespace, label_selector=label_selector)
+            except ApiException as e:
+                if e.status == 405:
+                    # Services only support deletecollection since Kubernetes 1.23
+                    KubernetesUtils.delete_each(doc, namespace, label_selector)
+                elif e.status != 404:
+                    raise KubernetesError(f"Kubernetes Delete Error\n{e.reason}\n{e.body}")
+
+    @staticmethod
+    def delete_each(doc, namespace, label_selector):
+        try:
+            items = KubernetesUtils._get_method(doc, "list")(
+                namespace=namespace, label_selector=label_selector
+            ).items
+            for item in items:
+                try:
+                    KubernetesUtils._get_method(doc, "delete")(name=item.metadata.name, namespace=namespace)
+                except ApiException as e:
+                    if e.status != 404:
+                        raise
+        except ApiException as e:
+            raise KubernetesError(f"Kubernetes Delete Error\n{e.reason}\n{e.body}")
+
+    @staticmethod
+    def delete_batch(namespace, kinds, members):
+        # members: [(id, chal id)], deleted with one selector; returns the ids whose objects
+        # are gone, none if the delete failed so they are retried on the next run
+        selector = f"chal-id in ({','.join(chal_id for _, chal_id in members)})"
+        try:
+            with Metrics.timer(PHASE, phase="reap"):
+                KubernetesUtils.delete_kinds(kinds, namespace, selector)
+        except Exception:
+            print(traceback.format_exc())
+            return []
+        return [member_id for member_id, _ in members]
+
+    @staticmethod
+    def add_container(container: KubernetesContainer):
+        objects = KubernetesUtils.apply_documents(get_templated_documents(container), get_namespace(container))
+        services = [obj for obj in objects if isinstance(obj, client.V1Service)]
+        if len(services) == 0:
+            raise KubernetesError(
+                "Kubernetes Service Error\n" "Failed to apply service"
             )
+        service = services[0]
+        # provisioning runs outside of any request, so CTFd.utils.logging.log can't be used here
+        logging.getLogger("kubernetes").info(
+            f"Created {service.metadata.name} {[(p.node_port, p.port, p.target_port) for p in service.spec.ports]}",
+        )
 
     @staticmethod
     def get_container_connection_info(container: KubernetesContainer):
         chal_id, short_id = get_challenge_id(container)
         chal_selector = f"chal-id={chal_id}"
-        services = KubernetesUtils.v1.list_namespaced_service(
-            namespace=get_namespace(), label_selector=chal_selector
-        ).items
+        services = KubernetesInformer.get_services(chal_id)
+        pods = KubernetesInformer.get_pods(chal_id)
+        # the watch may lag right behind our own create calls, so fall back to a selective LIST
+        if not services:
+            services = KubernetesUtils.v1.list_namespaced_service(
+                namespace=get_namespace(container), label_selector=chal_selector
+            ).items
+        if not pods or not pods[0].spec.node_name:
+            pods = KubernetesUtils.v1.list_namespaced_pod(
+                namespace=get_namespace(container), label_selector=chal_selector
+            ).items
         service = services[0]
         ports = [port.node_port for port in service.spec.ports]
-        pods = KubernetesUtils.v1.list_namespaced_pod(
-            namespace=get_namespace(), label_selector=chal_selector
-        ).items
         target_node_name = pods[0].spec.node_name
-        nodes = KubernetesUtils.v1.list_node()
-        node = [n for n in nodes.items if n.metadata.name == target_node_name][0]
-        external_ip = [
-            addr.address for addr in node.status.addresses if addr.type == "ExternalIP"
-        ][0]
+        node = KubernetesInformer.get_node(target_node_name)
+        if node is None:
+            node = KubernetesUtils.v1.read_node(target_node_name)
+        external_ip = get_external_ip(node)
+        if external_ip is None:
+            raise KubernetesError(f"Kubernetes Node Error\nNode {target_node_name} has no ExternalIP")
         return external_ip, ports
 
     @staticmethod
-    def remove_container(container):
+    def relabel_container(container: KubernetesContainer, old_short_id):
+        chal_id, _ = get_challenge_id(container)
+        patches = TemplateCache.get(container.challenge).relabel_patches(
+            id=chal_id, short_id=old_short_id, flag=container.flag
+        )
+        for api_version, kind, name, patch in patches:
+            if not patch:
+                continue
+            try:
+                KubernetesUtils._get_method({"apiVersion": api_version, "kind": kind}, "patch")(
+                    name=name, namespace=get_namespace(container), body=patch
+                )
+            except ApiException as e:
+                raise KubernetesError(f"Kubernetes Patch Error\n{e.reason}\n{e.body}")
+
+    @staticmethod
+    def remove_container(container, extra_kinds=()):
+        if container.shared:
+            return  # the deployment outlives any one player
         chal_id, short_id = get_challenge_id(container)
         chal_selector = f"chal-id={chal_id}"
-        with get_templated_yaml(container) as tmpf:
-            subprocess.run(
-                ["kubectl", "delete", "-f", tmpf.name, "--namespace", get_namespace()]
-            )
+        KubernetesUtils.delete_kinds(
+            TemplateCache.get(container.challenge).kinds + list(extra_kinds),
+            get_namespace(container), chal_selector
+        )
@@ -0,0 +1,73 @@
+import atexit
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+
+from .cache import CacheProvider
+
+
+class LeaderElection:
+    # exactly one CTFd process across all hosts holds the lease and runs the
+    # background jobs; a dead leader is replaced once its lease expires
+    lease_key = "ctfd_kubernetes-leader"
+    lease_ttl = 15
+    renew_interval = 5
+    owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    provider = None
+    _lease_until = 0
+    _thread = None
+
+    @staticmethod
+    def init(app):
+        LeaderElection.provider = CacheProvider(app=app)
+        if LeaderElection._thread is None:
+            LeaderElection._thread = threading.Thread(
+                target=LeaderElection._campaign, name="ctfd-kubernetes-leader", daemon=True
+            )
+            LeaderElection._thread.start()
+            atexit.register(LeaderElection.resign)
+
+    @staticmethod
+    def is_leader():
+        # only trust the lease while it can't have expired on the redis side yet
+        return time.time() < LeaderElection._lease_until
+
+    @staticmethod
+    def try_acquire():
+        started = time.time()
+        was_leader = LeaderElection.is_leader()
+        try:
+            acquired = LeaderElection.provider.acquire_lease(
+                LeaderElection.lease_key, LeaderElection.owner, LeaderElection.lease_ttl
+            )
+        except Exception:
+            print(traceback.format_exc())
+            acquired = False
+        # leave a second of slack for clock drift and the round trip
+        LeaderElection._lease_until = started + LeaderElection.lease_ttl - 1 if acquired else 0
+        if acquired != was_leader:
+            logging.getLogger("kubernetes").info(
+                f"{LeaderElection.owner} {'became' if acquired else 'is no longer'} the leader"
+            )
+        return acquired
+
+    @staticmethod
+    def resign():
+        if not LeaderElection.is_leader():
+            return
+        LeaderElection._lease_until = 0
+        try:
+            # hand over right away instead of letting the followers wait out the ttl
+            LeaderElection.provider.release_lease(LeaderElection.lease_key, LeaderElection.owner)
+        except Exception:
+            print(traceback.format_exc())
+
+    @staticmethod
+    def _campaign():
+        while True:
+            LeaderElection.try_acquire()
+            time.sleep(LeaderElection.renew_interval)
@@ -0,0 +1,141 @@
+import time
+import traceback
+from contextlib import contextmanager
+
+from .cache import CacheProvider
+
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+PHASE = "ctfd_kubernetes_phase_seconds"
+API = "ctfd_kubernetes_api_seconds"
+FAILURES = "ctfd_kubernetes_failures_total"
+
+# the only reasons FAILURES is labelled with, free-form messages would add a series per message
+FAILURE_REASONS = (
+    "unschedulable",  # needs more resources than any node has
+    "create_error",  # applying the manifests failed
+    "register_error",  # routing the instance failed
+    "exited",  # the pods exited before becoming ready
+    "timeout",  # not ready within kubernetes:launch_timeout
+    "disappeared",  # its objects were deleted behind our back
+    "destroy_error",
+    "other",
+)
+
+# name -> (type, help); gauges are not stored, they are collected when scraped
+FAMILIES = {
+    PHASE: (
+        "histogram",
+        "Time spent in each phase of an instance's life: queue (waiting for capacity), apply, "
+        "scheduling (applied until running), register (service lookup and routing), "
+        "launch (admission until ready), teardown and reap (one batched delete of the reaper)",
+    ),
+    API: ("histogram", "Latency of Kubernetes API server calls"),
+    FAILURES: ("counter", "Instances that failed, by reason"),
+    "ctfd_kubernetes_instances": ("gauge", "Instances by challenge and status"),
+    "ctfd_kubernetes_reaper_lag_seconds": ("gauge", "How far behind its deadline the oldest expired instance was"),
+    "ctfd_kubernetes_reaper_duration_seconds": ("gauge", "Duration of the last reaper run"),
+    "ctfd_kubernetes_drift": ("gauge", "Orphaned objects and dead rows found by the last reconciler run"),
+}
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels
+    )
+    return "{" + pairs + "}"
+
+
+class Metrics:
+    # counters and histograms live in one hash of the shared cache, so every worker
+    # process contributes to (and can serve) the same numbers
+    key = "ctfd_kubernetes-metrics"
+    provider = None
+
+    @staticmethod
+    def init(app):
+        Metrics.provider = CacheProvider(app=app)
+
+    @staticmethod
+    def _record(increments):
+        if Metrics.provider is None:
+            return
+        try:
+            Metrics.provider.incr_metrics(Metrics.key, increments)
+        except Exception:
+            # metrics must never get in the way of the instance itself
+            print(traceback.format_exc())
+
+    @staticmethod
+    def inc(name, amount=1, **labels):
+        Metrics._record({name + format_labels(sorted(labels.items())): amount})
+
+    @staticmethod
+    def failure(reason):
+        Metrics.inc(FAILURES, reason=reason if reason in FAILURE_REASONS else "other")
+
+    @staticmethod
+    def observe(name, seconds, **labels):
+        labels = sorted(labels.items())
+        increments = {
+            name + "_bucket" + format_labels(labels + [("le", str(bound))]): 1
+            for bound in BUCKETS if seconds <= bound
+        }
+        increments[name + "_bucket" + format_labels(labels + [("le", "+Inf")])] = 1
+        increments[name + "_sum" + format_labels(labels)] = seconds
+        increments[name + "_count" + format_labels(labels)] = 1
+        Metrics._record(increments)
+
+    @staticmethod
+    @contextmanager
+    def timer(name, **labels):
+        started = time.time()
+        try:
+            yield
+        finally:
+            Metrics.observe(name, time.time() - started, **labels)
+
+    @staticmethod
+    def render(gauges=()):
+        # gauges: (name, labels dict, value) collected by the caller at scrape time
+        series = {}
+        for field, value in Metrics.provider.get_metrics(Metrics.key).items():
+            series.setdefault(Metrics._family(field), []).append((field, value))
+        for name, labels, value in gauges:
+            series.setdefault(name, []).append((name + format_labels(sorted(labels.items())), value))
+
+        lines = []
+        for name in sorted(series):
+            kind, description = FAMILIES.get(name, ("untyped", ""))
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for field, value in sorted(series[name], key=Metrics._sort_key):
+                lines.append(f"{field} {Metrics._format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _sort_key(item):
+        # buckets of one series go by their numeric bound, with +Inf last
+        field, _ = item
+        head, sep, le = field.rpartition('le="')
+        if not sep or not field.endswith('"}'):
+            return field, 0
+        le = le[:-2]
+        return head, float("inf") if le == "+Inf" else float(le)
+
+    @staticmethod
+    def _format_value(value):
+        if isinstance(value, float) and not value.is_integer():
+            return repr(value)
+        return str(int(value))
+
+    @staticmethod
+    def _family(field):
+        name = field.split("{", 1)[0]
+        for suffix in ("_bucket", "_sum", "_count"):
+            if name.endswith(suffix) and name[:-len(suffix)] in FAMILIES:
+                return name[:-len(suffix)]
+        return name
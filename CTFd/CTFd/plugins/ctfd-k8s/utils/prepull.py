@@ -0,0 +1,153 @@
+import logging
+from hashlib import sha256
+
+from kubernetes.client.rest import ApiException
+
+from CTFd.utils import get_config
+
+from .exceptions import KubernetesError
+from .kubernetes import KubernetesUtils, get_namespace
+from .resources import get_pod_specs
+from .template import TemplateCache
+from ..models import DynamicKubernetesChallenge
+
+PAUSE_IMAGE = "registry.k8s.io/pause:3.9"
+# a static busybox, so its binary runs inside any challenge image
+HELPER_IMAGE = "busybox:1.36-musl"
+
+
+class Prepull:
+    # a DaemonSet with one init container per challenge image makes every node (new ones
+    # from the autoscaler included) pull them ahead of the first launch; init containers only
+    # run a copied `true`, so the images don't need a shell
+    name = "ctfd-prepull"
+    digest_annotation = "ctfd-kubernetes/images"
+
+    @staticmethod
+    def is_enabled():
+        return get_config("kubernetes:prepull_images", "true") == "true"
+
+    @staticmethod
+    def get_images():
+        images, pull_secrets = set(), set()
+        q = DynamicKubernetesChallenge.query.filter(DynamicKubernetesChallenge.state == "visible")
+        for challenge in q.all():
+            try:
+                documents = TemplateCache.get(challenge).render(id="prepull", short_id="prepull", flag="")
+            except KubernetesError:
+                continue
+            for spec in get_pod_specs(documents):
+                for c in (spec.get("initContainers") or []) + (spec.get("containers") or []):
+                    if c.get("image"):
+                        images.add(c["image"])
+                for secret in spec.get("imagePullSecrets") or []:
+                    if secret.get("name"):
+                        pull_secrets.add(secret["name"])
+        return sorted(images), sorted(pull_secrets)
+
+    @staticmethod
+    def get_daemonset(images, pull_secrets):
+        digest = sha256("\n".join(images).encode()).hexdigest()[:16]
+        resources = {"requests": {"cpu": "10m", "memory": "16Mi"}, "limits": {"cpu": "100m", "memory": "64Mi"}}
+        init_containers = [{
+            "name": "helper",
+            "image": HELPER_IMAGE,
+            "command": ["cp", "/bin/busybox", "/prepull/busybox"],
+            "volumeMounts": [{"name": "prepull", "mountPath": "/prepull"}],
+            "resources": resources,
+        }]
+        for i, image in enumerate(images):
+            init_containers.append({
+                "name": f"image-{i}",
+                "image": image,
+                "imagePullPolicy": "Always",  # refreshes moving tags whenever the set changes
+                "command": ["/prepull/busybox", "true"],
+                "volumeMounts": [{"name": "prepull", "mountPath": "/prepull"}],
+                "resources": resources,
+            })
+        return {
+            "apiVersion": "apps/v1",
+            "kind": "DaemonSet",
+            "metadata": {
+                "name": Prepull.name,
+                "labels": {"app": Prepull.name},
+                "annotations": {Prepull.digest_annotation: digest},
+            },
+            "spec": {
+                "selector": {"matchLabels": {"app": Prepull.name}},
+                "updateStrategy": {"type": "RollingUpdate", "rollingUpdate": {"maxUnavailable": "100%"}},
+                "template": {
+                    "metadata": {"labels": {"app": Prepull.name}},
+                    "spec": {
+                        "initContainers": init_containers,
+                        "containers": [{"name": "pause", "image": PAUSE_IMAGE, "resources": resources}],
+                        "imagePullSecrets": [{"name": name} for name in pull_secrets],
+                        "volumes": [{"name": "prepull", "emptyDir": {}}],
+                        "tolerations": [{"operator": "Exists"}],  # challenge nodes are often tainted
+                        "terminationGracePeriodSeconds": 0,
+                    },
+                },
+            },
+        }
+
+    @staticmethod
+    def sync():
+        apps = KubernetesUtils.get_api("apps/v1")
+        namespace = get_namespace()
+        images, pull_secrets = Prepull.get_images() if Prepull.is_enabled() else ([], [])
+        try:
+            current = apps.read_namespaced_daemon_set(name=Prepull.name, namespace=namespace)
+        except ApiException as e:
+            if e.status != 404:
+                raise KubernetesError(f"Kubernetes Read Error\n{e.reason}\n{e.body}")
+            current = None
+
+        try:
+            if not images:
+                if current is not None:
+                    apps.delete_namespaced_daemon_set(name=Prepull.name, namespace=namespace)
+                return
+            daemonset = Prepull.get_daemonset(images, pull_secrets)
+            if current is None:
+                apps.create_namespaced_daemon_set(namespace=namespace, body=daemonset)
+            elif (current.metadata.annotations or {}).get(Prepull.digest_annotation) != \
+                    daemonset["metadata"]["annotations"][Prepull.digest_annotation]:
+                # replaced rather than patched, a strategic merge would keep removed images
+                apps.replace_namespaced_daemon_set(name=Prepull.name, namespace=namespace, body=daemonset)
+            else:
+                return
+        except ApiException as e:
+            raise KubernetesError(f"Kubernetes Apply Error\n{e.reason}\n{e.body}")
+        logging.getLogger("kubernetes").info(f"Pre-pulling {len(images)} images")
+
+    @staticmethod
+    def get_status():
+        # per node: how many of the images the current pod has pulled, and what's wrong with the rest
+        if KubernetesUtils.v1 is None:
+            raise KubernetesError("Kubernetes is not connected")
+        pods = KubernetesUtils.v1.list_namespaced_pod(
+            namespace=get_namespace(), label_selector=f"app={Prepull.name}"
+        ).items
+        nodes = []
+        for pod in pods:
+            images = []
+            for status in pod.status.init_container_statuses or []:
+                if status.name == "helper":
+                    continue
+                state = "pending"
+                if status.state.terminated is not None:
+                    state = "pulled" if status.state.terminated.exit_code == 0 else status.state.terminated.reason
+                elif status.state.running is not None:
+                    state = "pulled"
+                elif status.state.waiting is not None and status.state.waiting.reason not in (
+                    None, "PodInitializing", "ContainerCreating"
+                ):
+                    state = status.state.waiting.reason
+                images.append({"image": status.image, "state": state})
+            nodes.append({
+                "node": pod.spec.node_name or "(unscheduled)",
+                "pulled": sum(1 for image in images if image["state"] == "pulled"),
+                "total": len(images),
+                "errors": [image for image in images if image["state"] not in ("pulled", "pending")],
+            })
+        return sorted(nodes, key=lambda node: node["node"])
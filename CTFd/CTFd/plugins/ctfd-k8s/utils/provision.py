@@ -0,0 +1,41 @@
+import queue
+import threading
+import traceback
+
+
+class ProvisionQueue:
+    # process-local work queue drained by a fixed number of worker threads
+    # (greenlets under the gevent worker), which bounds concurrent launches
+    _queue = queue.Queue()
+    _workers = []
+    app = None
+
+    @staticmethod
+    def init(app, concurrency):
+        ProvisionQueue.app = app
+        for i in range(len(ProvisionQueue._workers), concurrency):
+            worker = threading.Thread(
+                target=ProvisionQueue._work, name=f"ctfd-kubernetes-provision-{i}", daemon=True
+            )
+            worker.start()
+            ProvisionQueue._workers.append(worker)
+
+    @staticmethod
+    def submit(func, *args):
+        ProvisionQueue._queue.put((func, args))
+
+    @staticmethod
+    def size():
+        return ProvisionQueue._queue.qsize()
+
+    @staticmethod
+    def _work():
+        while True:
+            func, args = ProvisionQueue._queue.get()
+            try:
+                with ProvisionQueue.app.app_context():
+                    func(*args)
+            except Exception:
+                print(traceback.format_exc())
+            finally:
+                ProvisionQueue._queue.task_done()
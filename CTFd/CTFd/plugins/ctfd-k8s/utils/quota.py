@@ -0,0 +1,116 @@
+import time
+import traceback
+import uuid
+from collections import Counter
+
+from CTFd.models import Users, db
+from CTFd.utils import get_config
+from CTFd.utils.modes import TEAMS_MODE
+
+from .cache import CacheProvider
+from .db import DBContainer
+from ..models import ContainerStatus, DynamicKubernetesChallenge
+
+
+class Quota:
+    # slots are counted in one hash: "global", "challenge:<id>" and "team:<id>";
+    # an owned instance holds one slot of each from launch until it fails or is torn down
+    key = "ctfd_kubernetes-quota"
+    provider = None
+    # a reservation never settled within this long belongs to a launch that died half way
+    reservation_ttl = 600
+
+    @staticmethod
+    def init(app):
+        Quota.provider = CacheProvider(app=app)
+
+    @staticmethod
+    def _team_id(user):
+        if user is None or get_config("user_mode") != TEAMS_MODE:
+            return None
+        return user.team_id
+
+    @staticmethod
+    def _fields(challenge_id, team_id):
+        fields = ["global", f"challenge:{challenge_id}"]
+        if team_id is not None:
+            fields.append(f"team:{team_id}")
+        return fields
+
+    @staticmethod
+    def reserve(user_id, challenge_id):
+        challenge = DynamicKubernetesChallenge.query.filter_by(id=challenge_id).first()
+        team_id = Quota._team_id(Users.query.filter_by(id=user_id).first())
+        limits = [
+            int(get_config("kubernetes:docker_max_container_count", 0) or 0),
+            int(challenge.max_instances or 0) if challenge else 0,
+            int(get_config("kubernetes:team_max_container_count", 0) or 0),
+        ]
+        fields = Quota._fields(challenge_id, team_id)
+        # the reservation stays pending until its row is committed, see reconcile()
+        reservation = " ".join([uuid.uuid4().hex] + fields)
+        exhausted = Quota.provider.reserve_quota(Quota.key, list(zip(fields, limits)), reservation)
+        if exhausted == 0:
+            return True, reservation
+        return False, {
+            1: 'Max container count exceed.',
+            2: 'Max container count for this challenge exceed.',
+            3: 'Max container count for your team exceed.',
+        }[exhausted]
+
+    @staticmethod
+    def settle(reservation):
+        # its row is committed now, so from here on the database accounts for the slots
+        Quota.provider.settle_quota(Quota.key, reservation)
+
+    @staticmethod
+    def release_reservation(reservation):
+        Quota.provider.release_quota(
+            Quota.key, Counter(reservation.split()[1:]), reservation
+        )
+
+    @staticmethod
+    def slots(*containers):
+        # read off the columns while the rows are still around, release() works from these alone
+        owned = [
+            container for container in containers
+            # warm pool and shared instances never reserved anything, failed ones already gave it back
+            if container.user_id is not None and not container.shared
+            and container.status != ContainerStatus.FAILED
+        ]
+        teams = {}
+        if owned and get_config("user_mode") == TEAMS_MODE:
+            q = db.session.query(Users.id, Users.team_id)
+            teams = dict(q.filter(Users.id.in_({container.user_id for container in owned})).all())
+        counts = Counter()
+        for container in owned:
+            counts.update(Quota._fields(container.challenge_id, teams.get(container.user_id)))
+        return counts
+
+    @staticmethod
+    def release(slots):
+        if not slots:
+            return
+        try:
+            Quota.provider.release_quota(Quota.key, slots)
+        except Exception:
+            # the next reconcile puts the counters right again
+            print(traceback.format_exc())
+
+    @staticmethod
+    def reconcile():
+        # launches settled after this point may or may not be in the counts below, and
+        # pending ones aren't, the provider adds both on top rather than lose them
+        since = time.time()
+        challenges, teams = DBContainer.get_quota_usage(
+            by_team=get_config("user_mode") == TEAMS_MODE
+        )
+        usage = {"global": sum(challenges.values())}
+        usage.update({f"challenge:{k}": v for k, v in challenges.items()})
+        usage.update({f"team:{k}": v for k, v in teams.items()})
+        Quota.provider.reset_quota(Quota.key, usage, since, since - Quota.reservation_ttl)
+        return usage
+
+    @staticmethod
+    def get_usage():
+        return Quota.provider.get_quota(Quota.key)
@@ -0,0 +1,123 @@
+import threading
+import time
+
+from .informer import KubernetesInformer, get_chal_id, get_external_ip
+from .provision import ProvisionQueue
+
+
+class ReadinessTracker:
+    # chal_id -> {container_id: deadline}, several players may wait on one shared deployment;
+    # completion callbacks run on the provision workers
+    _pending = {}
+    # chal_id -> whether its pods only count as ready once their node has an ExternalIP
+    _needs_address = {}
+    _lock = threading.Lock()
+    _sweeper = None
+    sweep_interval = 5
+    on_ready = None
+    on_failed = None
+
+    @staticmethod
+    def init(on_ready, on_failed):
+        ReadinessTracker.on_ready = on_ready
+        ReadinessTracker.on_failed = on_failed
+        KubernetesInformer.add_handler(ReadinessTracker._handle_event)
+        if ReadinessTracker._sweeper is None:
+            ReadinessTracker._sweeper = threading.Thread(
+                target=ReadinessTracker._sweep, name="ctfd-kubernetes-readiness", daemon=True
+            )
+            ReadinessTracker._sweeper.start()
+
+    @staticmethod
+    def track(chal_id, container_id, timeout, needs_address=True):
+        with ReadinessTracker._lock:
+            ReadinessTracker._pending.setdefault(chal_id, {})[container_id] = time.time() + timeout
+            ReadinessTracker._needs_address[chal_id] = needs_address
+        # the pod may have become ready before we started tracking it
+        ReadinessTracker._check(chal_id)
+
+    @staticmethod
+    def untrack(chal_id, container_id=None):
+        with ReadinessTracker._lock:
+            if container_id is None:
+                ReadinessTracker._needs_address.pop(chal_id, None)
+                return ReadinessTracker._pending.pop(chal_id, None)
+            waiting = ReadinessTracker._pending.get(chal_id, {})
+            deadline = waiting.pop(container_id, None)
+            if not waiting:
+                ReadinessTracker._pending.pop(chal_id, None)
+                ReadinessTracker._needs_address.pop(chal_id, None)
+            return deadline
+
+    @staticmethod
+    def pending_count():
+        return sum(len(waiting) for waiting in ReadinessTracker._pending.values())
+
+    @staticmethod
+    def pod_state(chal_id, needs_address=True):
+        # returns "ready", "failed" or None while the pod is still on its way; one replica
+        # that is up is enough, and an exited one (evicted, OOM killed...) only fails the
+        # instance if no other replica can still become ready. Routers that don't reach
+        # instances on their node (see BaseRouter.needs_node_address) skip the address check
+        exited = waiting = False
+        for pod in KubernetesInformer.get_pods(chal_id):
+            phase = pod.status.phase if pod.status else None
+            if phase in ("Failed", "Succeeded"):
+                exited = True
+                continue
+            if phase == "Running" and pod.spec.node_name:
+                if not needs_address:
+                    return "ready"
+                if get_external_ip(KubernetesInformer.get_node(pod.spec.node_name)):
+                    return "ready"
+            waiting = True
+        if exited and not waiting:
+            return "failed"
+        return None
+
+    @staticmethod
+    def _check(chal_id):
+        state = ReadinessTracker.pod_state(chal_id, ReadinessTracker._needs_address.get(chal_id, True))
+        if state is None:
+            return
+        waiting = ReadinessTracker.untrack(chal_id)
+        if not waiting:
+            return  # someone else already resolved it
+        for container_id in waiting:
+            if state == "ready":
+                ProvisionQueue.submit(ReadinessTracker.on_ready, container_id)
+            else:
+                ProvisionQueue.submit(
+                    ReadinessTracker.on_failed, container_id, "Instance exited unexpectedly", "exited"
+                )
+
+    @staticmethod
+    def _handle_event(kind, event_type, obj, old):
+        if kind == "pod" and obj is not None:
+            chal_id = get_chal_id(obj)
+            if chal_id in ReadinessTracker._pending:
+                ReadinessTracker._check(chal_id)
+        elif kind == "node" or event_type == "SYNC":
+            # a new node got its address, recheck everything still waiting
+            for chal_id in list(ReadinessTracker._pending):
+                ReadinessTracker._check(chal_id)
+
+    @staticmethod
+    def _sweep():
+        while True:
+            time.sleep(ReadinessTracker.sweep_interval)
+            now = time.time()
+            with ReadinessTracker._lock:
+                expired = [
+                    (chal_id, container_id)
+                    for chal_id, waiting in ReadinessTracker._pending.items()
+                    for container_id, deadline in waiting.items()
+                    if deadline < now
+                ]
+            for chal_id, container_id in expired:
+                if ReadinessTracker.untrack(chal_id, container_id) is None:
+                    continue
+                ProvisionQueue.submit(
+                    ReadinessTracker.on_failed, container_id,
+                    "Timed out waiting for the instance to be scheduled", "timeout"
+                )
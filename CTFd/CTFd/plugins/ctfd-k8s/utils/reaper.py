@@ -0,0 +1,91 @@
+import datetime
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from CTFd.cache import cache
+from CTFd.utils import get_config
+
+from .db import DBContainer
+from .quota import Quota
+from .kubernetes import KubernetesUtils, get_challenge_id, get_namespace
+from .readiness import ReadinessTracker
+from .routers import Router
+from .template import TemplateCache
+
+
+class Reaper:
+    # label selectors have to stay reasonably short, so ids are deleted in chunks
+    batch_size = 50
+    stats_key = "kubernetes:reaper_stats"
+
+    @staticmethod
+    def run():
+        started = time.time()
+        timeout = int(get_config("kubernetes:docker_timeout", "3600"))
+        containers = DBContainer.get_all_expired_container()
+
+        lag = 0
+        if containers:
+            oldest = min(c.start_time for c in containers)
+            deadline = oldest + datetime.timedelta(seconds=timeout)
+            lag = max(0, (datetime.datetime.now() - deadline).total_seconds())
+
+        removed = Reaper.remove(containers)
+
+        stats = {
+            "expired": len(containers),
+            "removed": len(removed),
+            "lag": lag,
+            "duration": time.time() - started,
+            "last_run": started,
+        }
+        cache.set(Reaper.stats_key, stats, timeout=0)
+        return stats
+
+    @staticmethod
+    def remove(containers, progress=None):
+        # tears the instances down with batched deletes and returns the ids of the removed rows;
+        # progress(count) is called as batches finish
+        # namespace -> (kinds, [(container id, chal id)])
+        groups = {}
+        removed = []
+        for container in containers:
+            try:
+                ok, msg = Router.unregister(container)
+                if not ok:
+                    print(f"[CTFd Kubernetes] Failed to unregister {container.uuid}: {msg}")
+                    continue
+                chal_id, _ = get_challenge_id(container)
+                ReadinessTracker.untrack(chal_id, container.id)
+                if container.shared:
+                    removed.append(container.id)  # nothing of its own to delete
+                    continue
+                kinds, members = groups.setdefault(get_namespace(container), (set(), []))
+                kinds.update(TemplateCache.get(container.challenge).kinds)
+                kinds.update(Router.kinds)
+                members.append((container.id, chal_id))
+            except Exception:
+                print(traceback.format_exc())
+
+        batches = []
+        for namespace, (kinds, members) in groups.items():
+            for i in range(0, len(members), Reaper.batch_size):
+                batches.append((namespace, sorted(kinds), members[i:i + Reaper.batch_size]))
+
+        concurrency = int(get_config("kubernetes:reaper_concurrency", "4"))
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            results = executor.map(lambda batch: KubernetesUtils.delete_batch(*batch), batches)
+            for (_, _, members), result in zip(batches, results):
+                removed.extend(result)
+                if progress is not None:
+                    progress(len(members))
+        by_id = {container.id: container for container in containers}
+        slots = Quota.slots(*(by_id[container_id] for container_id in removed))
+        DBContainer.remove_container_records(removed)
+        Quota.release(slots)
+        return removed
+
+    @staticmethod
+    def get_stats():
+        return cache.get(Reaper.stats_key) or {}
@@ -0,0 +1,110 @@
+import datetime
+import time
+import traceback
+
+from CTFd.cache import cache
+from CTFd.utils import get_config
+
+from .control import ControlUtil
+from .db import DBContainer
+from .exceptions import KubernetesError
+from .informer import KubernetesInformer
+from .kubernetes import KubernetesUtils, get_challenge_id, shared_challenge_id
+from .reaper import Reaper
+from .routers import Router
+from .template import TemplateCache
+from ..models import ContainerStatus, DynamicKubernetesChallenge
+
+
+class Reconciler:
+    # diffs the chal-ids the informer sees against the rows: objects without a row are
+    # orphans and get deleted, rows whose pods are gone are dead and get failed. Either has
+    # to show up on two runs in a row, which leaves in-flight launches and teardowns alone
+    stats_key = "kubernetes:reconciler_stats"
+    suspects_key = "kubernetes:reconciler_suspects"
+
+    @staticmethod
+    def get_kinds():
+        # an orphan's challenge is unknown, so everything any template (or the router) creates goes
+        kinds = {("v1", "Pod"), ("v1", "Service")}
+        kinds.update(Router.kinds)
+        for challenge in DynamicKubernetesChallenge.query.all():
+            try:
+                kinds.update(TemplateCache.get(challenge).kinds)
+            except KubernetesError:
+                pass
+        return sorted(kinds)
+
+    @staticmethod
+    def diff(observed, containers, shared_ids, now=None):
+        now = now or datetime.datetime.now()
+        launch_timeout = datetime.timedelta(seconds=int(get_config("kubernetes:launch_timeout", "300")))
+        expected = set(shared_ids)
+        dead = set()
+        for container in containers:
+            chal_id, _ = get_challenge_id(container)
+            expected.add(chal_id)
+            if container.shared:
+                continue  # the deployment belongs to the challenge, not the row
+            _, has_pod = observed.get(chal_id, ((), False))
+            if has_pod:
+                continue
+            if container.status == ContainerStatus.READY:
+                dead.add(container.id)
+            elif container.status in (ContainerStatus.PENDING, ContainerStatus.SCHEDULING) and \
+                    container.status_time is not None and now - container.status_time > launch_timeout:
+                # left behind by a worker that went away mid-launch
+                dead.add(container.id)
+        orphans = set(observed) - expected
+        return orphans, dead
+
+    @staticmethod
+    def run():
+        if not KubernetesInformer.has_synced():
+            return None
+        started = time.time()
+        observed = KubernetesInformer.get_chal_ids()
+        containers = DBContainer.get_all_container()
+        shared_ids = [
+            shared_challenge_id(challenge.id)[0]
+            for challenge in DynamicKubernetesChallenge.query.filter(DynamicKubernetesChallenge.shared == 1)
+        ]
+        orphans, dead = Reconciler.diff(observed, containers, shared_ids)
+
+        previous = cache.get(Reconciler.suspects_key) or {"orphans": set(), "dead": set()}
+        cache.set(Reconciler.suspects_key, {"orphans": orphans, "dead": dead}, timeout=0)
+        orphans &= previous["orphans"]
+        dead &= previous["dead"]
+
+        collected = 0
+        if orphans:
+            kinds = Reconciler.get_kinds()
+            by_namespace = {}
+            for chal_id in sorted(orphans):
+                for namespace in observed[chal_id][0]:
+                    by_namespace.setdefault(namespace, []).append((chal_id, chal_id))
+            for namespace, members in by_namespace.items():
+                for i in range(0, len(members), Reaper.batch_size):
+                    collected += len(KubernetesUtils.delete_batch(namespace, kinds, members[i:i + Reaper.batch_size]))
+
+        for container_id in sorted(dead):
+            try:
+                ControlUtil.fail_container(container_id, 'Instance disappeared from the cluster', 'disappeared')
+            except Exception:
+                print(traceback.format_exc())
+
+        stats = {
+            "objects": len(observed),
+            "rows": len(containers),
+            "orphans": len(orphans),
+            "collected": collected,
+            "dead": len(dead),
+            "duration": time.time() - started,
+            "last_run": started,
+        }
+        cache.set(Reconciler.stats_key, stats, timeout=0)
+        return stats
+
+    @staticmethod
+    def get_stats():
+        return cache.get(Reconciler.stats_key) or {}
@@ -0,0 +1,72 @@
+import re
+from decimal import Decimal
+
+from kubernetes.utils import parse_quantity
+
+# memory_limit has always been written docker style, where "128m" means 128 MiB
+DOCKER_MEMORY = re.compile(r"^(\d+(?:\.\d+)?)([bkmg])$")
+DOCKER_UNITS = {"b": 1, "k": 2 ** 10, "m": 2 ** 20, "g": 2 ** 30}
+
+# where the pod spec lives in each kind that runs containers
+POD_SPEC_PATHS = {
+    "Pod": ("spec",),
+    "Deployment": ("spec", "template", "spec"),
+    "StatefulSet": ("spec", "template", "spec"),
+    "ReplicaSet": ("spec", "template", "spec"),
+    "DaemonSet": ("spec", "template", "spec"),
+    "Job": ("spec", "template", "spec"),
+    "CronJob": ("spec", "jobTemplate", "spec", "template", "spec"),
+}
+
+
+def parse_memory(value):
+    value = str(value or "0").strip()
+    match = DOCKER_MEMORY.match(value)
+    if match:
+        return Decimal(match.group(1)) * DOCKER_UNITS[match.group(2)]
+    return parse_quantity(value)
+
+
+def get_pod_specs(documents):
+    for doc in documents:
+        spec = doc
+        for key in POD_SPEC_PATHS.get(doc.get("kind"), ()):
+            spec = spec.get(key) if isinstance(spec, dict) else None
+        if spec is not doc and isinstance(spec, dict):
+            yield spec
+
+
+def get_request(challenge):
+    return Decimal(str(challenge.cpu_limit or 0)), parse_memory(challenge.memory_limit)
+
+
+def inject_resources(documents, challenge):
+    # the challenge's cpu/memory budget is split evenly over the containers that don't
+    # declare limits themselves; requests equal limits so the scheduler reserves all of it,
+    # unless the template asks for less. A larger request would get the pod rejected, so
+    # it is lowered to the limit
+    cpu, memory = get_request(challenge)
+    for spec in get_pod_specs(documents):
+        containers = [
+            c for c in spec.get("containers") or []
+            if not (c.get("resources") or {}).get("limits")
+        ]
+        if not containers:
+            continue
+        share = {}
+        if cpu > 0:
+            share["cpu"] = f"{max(1, int(cpu * 1000 / len(containers)))}m"
+        if memory > 0:
+            share["memory"] = str(int(memory / len(containers)))
+        if not share:
+            continue
+        for c in containers:
+            resources = c.get("resources") or {}
+            resources["limits"] = dict(share)
+            requests = resources.get("requests") or {}
+            for key, limit in share.items():
+                if key not in requests or parse_quantity(requests[key]) > parse_quantity(limit):
+                    requests[key] = limit
+            resources["requests"] = requests
+            c["resources"] = resources
+    return documents
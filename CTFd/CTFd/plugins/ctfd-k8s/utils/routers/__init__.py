@@ -1,9 +1,13 @@
 from CTFd.utils import get_config
 
+from .gateway import GatewayRouter
+from .ingress import IngressRouter
 from .k8s import K8sRouter
 
 _routers = {
     'k8s': K8sRouter,
+    'ingress': IngressRouter,
+    'gateway': GatewayRouter,
 }
 
 
@@ -1,14 +1,31 @@
 import typing
 
+from ..shared import SharedInstance
 from ...models import KubernetesContainer
 
 
 class BaseRouter:
     name = None
+    # (apiVersion, kind) of objects the router creates per instance, labelled with its chal-id
+    # so they are torn down together with the instance
+    kinds = ()
+    # instances are reached on the ExternalIP of their node, so they only count as ready
+    # once the node has one
+    needs_node_address = True
 
     def __init__(self):
         pass
 
+    @staticmethod
+    def render_access(connection_format, host, ports, token=""):
+        return connection_format.format(host=host, port=ports[0], ports=ports, token=token)
+
+    @staticmethod
+    def get_token(container: KubernetesContainer):
+        if not container.shared:
+            return ""
+        return SharedInstance.token_for(container.challenge_id, container.user_id)
+
     def access(self, container: KubernetesContainer):
         pass
 
@@ -0,0 +1,80 @@
+from flask import current_app
+
+from CTFd.models import db
+from CTFd.utils import get_config
+
+from .base import BaseRouter
+from ..cache import CacheProvider
+from ..db import forget_instances
+from ..exceptions import KubernetesError
+from ..informer import KubernetesInformer
+from ..kubernetes import KubernetesUtils, get_challenge_id, get_namespace
+from ...models import KubernetesContainer
+
+
+class GatewayRouter(BaseRouter):
+    # tcp instances are reached through the gateway (see gateway/ in this plugin), which
+    # looks up "<token>.<gateway domain>" from the TLS SNI or the first line the player
+    # sends and splices the connection to the instance's Service inside the cluster
+    name = "gateway"
+    # the gateway reaches instances through their Service, private nodes are fine
+    needs_node_address = False
+    routes_key = "ctfd_kubernetes-gateway-routes"
+
+    def __init__(self):
+        super().__init__()
+        self.provider = CacheProvider(app=current_app)
+
+    def reload(self, exclude=None):
+        pass
+
+    @staticmethod
+    def get_route_token(container: KubernetesContainer):
+        return container.uuid.replace("-", "")
+
+    @staticmethod
+    def get_ports():
+        ports = [int(get_config("kubernetes:gateway_port", "31337"))]
+        if get_config("kubernetes:gateway_tls_port"):
+            ports.append(int(get_config("kubernetes:gateway_tls_port")))
+        return ports
+
+    def access(self, container: KubernetesContainer):
+        return self.render_access(
+            container.challenge.connection_format, container.host, container.ports, self.get_token(container)
+        )
+
+    @staticmethod
+    def get_target(container: KubernetesContainer):
+        chal_id, _ = get_challenge_id(container)
+        namespace = get_namespace(container)
+        services = KubernetesInformer.get_services(chal_id)
+        if not services:
+            services = KubernetesUtils.v1.list_namespaced_service(
+                namespace=namespace, label_selector=f"chal-id={chal_id}"
+            ).items
+        if not services:
+            raise KubernetesError("Kubernetes Service Error\nNo service to route to")
+        service = services[0]
+        # the service name rather than a pod ip, so the route survives the pod being rescheduled
+        return f"{service.metadata.name}.{namespace}.svc:{service.spec.ports[0].port}"
+
+    def register(self, container: KubernetesContainer):
+        token = self.get_route_token(container)
+        self.provider.set_route(self.routes_key, token, self.get_target(container))
+        container.host = f"{token}.{get_config('kubernetes:gateway_domain')}"
+        container.ports = self.get_ports()
+        db.session.commit()
+        forget_instances(uuids=[container.uuid])
+        return True, "success"
+
+    def unregister(self, container: KubernetesContainer):
+        self.provider.delete_routes(self.routes_key, self.get_route_token(container))
+        return True, "success"
+
+    def check_availability(self):
+        if current_app.config['CACHE_TYPE'] != 'redis':
+            return False, "The gateway reads its routes from redis"
+        if not get_config("kubernetes:gateway_domain"):
+            return False, "No domain configured for the gateway"
+        return True, "Available"
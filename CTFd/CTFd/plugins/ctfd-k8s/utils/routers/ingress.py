@@ -0,0 +1,97 @@
+from hashlib import sha256
+
+from CTFd.models import db
+from CTFd.utils import get_config
+
+from .base import BaseRouter
+from ..db import forget_instances
+from ..exceptions import KubernetesError
+from ..informer import KubernetesInformer
+from ..kubernetes import KubernetesUtils, get_challenge_id, get_namespace
+from ...models import KubernetesContainer
+
+
+class IngressRouter(BaseRouter):
+    # every instance gets a host rule <http_subdomain>.<domain suffix> on the cluster's
+    # ingress controller in front of its first Service, so no node ports are used at all
+    name = "ingress"
+    kinds = (("networking.k8s.io/v1", "Ingress"),)
+    needs_node_address = False
+
+    def reload(self, exclude=None):
+        pass
+
+    @staticmethod
+    def get_host(container: KubernetesContainer):
+        suffix = get_config("kubernetes:ingress_domain_suffix", "")
+        if container.shared:
+            subdomain = f"shared-{container.challenge_id}"  # one rule for everyone playing
+        else:
+            subdomain = container.http_subdomain
+        return f"{subdomain}.{suffix}"
+
+    @staticmethod
+    def get_port():
+        return 443 if get_config("kubernetes:ingress_scheme", "http") == "https" else 80
+
+    def access(self, container: KubernetesContainer):
+        return self.render_access(
+            container.challenge.connection_format, container.host, container.ports, self.get_token(container)
+        )
+
+    def get_ingress(self, container: KubernetesContainer):
+        chal_id, _ = get_challenge_id(container)
+        services = KubernetesInformer.get_services(chal_id)
+        if not services:
+            services = KubernetesUtils.v1.list_namespaced_service(
+                namespace=get_namespace(container), label_selector=f"chal-id={chal_id}"
+            ).items
+        if not services:
+            raise KubernetesError("Kubernetes Service Error\nNo service to route to")
+        service = services[0]
+        host = self.get_host(container)
+        spec = {
+            "rules": [{
+                "host": host,
+                "http": {"paths": [{
+                    "path": "/",
+                    "pathType": "Prefix",
+                    "backend": {"service": {
+                        "name": service.metadata.name,
+                        "port": {"number": service.spec.ports[0].port},
+                    }},
+                }]},
+            }],
+        }
+        if get_config("kubernetes:ingress_class"):
+            spec["ingressClassName"] = get_config("kubernetes:ingress_class")
+        if get_config("kubernetes:ingress_tls_secret"):
+            spec["tls"] = [{"hosts": [host], "secretName": get_config("kubernetes:ingress_tls_secret")}]
+        return {
+            "apiVersion": "networking.k8s.io/v1",
+            "kind": "Ingress",
+            "metadata": {
+                # named after the host, so a claimed warm instance keeps its object
+                "name": "ctfd-" + sha256(host.encode()).hexdigest()[:16],
+                "labels": {"chal-id": chal_id},
+            },
+            "spec": spec,
+        }
+
+    def register(self, container: KubernetesContainer):
+        # applying again (e.g. after a warm instance is claimed) moves the label to the new owner
+        KubernetesUtils.apply_documents([self.get_ingress(container)], get_namespace(container))
+        container.host = self.get_host(container)
+        container.ports = [self.get_port()]
+        db.session.commit()
+        forget_instances(uuids=[container.uuid])
+        return True, "success"
+
+    def unregister(self, container: KubernetesContainer):
+        # the ingress is deleted by label together with the instance
+        return True, "success"
+
+    def check_availability(self):
+        if not get_config("kubernetes:ingress_domain_suffix"):
+            return False, "No domain suffix configured for the ingress router"
+        return True, "Available"
@@ -8,8 +8,8 @@ from CTFd.utils import get_config, set_config, logging
 
 from .base import BaseRouter
 from ..cache import CacheProvider
-from ..db import DBContainer
-from ..kubernetes import KubernetesUtils, get_templated_yaml
+from ..db import DBContainer, forget_instances
+from ..kubernetes import KubernetesUtils
 from ..exceptions import KubernetesError, KubernetesWarning
 from ...models import KubernetesContainer
 
@@ -21,8 +21,8 @@ class K8sRouter(BaseRouter):
         pass
 
     def access(self, container: KubernetesContainer):
-        return container.challenge.connection_format.format(
-            host=container.host, port=container.ports[0], ports=container.ports
+        return self.render_access(
+            container.challenge.connection_format, container.host, container.ports, self.get_token(container)
         )
 
     def register(self, container: KubernetesContainer):
@@ -30,6 +30,7 @@ class K8sRouter(BaseRouter):
         container.host = external_ip
         container.ports = ports
         db.session.commit()
+        forget_instances(uuids=[container.uuid])
         return True, "success"
 
     def unregister(self, container: KubernetesContainer):
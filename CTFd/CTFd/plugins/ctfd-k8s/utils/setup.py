@@ -11,6 +11,7 @@ def setup_default_configs():
         'docker_dns': '127.0.0.1',
         'docker_max_container_count': '100',
         'docker_max_renew_count': '5',
+        'team_max_container_count': '0',
         'docker_subnet': '174.1.0.0/16',
         'docker_subnet_new_prefix': '24',
         'docker_swarm_nodes': 'linux-1',
@@ -23,6 +24,26 @@ def setup_default_configs():
         'template_http_subdomain': '{{ container.uuid }}',
         'template_chall_flag': '{{ "flag{"+uuid.uuid4()|string+"}" }}',
         'kubernetes_namespace': 'default',
+        'ingress_domain_suffix': '',
+        'ingress_class': '',
+        'ingress_scheme': 'http',
+        'ingress_tls_secret': '',
+        'gateway_domain': '',
+        'gateway_port': '31337',
+        'gateway_tls_port': '',
+        'metrics_token': '',
+        'kubernetes_namespaces': '',
+        'namespace_shard_by': 'challenge',
+        'provision_concurrency': '8',
+        'launch_timeout': '300',
+        'max_nodes': '0',
+        'reaper_concurrency': '4',
+        'prepull_images': 'true',
+        'prescale_enabled': 'false',
+        'prescale_lead': '900',
+        'prescale_start_ratio': '0.5',
+        'prescale_release_ratio': '0.2',
+        'prescale_max_balloons': '20',
     }.items():
         set_config('kubernetes:' + key, val)
     db.session.add(KubernetesRedirectTemplate(
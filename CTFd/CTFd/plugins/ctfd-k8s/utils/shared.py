@@ -0,0 +1,124 @@
+import hmac
+import logging
+import math
+import traceback
+from hashlib import sha256
+
+from flask import current_app
+from kubernetes.client.rest import ApiException
+
+from CTFd.cache import cache
+
+from .db import DBContainer
+from .exceptions import KubernetesError
+from .informer import KubernetesInformer
+from .kubernetes import KubernetesUtils, get_namespace_for_challenge, shared_challenge_id
+from .resources import inject_resources
+from .template import TemplateCache
+from ..models import DynamicKubernetesChallenge
+
+
+class SharedInstance:
+    # a shared challenge runs one Deployment serving every player; the deployment gets a
+    # per-challenge key in place of {flag} so it can hand out flag{hmac_sha256(key, token)[:32]}
+    # on its own. Tokens come from a second key which never leaves CTFd, so reading the
+    # deployment's key doesn't give away the token (and with it the flag) of anyone else
+    replicas_key = "kubernetes:shared_replicas:{}"
+
+    @staticmethod
+    def get_key(challenge_id, purpose="shared"):
+        secret = current_app.config["SECRET_KEY"]
+        if isinstance(secret, str):
+            secret = secret.encode()
+        return hmac.new(secret, f"ctfd-k8s-{purpose}:{challenge_id}".encode(), sha256).hexdigest()
+
+    @staticmethod
+    def token_for(challenge_id, user_id):
+        key = SharedInstance.get_key(challenge_id, "shared-token").encode()
+        return hmac.new(key, f"token:{user_id}".encode(), sha256).hexdigest()[:24]
+
+    @staticmethod
+    def flag_for(challenge_id, user_id):
+        key = SharedInstance.get_key(challenge_id).encode()
+        token = SharedInstance.token_for(challenge_id, user_id)
+        return "flag{" + hmac.new(key, token.encode(), sha256).hexdigest()[:32] + "}"
+
+    @staticmethod
+    def get_documents(challenge, replicas):
+        chal_id, short_id = shared_challenge_id(challenge.id)
+        documents = TemplateCache.get(challenge).render(
+            id=chal_id, short_id=short_id, flag=SharedInstance.get_key(challenge.id)
+        )
+        for doc in documents:
+            if doc["kind"] == "Deployment":
+                doc.setdefault("spec", {})["replicas"] = replicas
+        # limits apply per replica
+        return inject_resources(documents, challenge)
+
+    @staticmethod
+    def get_deployment_name(challenge):
+        for doc in SharedInstance.get_documents(challenge, 0):
+            if doc["kind"] == "Deployment":
+                return doc["metadata"]["name"]
+        raise KubernetesError("Kubernetes Config Error\nShared challenges need a Deployment")
+
+    @staticmethod
+    def get_replicas(challenge_id):
+        return cache.get(SharedInstance.replicas_key.format(challenge_id)) or 0
+
+    @staticmethod
+    def ensure(challenge):
+        # make sure the deployment is there and running at least one replica
+        chal_id, _ = shared_challenge_id(challenge.id)
+        replicas = SharedInstance.get_replicas(challenge.id)
+        if KubernetesInformer.get_services(chal_id) and replicas > 0:
+            return
+        SharedInstance.apply(challenge, max(1, replicas))
+
+    @staticmethod
+    def apply(challenge, replicas):
+        KubernetesUtils.apply_documents(
+            SharedInstance.get_documents(challenge, replicas), get_namespace_for_challenge(challenge.id)
+        )
+        cache.set(SharedInstance.replicas_key.format(challenge.id), replicas, timeout=0)
+
+    @staticmethod
+    def scale(challenge, replicas):
+        if replicas == SharedInstance.get_replicas(challenge.id):
+            return
+        try:
+            KubernetesUtils.get_api("apps/v1").patch_namespaced_deployment_scale(
+                name=SharedInstance.get_deployment_name(challenge),
+                namespace=get_namespace_for_challenge(challenge.id),
+                body={"spec": {"replicas": replicas}},
+            )
+        except ApiException as e:
+            if e.status != 404:
+                raise KubernetesError(f"Kubernetes Scale Error\n{e.reason}\n{e.body}")
+            if replicas == 0:
+                return
+            SharedInstance.apply(challenge, replicas)  # deleted behind our back
+        cache.set(SharedInstance.replicas_key.format(challenge.id), replicas, timeout=0)
+        logging.getLogger("kubernetes").info(f"Scaled shared challenge {challenge.id} to {replicas}")
+
+    @staticmethod
+    def scale_all():
+        active = DBContainer.get_shared_user_counts()
+        q = DynamicKubernetesChallenge.query.filter(DynamicKubernetesChallenge.shared == 1)
+        for challenge in q.all():
+            users = active.get(challenge.id, 0)
+            per_replica = max(1, int(challenge.shared_users_per_replica or 1))
+            replicas = min(math.ceil(users / per_replica), max(1, int(challenge.shared_max_replicas or 1)))
+            try:
+                SharedInstance.scale(challenge, replicas)
+            except Exception:
+                print(traceback.format_exc())
+
+    @staticmethod
+    def teardown(challenge, extra_kinds=()):
+        chal_id, _ = shared_challenge_id(challenge.id)
+        KubernetesUtils.delete_kinds(
+            TemplateCache.get(challenge).kinds + list(extra_kinds), get_namespace_for_challenge(challenge.id),
+            f"chal-id={chal_id}"
+        )
+        cache.delete(SharedInstance.replicas_key.format(challenge.id))
@@ -0,0 +1,182 @@
+import copy
+import re
+import threading
+
+import yaml
+from kubernetes import client
+
+from .exceptions import KubernetesError
+
+SLOTS = ("id", "short_id", "flag")
+_SENTINELS = {slot: f"__ctfd_k8s_{slot}__" for slot in SLOTS}
+_SENTINEL_RE = re.compile("(" + "|".join(re.escape(s) for s in _SENTINELS.values()) + ")")
+_SENTINEL_SLOTS = {sentinel: slot for slot, sentinel in _SENTINELS.items()}
+
+# objects that can be handed over to another identity by patching their labels in place
+RELABEL_KINDS = {("v1", "Pod"), ("v1", "Service"), ("v1", "ConfigMap"), ("v1", "Secret")}
+RELABEL_PATHS = {("metadata", "labels"), ("metadata", "annotations"), ("spec", "selector")}
+
+
+def snake_case(kind):
+    kind = re.sub(r"(.)([A-Z][a-z]+)", r"\1_\2", kind)
+    return re.sub(r"([a-z0-9])([A-Z])", r"\1_\2", kind).lower()
+
+
+def api_class_name(api_version):
+    # same naming scheme as kubernetes.utils.create_from_yaml:
+    # v1 -> CoreV1Api, apps/v1 -> AppsV1Api, networking.k8s.io/v1 -> NetworkingV1Api
+    group, _, version = api_version.partition("/")
+    if version == "":
+        group, version = "core", group
+    group = "".join(group.rsplit(".k8s.io", 1))
+    group = "".join(word.capitalize() for word in group.split("."))
+    return f"{group}{version.capitalize()}Api"
+
+
+class CompiledTemplate:
+    def __init__(self, source):
+        self.source = source
+        try:
+            # substitute every placeholder by a sentinel so the yaml is parsed exactly once
+            text = source.format(**_SENTINELS)
+        except (KeyError, IndexError, ValueError) as e:
+            raise KubernetesError(
+                "Kubernetes Config Error\n"
+                f"Invalid placeholder {e}, only {{id}}, {{short_id}} and {{flag}} are allowed"
+            )
+        try:
+            self.documents = [doc for doc in yaml.safe_load_all(text) if doc]
+        except yaml.YAMLError as e:
+            raise KubernetesError(f"Kubernetes Config Error\n{e}")
+        if not self.documents:
+            raise KubernetesError("Kubernetes Config Error\nThe challenge config is empty")
+
+        # (path from the document list to a string value, [literal or (slot name,), ...])
+        self.slots = []
+        for index, doc in enumerate(self.documents):
+            self._validate(doc)
+            self._collect(doc, (index,))
+
+        self.kinds = []
+        for doc in self.documents:
+            kind = (doc["apiVersion"], doc["kind"])
+            if kind not in self.kinds:
+                self.kinds.append(kind)
+
+    @staticmethod
+    def _validate(doc):
+        if not isinstance(doc, dict) or "apiVersion" not in doc or "kind" not in doc:
+            raise KubernetesError(
+                "Kubernetes Config Error\n"
+                "Every document must be an object with apiVersion and kind"
+            )
+        api_cls = getattr(client, api_class_name(str(doc["apiVersion"])), None)
+        if api_cls is None or not hasattr(api_cls, f"create_namespaced_{snake_case(str(doc['kind']))}"):
+            raise KubernetesError(
+                "Kubernetes Config Error\n"
+                f"Unsupported kind {doc['kind']} ({doc['apiVersion']})"
+            )
+        metadata = doc.get("metadata") or {}
+        if not metadata.get("name"):
+            raise KubernetesError(
+                "Kubernetes Config Error\n"
+                f"{doc['kind']} must have metadata.name"
+            )
+        if (metadata.get("labels") or {}).get("chal-id") != _SENTINELS["id"]:
+            raise KubernetesError(
+                "Kubernetes Config Error\n"
+                "The challenge config must contain templated chal-id as label"
+            )
+
+    def _collect(self, node, path):
+        if isinstance(node, dict):
+            items = node.items()
+        elif isinstance(node, list):
+            items = enumerate(node)
+        else:
+            return
+        for key, value in items:
+            if isinstance(key, str) and _SENTINEL_RE.search(key):
+                raise KubernetesError(
+                    "Kubernetes Config Error\n"
+                    "Placeholders are only allowed in values"
+                )
+            if isinstance(value, str):
+                parts = [p for p in _SENTINEL_RE.split(value) if p]
+                if any(p in _SENTINEL_SLOTS for p in parts):
+                    self.slots.append((path + (key,), [
+                        (_SENTINEL_SLOTS[p],) if p in _SENTINEL_SLOTS else p for p in parts
+                    ]))
+            else:
+                self._collect(value, path + (key,))
+
+    @property
+    def can_relabel(self):
+        if not set(self.kinds) <= RELABEL_KINDS:
+            return False
+        return all(
+            tuple(path[1:3]) in RELABEL_PATHS and len(path) == 4
+            for path, parts in self.slots if ("id",) in parts
+        )
+
+    @property
+    def can_share(self):
+        # one Deployment whose pods carry the chal-id label, so readiness can see them
+        deployments = [doc for doc in self.documents if (doc["apiVersion"], doc["kind"]) == ("apps/v1", "Deployment")]
+        if len(deployments) != 1:
+            return False
+        pod_metadata = ((deployments[0].get("spec") or {}).get("template") or {}).get("metadata") or {}
+        return (pod_metadata.get("labels") or {}).get("chal-id") == _SENTINELS["id"]
+
+    def relabel_patches(self, **values):
+        # merge patches moving an already running instance to the id in values,
+        # short_id and flag are expected to be the ones it was created with
+        patches = []
+        for index, doc in enumerate(self.documents):
+            patch = {}
+            for path, parts in self.slots:
+                if path[0] != index or ("id",) not in parts:
+                    continue
+                node = patch
+                for key in path[1:-1]:
+                    node = node.setdefault(key, {})
+                node[path[-1]] = self._render_parts(parts, values)
+            name = doc["metadata"]["name"]
+            for path, parts in self.slots:
+                if path == (index, "metadata", "name"):
+                    name = self._render_parts(parts, values)
+            patches.append((doc["apiVersion"], doc["kind"], name, patch))
+        return patches
+
+    @staticmethod
+    def _render_parts(parts, values):
+        return "".join(str(values[p[0]]) if isinstance(p, tuple) else p for p in parts)
+
+    def render(self, **values):
+        documents = copy.deepcopy(self.documents)
+        for path, parts in self.slots:
+            node = documents
+            for key in path[:-1]:
+                node = node[key]
+            node[path[-1]] = self._render_parts(parts, values)
+        return documents
+
+
+class TemplateCache:
+    _lock = threading.Lock()
+    _templates = {}
+
+    @staticmethod
+    def get(challenge):
+        compiled = TemplateCache._templates.get(challenge.id)
+        # the source comparison catches updates made through another worker process
+        if compiled is None or compiled.source != challenge.kubernetes_config:
+            compiled = CompiledTemplate(challenge.kubernetes_config)
+            with TemplateCache._lock:
+                TemplateCache._templates[challenge.id] = compiled
+        return compiled
+
+    @staticmethod
+    def invalidate(challenge_id):
+        with TemplateCache._lock:
+            TemplateCache._templates.pop(int(challenge_id), None)
@@ -1,10 +1,13 @@
-from sqlalchemy.sql.expression import union_all
+import time
+from uuid import uuid4
+
+from flask import current_app
 
 from CTFd.cache import cache
-from CTFd.models import Awards, Challenges, Solves, Teams, Users, db
 from CTFd.utils import get_config
-from CTFd.utils.dates import unix_time_to_utc
-from CTFd.utils.modes import get_model
+from CTFd.utils.modes import TEAMS_MODE
+from CTFd.utils.scores.engine import get_engine
+from CTFd.utils.scores.snapshots import get_frozen_snapshot
 
 
 @cache.memoize(timeout=60)
@@ -16,292 +19,103 @@ def get_standings(count=None, admin=False, fields=None):
     user will have a solve ID that is before the others. That user will be considered the tie-winner.
 
     Challenges & Awards with a value of zero are filtered out of the calculations to avoid incorrect tie breaks.
-    """
-    if fields is None:
-        fields = []
-    Model = get_model()
-
-    scores = (
-        db.session.query(
-            Solves.account_id.label("account_id"),
-            db.func.sum(Challenges.value).label("score"),
-            db.func.max(Solves.id).label("id"),
-            db.func.max(Solves.date).label("date"),
-        )
-        .join(Challenges)
-        .filter(Challenges.value != 0)
-        .group_by(Solves.account_id)
-    )
-
-    awards = (
-        db.session.query(
-            Awards.account_id.label("account_id"),
-            db.func.sum(Awards.value).label("score"),
-            db.func.max(Awards.id).label("id"),
-            db.func.max(Awards.date).label("date"),
-        )
-        .filter(Awards.value != 0)
-        .group_by(Awards.account_id)
-    )
 
+    Scores come from the incrementally maintained scoreboard engine (see CTFd.utils.scores.engine) instead of
+    being recomputed from every solve and award. Once the freeze time passed the public standings come from
+    the frozen snapshot (see CTFd.utils.scores.snapshots).
     """
-    Filter out solves and awards that are before a specific time point.
-    """
-    freeze = get_config("freeze")
-    if not admin and freeze:
-        scores = scores.filter(Solves.date < unix_time_to_utc(freeze))
-        awards = awards.filter(Awards.date < unix_time_to_utc(freeze))
-
-    """
-    Combine awards and solves with a union. They should have the same amount of columns
-    """
-    results = union_all(scores, awards).alias("results")
-
-    """
-    Sum each of the results by the team id to get their score.
-    """
-    sumscores = (
-        db.session.query(
-            results.columns.account_id,
-            db.func.sum(results.columns.score).label("score"),
-            db.func.max(results.columns.id).label("id"),
-            db.func.max(results.columns.date).label("date"),
-        )
-        .group_by(results.columns.account_id)
-        .subquery()
+    snapshot = _get_public_snapshot(admin=admin, fields=fields)
+    if snapshot is not None:
+        return _limit(snapshot["standings"]["account"], count)
+    kind = "teams" if get_config("user_mode") == TEAMS_MODE else "users"
+    return get_engine().standings(
+        kind, "account_id", count=count, admin=admin, fields=fields
     )
 
-    """
-    Admins can see scores for all users but the public cannot see banned users.
-
-    Filters out banned users.
-    Properly resolves value ties by ID.
-
-    Different databases treat time precision differently so resolve by the row ID instead.
-    """
-    if admin:
-        standings_query = (
-            db.session.query(
-                Model.id.label("account_id"),
-                Model.oauth_id.label("oauth_id"),
-                Model.name.label("name"),
-                Model.hidden,
-                Model.banned,
-                sumscores.columns.score,
-                *fields,
-            )
-            .join(sumscores, Model.id == sumscores.columns.account_id)
-            .order_by(
-                sumscores.columns.score.desc(),
-                sumscores.columns.date.asc(),
-                sumscores.columns.id.asc(),
-            )
-        )
-    else:
-        standings_query = (
-            db.session.query(
-                Model.id.label("account_id"),
-                Model.oauth_id.label("oauth_id"),
-                Model.name.label("name"),
-                sumscores.columns.score,
-                *fields,
-            )
-            .join(sumscores, Model.id == sumscores.columns.account_id)
-            .filter(Model.banned == False, Model.hidden == False)
-            .order_by(
-                sumscores.columns.score.desc(),
-                sumscores.columns.date.asc(),
-                sumscores.columns.id.asc(),
-            )
-        )
-
-    """
-    Only select a certain amount of users if asked.
-    """
-    if count is None:
-        standings = standings_query.all()
-    else:
-        standings = standings_query.limit(count).all()
-
-    return standings
-
 
 @cache.memoize(timeout=60)
 def get_team_standings(count=None, admin=False, fields=None):
-    if fields is None:
-        fields = []
-    scores = (
-        db.session.query(
-            Solves.team_id.label("team_id"),
-            db.func.sum(Challenges.value).label("score"),
-            db.func.max(Solves.id).label("id"),
-            db.func.max(Solves.date).label("date"),
-        )
-        .join(Challenges)
-        .filter(Challenges.value != 0)
-        .group_by(Solves.team_id)
+    snapshot = _get_public_snapshot(admin=admin, fields=fields)
+    if snapshot is not None:
+        return _limit(snapshot["standings"]["teams"], count)
+    return get_engine().standings(
+        "teams", "team_id", count=count, admin=admin, fields=fields
     )
 
-    awards = (
-        db.session.query(
-            Awards.team_id.label("team_id"),
-            db.func.sum(Awards.value).label("score"),
-            db.func.max(Awards.id).label("id"),
-            db.func.max(Awards.date).label("date"),
-        )
-        .filter(Awards.value != 0)
-        .group_by(Awards.team_id)
+
+@cache.memoize(timeout=60)
+def get_user_standings(count=None, admin=False, fields=None):
+    snapshot = _get_public_snapshot(admin=admin, fields=fields)
+    if snapshot is not None:
+        return _limit(snapshot["standings"]["users"], count)
+    return get_engine().standings(
+        "users", "user_id", count=count, admin=admin, fields=fields
     )
 
-    freeze = get_config("freeze")
-    if not admin and freeze:
-        scores = scores.filter(Solves.date < unix_time_to_utc(freeze))
-        awards = awards.filter(Awards.date < unix_time_to_utc(freeze))
 
-    results = union_all(scores, awards).alias("results")
+def _get_public_snapshot(admin=False, fields=None):
+    # Snapshots only hold the public standings without any extra fields
+    if admin or fields:
+        return None
+    return get_frozen_snapshot()
 
-    sumscores = (
-        db.session.query(
-            results.columns.team_id,
-            db.func.sum(results.columns.score).label("score"),
-            db.func.max(results.columns.id).label("id"),
-            db.func.max(results.columns.date).label("date"),
-        )
-        .group_by(results.columns.team_id)
-        .subquery()
-    )
-
-    if admin:
-        standings_query = (
-            db.session.query(
-                Teams.id.label("team_id"),
-                Teams.oauth_id.label("oauth_id"),
-                Teams.name.label("name"),
-                Teams.hidden,
-                Teams.banned,
-                sumscores.columns.score,
-                *fields,
-            )
-            .join(sumscores, Teams.id == sumscores.columns.team_id)
-            .order_by(
-                sumscores.columns.score.desc(),
-                sumscores.columns.date.asc(),
-                sumscores.columns.id.asc(),
-            )
-        )
-    else:
-        standings_query = (
-            db.session.query(
-                Teams.id.label("team_id"),
-                Teams.oauth_id.label("oauth_id"),
-                Teams.name.label("name"),
-                sumscores.columns.score,
-                *fields,
-            )
-            .join(sumscores, Teams.id == sumscores.columns.team_id)
-            .filter(Teams.banned == False)
-            .filter(Teams.hidden == False)
-            .order_by(
-                sumscores.columns.score.desc(),
-                sumscores.columns.date.asc(),
-                sumscores.columns.id.asc(),
-            )
-        )
 
+def _limit(standings, count):
     if count is None:
-        standings = standings_query.all()
-    else:
-        standings = standings_query.limit(count).all()
-
-    return standings
+        return standings
+    return standings[: int(count)]
 
 
-@cache.memoize(timeout=60)
-def get_user_standings(count=None, admin=False, fields=None):
-    if fields is None:
-        fields = []
-    scores = (
-        db.session.query(
-            Solves.user_id.label("user_id"),
-            db.func.sum(Challenges.value).label("score"),
-            db.func.max(Solves.id).label("id"),
-            db.func.max(Solves.date).label("date"),
-        )
-        .join(Challenges)
-        .filter(Challenges.value != 0)
-        .group_by(Solves.user_id)
-    )
-
-    awards = (
-        db.session.query(
-            Awards.user_id.label("user_id"),
-            db.func.sum(Awards.value).label("score"),
-            db.func.max(Awards.id).label("id"),
-            db.func.max(Awards.date).label("date"),
-        )
-        .filter(Awards.value != 0)
-        .group_by(Awards.user_id)
-    )
+def get_timelines(account_ids, admin=False):
+    """
+    Get every solve and award of the given accounts in date order as dicts of account_id -> list of
+    (challenge_id, user_id, team_id, value, date) tuples, only counting what happened before the
+    freeze unless admin.
 
-    freeze = get_config("freeze")
-    if not admin and freeze:
-        scores = scores.filter(Solves.date < unix_time_to_utc(freeze))
-        awards = awards.filter(Awards.date < unix_time_to_utc(freeze))
+    The timelines are maintained by the scoreboard engine as rows come in, so this neither loads the
+    rows nor sorts them.
+    """
+    snapshot = None if admin else get_frozen_snapshot()
+    if snapshot is not None:
+        return {
+            account_id: snapshot["timelines"].get(account_id, [])
+            for account_id in account_ids
+        }
+    kind = "teams" if get_config("user_mode") == TEAMS_MODE else "users"
+    return get_engine().timelines(kind, account_ids, admin=admin)
 
-    results = union_all(scores, awards).alias("results")
 
-    sumscores = (
-        db.session.query(
-            results.columns.user_id,
-            db.func.sum(results.columns.score).label("score"),
-            db.func.max(results.columns.id).label("id"),
-            db.func.max(results.columns.date).label("date"),
-        )
-        .group_by(results.columns.user_id)
-        .subquery()
-    )
+def get_user_places(admin=False):
+    """
+    Get a dict of user_id -> place on the user standings.
 
-    if admin:
-        standings_query = (
-            db.session.query(
-                Users.id.label("user_id"),
-                Users.oauth_id.label("oauth_id"),
-                Users.name.label("name"),
-                Users.team_id.label("team_id"),
-                Users.hidden,
-                Users.banned,
-                sumscores.columns.score,
-                *fields,
-            )
-            .join(sumscores, Users.id == sumscores.columns.user_id)
-            .order_by(
-                sumscores.columns.score.desc(),
-                sumscores.columns.date.asc(),
-                sumscores.columns.id.asc(),
-            )
-        )
-    else:
-        standings_query = (
-            db.session.query(
-                Users.id.label("user_id"),
-                Users.oauth_id.label("oauth_id"),
-                Users.name.label("name"),
-                Users.team_id.label("team_id"),
-                sumscores.columns.score,
-                *fields,
-            )
-            .join(sumscores, Users.id == sumscores.columns.user_id)
-            .filter(Users.banned == False, Users.hidden == False)
-            .order_by(
-                sumscores.columns.score.desc(),
-                sumscores.columns.date.asc(),
-                sumscores.columns.id.asc(),
-            )
-        )
+    The index is built once per standings version (bumped whenever the standings are cleared) and
+    kept in process so that place lookups are a dict hit instead of a scan of the standings.
+    """
+    return _get_places(get_user_standings, admin=admin)
 
-    if count is None:
-        standings = standings_query.all()
-    else:
-        standings = standings_query.limit(count).all()
 
-    return standings
+def get_team_places(admin=False):
+    """
+    Get a dict of team_id -> place on the team standings. See get_user_places().
+    """
+    return _get_places(get_team_standings, admin=admin)
+
+
+def _get_places(standings_func, admin=False):
+    from CTFd.constants.static import CacheKeys
+
+    version = cache.get(CacheKeys.STANDINGS_VERSION)
+    if version is None:
+        version = uuid4().hex
+        cache.set(CacheKeys.STANDINGS_VERSION, version, timeout=0)
+    indexes = current_app.extensions.setdefault("scoreboard_places", {})
+    key = (standings_func.__name__, admin)
+    built = indexes.get(key)
+    # Built indexes expire like the standings they were built from
+    if built is None or built[0] != version or time.time() - built[1] > 60:
+        standings = standings_func(admin=admin)
+        places = {standing[0]: i + 1 for i, standing in enumerate(standings)}
+        built = (version, time.time(), places)
+        indexes[key] = built
+    return built[2]
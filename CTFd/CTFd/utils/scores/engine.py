@@ -0,0 +1,385 @@
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+
+from flask import current_app
+from sqlalchemy.util import lightweight_named_tuple
+
+from CTFd.cache import cache
+from CTFd.models import Awards, Challenges, Solves, Teams, Users, db
+from CTFd.utils import get_config
+from CTFd.utils.dates import isoformat, unix_time_to_utc
+
+
+class Timeline(object):
+    """
+    Every solve and award of one account in date order, kept as parallel arrays the way the scoreboard
+    graph draws them. New rows are practically always the latest so adding one is an append.
+
+    Solves keep their challenge rather than its value as challenge values can still change.
+    """
+
+    __slots__ = ("keys", "dates", "challenge_ids", "user_ids", "team_ids", "values")
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, [])
+
+    def add(self, key, date, challenge_id, user_id, team_id, value):
+        # Solves before awards at the same time, like the graph always sorted them
+        order = (date, 0 if key[0] == "solve" else 1, key[1])
+        i = bisect_right(self.keys, order)
+        self.keys.insert(i, order)
+        self.dates.insert(i, isoformat(date))
+        self.challenge_ids.insert(i, challenge_id)
+        self.user_ids.insert(i, user_id)
+        self.team_ids.insert(i, team_id)
+        self.values.insert(i, value)
+
+    def entries(self, values):
+        """
+        Get (challenge_id, user_id, team_id, value, date) of every row, solves valued at the current
+        value of their challenge.
+        """
+        return [
+            (
+                challenge_id,
+                user_id,
+                team_id,
+                values.get(challenge_id) if challenge_id is not None else value,
+                date,
+            )
+            for challenge_id, user_id, team_id, value, date in zip(
+                self.challenge_ids,
+                self.user_ids,
+                self.team_ids,
+                self.values,
+                self.dates,
+            )
+        ]
+
+
+class Board(object):
+    """
+    Running totals and rank order of one kind of account (users or teams) over the solves and awards
+    before an optional cutoff.
+
+    Every account keeps the rows it was credited with so that its total can be recomputed on its own.
+    The order is a sorted list of (-score, date, id, account_id) keys which is the same ordering as the
+    SQL standings: highest score first with ties going to whoever reached it first.
+    """
+
+    def __init__(self, cutoff=None):
+        self.cutoff = cutoff
+        self.rows = defaultdict(dict)
+        self.keys = {}
+        self.previous = {}
+        self.order = []
+        self.timelines = defaultdict(Timeline)
+
+    def add(self, account_id, key, challenge_id, value, date, row_id, user_id, team_id):
+        if account_id is None:
+            return False
+        if self.cutoff is not None and date >= self.cutoff:
+            return False
+        self.rows[account_id][key] = (challenge_id, value, date, row_id)
+        self.timelines[account_id].add(key, date, challenge_id, user_id, team_id, value)
+        return True
+
+    def update(self, account_id, values):
+        old = self.keys.pop(account_id, None)
+        self.previous[account_id] = old
+        if old is not None:
+            del self.order[bisect_left(self.order, old)]
+
+        score, date, row_id, found = 0, None, None, False
+        for challenge_id, value, row_date, rid in self.rows[account_id].values():
+            if challenge_id is not None:
+                value = values.get(challenge_id)
+            # Challenges & Awards with a value of zero don't count towards tie breaks
+            if not value:
+                continue
+            found = True
+            score += value
+            date = row_date if date is None else max(date, row_date)
+            row_id = rid if row_id is None else max(row_id, rid)
+
+        if found:
+            key = (-score, date, row_id, account_id)
+            self.keys[account_id] = key
+            insort(self.order, key)
+
+    def ranked(self):
+        return [(key[3], -key[0]) for key in self.order]
+
+    def moved(self, account_id):
+        """
+        Get the accounts whose place changed with the last update of account_id: everyone between
+        its old and its new key, itself included. Off the board counts as the bottom.
+        """
+        old = self.previous.get(account_id)
+        new = self.keys.get(account_id)
+        start, end = sorted(
+            bisect_left(self.order, key) if key is not None else len(self.order)
+            for key in (old, new)
+        )
+        return [key[3] for key in self.order[start : end + 1]]
+
+
+class ScoreboardEngine(object):
+    """
+    Incrementally maintained standings for every account.
+
+    Instead of recomputing the union of all solves and awards on every read, the engine catches up with
+    the rows added since its last read and only re-ranks the accounts they belong to. Challenge value
+    changes (e.g. dynamic challenges decaying) re-rank the accounts which solved that challenge.
+
+    A full rebuild happens when clear_standings() bumps the scoreboard generation (admin edits), when the
+    freeze time changes, when rows were deleted behind our back and every REBUILD_INTERVAL seconds.
+
+    Every change to the standings bumps the standings version (see CTFd.cache._clear_rankings), so reads
+    only go to the database once it moved.
+    """
+
+    # Rows are picked up a little before the newest one seen as ids don't have to commit in order
+    WINDOW = 200
+    REBUILD_INTERVAL = 600
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generation = None
+        self.version = None
+        self.freeze = None
+        self.built = None
+        self.values = {}
+        self.solvers = defaultdict(set)
+        self.solve_ids = set()
+        self.award_ids = set()
+        self.solve_mark = 0
+        self.award_mark = 0
+        self.boards = {}
+
+    def sync(self):
+        from CTFd.constants.static import CacheKeys
+
+        generation = cache.get(CacheKeys.SCOREBOARD_GENERATION)
+        # Read before the database so that a change committed meanwhile is caught up with next time
+        version = cache.get(CacheKeys.STANDINGS_VERSION)
+        freeze = get_config("freeze")
+        if (
+            self.built is None
+            or generation != self.generation
+            or freeze != self.freeze
+            or time.time() - self.built > self.REBUILD_INTERVAL
+            or (version != self.version and not self.catch_up())
+        ):
+            self.rebuild(generation, freeze)
+        self.version = version
+
+    def rebuild(self, generation, freeze):
+        cutoff = unix_time_to_utc(freeze) if freeze else None
+        self.boards = {
+            ("users", False): Board(),
+            ("teams", False): Board(),
+        }
+        if cutoff is not None:
+            self.boards[("users", True)] = Board(cutoff=cutoff)
+            self.boards[("teams", True)] = Board(cutoff=cutoff)
+        self.values = dict(db.session.query(Challenges.id, Challenges.value).all())
+        self.solvers = defaultdict(set)
+        self.solve_ids = set()
+        self.award_ids = set()
+        self.solve_mark = 0
+        self.award_mark = 0
+
+        solves = db.session.query(
+            Solves.id, Solves.user_id, Solves.team_id, Solves.challenge_id, Solves.date
+        ).all()
+        awards = db.session.query(
+            Awards.id, Awards.user_id, Awards.team_id, Awards.value, Awards.date
+        ).all()
+        self.apply(solves, awards)
+
+        self.generation = generation
+        self.freeze = freeze
+        self.built = time.time()
+
+    def catch_up(self):
+        """
+        Apply what changed since the last read. Returns False if a full rebuild is needed instead.
+        """
+        dirty = set()
+
+        values = dict(db.session.query(Challenges.id, Challenges.value).all())
+        for challenge_id, value in values.items():
+            if self.values.get(challenge_id) != value:
+                dirty.update(self.solvers[challenge_id])
+        self.values = values
+
+        solve_mark = self.solve_mark - self.WINDOW
+        award_mark = self.award_mark - self.WINDOW
+        solves = (
+            db.session.query(
+                Solves.id,
+                Solves.user_id,
+                Solves.team_id,
+                Solves.challenge_id,
+                Solves.date,
+            )
+            .filter(Solves.id > solve_mark)
+            .all()
+        )
+        awards = (
+            db.session.query(
+                Awards.id, Awards.user_id, Awards.team_id, Awards.value, Awards.date
+            )
+            .filter(Awards.id > award_mark)
+            .all()
+        )
+        solves = [s for s in solves if s.id not in self.solve_ids]
+        awards = [a for a in awards if a.id not in self.award_ids]
+        self.apply(solves, awards, dirty=dirty)
+
+        # Deleted rows can't be caught up with, only noticed
+        solve_count = db.session.query(db.func.count(Solves.id)).scalar()
+        award_count = db.session.query(db.func.count(Awards.id)).scalar()
+        return solve_count == len(self.solve_ids) and award_count == len(self.award_ids)
+
+    def apply(self, solves, awards, dirty=None):
+        if dirty is None:
+            dirty = set()
+        for solve in solves:
+            self.solve_ids.add(solve.id)
+            self.solve_mark = max(self.solve_mark, solve.id)
+            self.solvers[solve.challenge_id].add((solve.user_id, solve.team_id))
+            dirty.add((solve.user_id, solve.team_id))
+            self._add(
+                solve.user_id,
+                solve.team_id,
+                ("solve", solve.id),
+                solve.challenge_id,
+                None,
+                solve.date,
+                solve.id,
+            )
+        for award in awards:
+            self.award_ids.add(award.id)
+            self.award_mark = max(self.award_mark, award.id)
+            dirty.add((award.user_id, award.team_id))
+            self._add(
+                award.user_id,
+                award.team_id,
+                ("award", award.id),
+                None,
+                award.value,
+                award.date,
+                award.id,
+            )
+
+        accounts = {
+            "users": {user_id for user_id, _ in dirty if user_id is not None},
+            "teams": {team_id for _, team_id in dirty if team_id is not None},
+        }
+        for (kind, _frozen), board in self.boards.items():
+            for account_id in accounts[kind]:
+                board.update(account_id, self.values)
+
+    def _add(self, user_id, team_id, key, challenge_id, value, date, row_id):
+        for (kind, _frozen), board in self.boards.items():
+            account_id = team_id if kind == "teams" else user_id
+            board.add(
+                account_id, key, challenge_id, value, date, row_id, user_id, team_id
+            )
+
+    def ranked(self, kind, admin=False):
+        """
+        Get the (account_id, score) pairs of a board in order, after catching up with the database.
+        """
+        with self.lock:
+            self.sync()
+            frozen = not admin and ("users", True) in self.boards
+            return self.boards[(kind, frozen)].ranked()
+
+    def moved(self, kind, account_id):
+        """
+        Catch up with the database and get the ids of the accounts whose place changed with
+        the last change to account_id's score, on the public and the admin board.
+        """
+        with self.lock:
+            self.sync()
+            moved = set()
+            for (board_kind, _frozen), board in self.boards.items():
+                if board_kind == kind:
+                    moved.update(board.moved(account_id))
+            return moved
+
+    def timelines(self, kind, account_ids, admin=False):
+        """
+        Catch up with the database and get the timeline entries (see Timeline.entries) of the
+        given accounts, only counting what happened before the freeze unless admin.
+        """
+        with self.lock:
+            self.sync()
+            frozen = not admin and ("users", True) in self.boards
+            board = self.boards[(kind, frozen)]
+            return {
+                account_id: (
+                    board.timelines[account_id].entries(self.values)
+                    if account_id in board.timelines
+                    else []
+                )
+                for account_id in account_ids
+            }
+
+    def standings(self, kind, label, count=None, admin=False, fields=None):
+        """
+        Get standings rows shaped like the SQL standings queries: (label, oauth_id, name, [team_id],
+        [hidden, banned], score, *fields) with team_id only for user_id labelled rows. The public board
+        leaves out hidden and banned accounts.
+        """
+        Model = Teams if kind == "teams" else Users
+        columns = [Model.id, Model.oauth_id, Model.name]
+        names = [label, "oauth_id", "name"]
+        if label == "user_id":
+            columns.append(Users.team_id)
+            names.append("team_id")
+        if admin:
+            columns += [Model.hidden, Model.banned]
+            names += ["hidden", "banned"]
+        extra = len(columns)
+        columns += list(fields or [])
+        names.append("score")
+        names += [
+            getattr(f, "key", None) or getattr(f, "name", None) for f in fields or []
+        ]
+        # The same keyed tuples a query returns, so they can be cached like the query results were
+        Row = lightweight_named_tuple("result", names)
+
+        if count is not None:
+            count = int(count)
+        ranked = self.ranked(kind, admin=admin)
+
+        standings = []
+        chunk = 500
+        for i in range(0, len(ranked), chunk):
+            ids = [account_id for account_id, _ in ranked[i : i + chunk]]
+            q = db.session.query(*columns).filter(Model.id.in_(ids))
+            if not admin:
+                q = q.filter(Model.banned == False, Model.hidden == False)
+            found = {r[0]: r for r in q.all()}
+            for account_id, score in ranked[i : i + chunk]:
+                r = found.get(account_id)
+                if r is None:
+                    continue
+                standings.append(Row([*r[:extra], int(score), *r[extra:]]))
+                if count is not None and len(standings) >= count:
+                    return standings
+        return standings
+
+
+def get_engine():
+    engine = current_app.extensions.get("scoreboard")
+    if engine is None:
+        engine = current_app.extensions.setdefault("scoreboard", ScoreboardEngine())
+    return engine
@@ -0,0 +1,135 @@
+import time
+
+from CTFd.cache import cache
+from CTFd.utils import get_config
+from CTFd.utils.modes import TEAMS_MODE
+from CTFd.utils.scores.engine import get_engine
+
+FROZEN_KEY = "scoreboard_snapshot_frozen"
+HISTORY_KEY = "scoreboard_snapshots"
+# Held while a snapshot is taken so that concurrent runs don't overwrite each other's
+LOCK_KEY = "scoreboard_snapshots_lock"
+# How many periodic snapshots are kept around
+HISTORY_SIZE = 48
+
+
+def take_snapshot():
+    """
+    Materialise the public scoreboard as it stands: the standings of the accounts, teams and users
+    and the timeline of every account on the standings.
+    """
+    engine = get_engine()
+    kind = "teams" if get_config("user_mode") == TEAMS_MODE else "users"
+    standings = {
+        "account": engine.standings(kind, "account_id"),
+        "teams": engine.standings("teams", "team_id"),
+        "users": engine.standings("users", "user_id"),
+    }
+    account_ids = [standing.account_id for standing in standings["account"]]
+    return {
+        "time": int(time.time()),
+        "freeze": get_config("freeze"),
+        "standings": standings,
+        "timelines": engine.timelines(kind, account_ids),
+    }
+
+
+def get_frozen_snapshot():
+    """
+    Get the snapshot of the public scoreboard taken once the freeze time passed, taking it if needed.
+    Returns None while the scoreboard isn't frozen, or while another request holds the lock to take
+    it, in which case the caller computes the standings itself.
+
+    Nothing before the freeze changes during the freeze so the public scoreboard is served from the
+    snapshot instead of being recomputed. Admin edits (clear_standings()) drop it to be taken again.
+    """
+    freeze = get_config("freeze")
+    if not freeze or time.time() < freeze:
+        return None
+    snapshot = cache.get(FROZEN_KEY)
+    if snapshot is not None and snapshot["freeze"] == freeze:
+        return snapshot
+    if not cache.add(LOCK_KEY, True, timeout=60):
+        return None
+    try:
+        snapshot = cache.get(FROZEN_KEY)
+        if snapshot is None or snapshot["freeze"] != freeze:
+            snapshot = take_snapshot()
+            cache.set(FROZEN_KEY, snapshot, timeout=0)
+        return snapshot
+    finally:
+        cache.delete(LOCK_KEY)
+
+
+def clear_frozen_snapshot():
+    cache.delete(FROZEN_KEY)
+
+
+def record_snapshot():
+    """
+    Take a historical snapshot if the last one is older than the scoreboard_snapshot_interval config
+    (in minutes, 0 disables them). Only the last HISTORY_SIZE snapshots are kept.
+
+    Meant to be run periodically (see the record_scoreboard_snapshot command in manage.py) rather
+    than while serving requests. Returns None if no snapshot was due or another run holds the lock.
+    """
+    interval = int(get_config("scoreboard_snapshot_interval") or 0) * 60
+    if interval <= 0:
+        return None
+    if not cache.add(LOCK_KEY, True, timeout=60):
+        return None
+    try:
+        history = cache.get(HISTORY_KEY) or []
+        if history and time.time() - history[-1] < interval:
+            return None
+
+        snapshot = take_snapshot()
+        cache.set(HISTORY_KEY + ":" + str(snapshot["time"]), snapshot, timeout=0)
+        history.append(snapshot["time"])
+        for taken in history[:-HISTORY_SIZE]:
+            cache.delete(HISTORY_KEY + ":" + str(taken))
+        cache.set(HISTORY_KEY, history[-HISTORY_SIZE:], timeout=0)
+        return snapshot
+    finally:
+        cache.delete(LOCK_KEY)
+
+
+def get_snapshot_times():
+    return cache.get(HISTORY_KEY) or []
+
+
+def get_snapshot(taken):
+    return cache.get(HISTORY_KEY + ":" + str(taken))
+
+
+def diff_snapshot(snapshot):
+    """
+    Compare the live (admin) standings against a snapshot. Returns a dict per account on either
+    of them with its place & score in both, None where it isn't on one.
+    """
+    kind = "teams" if get_config("user_mode") == TEAMS_MODE else "users"
+    live = get_engine().standings(kind, "account_id", admin=True)
+    live = {
+        standing.account_id: (i + 1, standing.score, standing.name)
+        for i, standing in enumerate(live)
+    }
+    frozen = {
+        standing.account_id: (i + 1, standing.score, standing.name)
+        for i, standing in enumerate(snapshot["standings"]["account"])
+    }
+
+    diff = []
+    for account_id in list(live) + [a for a in frozen if a not in live]:
+        live_place, live_score, name = live.get(account_id, (None, None, None))
+        place, score, snapshot_name = frozen.get(account_id, (None, None, None))
+        diff.append(
+            {
+                "account_id": account_id,
+                "name": name or snapshot_name,
+                "place": live_place,
+                "score": live_score,
+                "snapshot_place": place,
+                "snapshot_score": score,
+            }
+        )
+    return diff
@@ -91,5 +91,16 @@ def import_ctf(path, delete_import_on_finish=False):
         Path(path).unlink()
 
 
+@manager.command
+def record_scoreboard_snapshot():
+    """Keep a scoreboard snapshot if one is due. Run this every minute, e.g. from cron"""
+    from CTFd.utils.scores.snapshots import record_snapshot
+
+    with app.app_context():
+        snapshot = record_snapshot()
+        if snapshot:
+            print(f"Recorded scoreboard snapshot {snapshot['time']}")
+
+
 if __name__ == "__main__":
     manager.run()
@@ -5,6 +5,7 @@ from flask_caching import make_template_fragment_key
 
 from CTFd.cache import clear_standings
 from CTFd.models import Users
+from CTFd.utils import set_config
 from tests.helpers import (
     create_ctfd,
     destroy_ctfd,
@@ -153,3 +154,42 @@ def test_scoreboard_tie_break_ordering_with_awards_under_teams():
             assert resp["data"][1]["name"] == "team1"
             assert resp["data"][1]["score"] == 200
     destroy_ctfd(app)
+
+
+def test_scoreboard_snapshot_diff():
+    """Test that admins can compare the live scoreboard against the frozen one"""
+    app = create_ctfd()
+    with app.app_context():
+        register_user(app)
+        gen_challenge(app.db, value=100)
+
+        with login_as_user(app, "admin") as client:
+            r = client.get("/api/v1/scoreboard/snapshots/diff")
+            assert r.status_code == 404
+
+            set_config("freeze", 1507001280)
+            r = client.get("/api/v1/scoreboard/snapshots")
+            assert r.get_json()["data"] == {"frozen": True, "snapshots": []}
+
+            gen_solve(app.db, user_id=2, challenge_id=1)
+            r = client.get("/api/v1/scoreboard/snapshots/diff")
+            data = r.get_json()["data"]
+            assert data["diff"] == [
+                {
+                    "account_id": 2,
+                    "name": "user",
+                    "place": 1,
+                    "score": 100,
+                    "snapshot_place": None,
+                    "snapshot_score": None,
+                }
+            ]
+            assert (
+                client.get("/api/v1/scoreboard/snapshots/diff?snapshot=1").status_code
+                == 404
+            )
+
+        with login_as_user(app) as client:
+            r = client.get("/api/v1/scoreboard/snapshots", json="")
+            assert r.status_code == 403
+    destroy_ctfd(app)
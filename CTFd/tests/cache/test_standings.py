@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from CTFd.cache import cache
+from CTFd.models import Users
+from tests.helpers import (
+    create_ctfd,
+    destroy_ctfd,
+    gen_challenge,
+    gen_flag,
+    gen_solve,
+    login_as_user,
+    register_user,
+)
+
+
+def is_cached(f, *args, **kwargs):
+    return cache.get(f.make_cache_key(f.uncached, *args, **kwargs)) is not None
+
+
+def test_incorrect_submission_keeps_caches():
+    """Test that a wrong flag doesn't drop any cached standings or solve counts"""
+    app = create_ctfd()
+    with app.app_context():
+        from CTFd.utils.challenges import get_solve_counts_for_challenges
+
+        register_user(app)
+        chal = gen_challenge(app.db, value=100)
+        chal_id = chal.id
+        gen_flag(app.db, challenge_id=chal_id, content="flag")
+
+        with login_as_user(app) as client:
+            client.get("/api/v1/scoreboard")
+            client.get("/api/v1/challenges")
+            assert app.cache.get("view/api.scoreboard_scoreboard_list")
+            assert is_cached(get_solve_counts_for_challenges, admin=False)
+
+            r = client.post(
+                "/api/v1/challenges/attempt",
+                json={"challenge_id": chal_id, "submission": "wrong"},
+            )
+            assert r.get_json()["data"]["status"] == "incorrect"
+            assert app.cache.get("view/api.scoreboard_scoreboard_list")
+            assert is_cached(get_solve_counts_for_challenges, admin=False)
+    destroy_ctfd(app)
+
+
+def test_correct_submission_clears_rank_window():
+    """Test that a solve only drops the places of the accounts it moved past"""
+    app = create_ctfd()
+    with app.app_context():
+        from CTFd.utils.user import get_user_place, get_user_score
+
+        register_user(app, name="user1", email="user1@examplectf.com")
+        register_user(app, name="user2", email="user2@examplectf.com")
+        register_user(app, name="user3", email="user3@examplectf.com")
+        gen_challenge(app.db, value=100)
+        gen_challenge(app.db, value=300)
+        chal = gen_challenge(app.db, value=150)
+        chal_id = chal.id
+        gen_flag(app.db, challenge_id=chal_id, content="flag")
+        gen_solve(app.db, user_id=3, challenge_id=1)
+        gen_solve(app.db, user_id=4, challenge_id=2)
+
+        assert [get_user_place(user_id=i) for i in (2, 3, 4)] == [None, "2nd", "1st"]
+        for user_id in (2, 3, 4):
+            get_user_score(user_id=user_id)
+            # Non default arguments are dropped as well
+            Users.query.filter_by(id=user_id).first().get_place(
+                admin=True, numeric=True
+            )
+
+        with login_as_user(app, "user1") as client:
+            client.get("/api/v1/scoreboard")
+            r = client.post(
+                "/api/v1/challenges/attempt",
+                json={"challenge_id": chal_id, "submission": "flag"},
+            )
+            assert r.get_json()["data"]["status"] == "correct"
+
+        assert app.cache.get("view/api.scoreboard_scoreboard_list") is None
+        # user1 moved past user2 but not user3
+        assert is_cached(get_user_place, user_id=2) is False
+        assert is_cached(get_user_place, user_id=3) is False
+        assert is_cached(get_user_place, user_id=4)
+        assert is_cached(get_user_score, user_id=2) is False
+        assert is_cached(get_user_score, user_id=3)
+        user2 = Users.query.filter_by(id=3).first()
+        user3 = Users.query.filter_by(id=4).first()
+        assert is_cached(Users.get_place, user2, admin=True, numeric=True) is False
+        assert is_cached(Users.get_place, user3, admin=True, numeric=True)
+        assert user2.get_place(admin=True, numeric=True) == 3
+        assert [get_user_place(user_id=i) for i in (2, 3, 4)] == ["2nd", "3rd", "1st"]
+        assert get_user_score(user_id=2) == 150
+    destroy_ctfd(app)
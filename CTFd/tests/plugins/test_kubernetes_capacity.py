@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import importlib
+from decimal import Decimal
+from types import SimpleNamespace
+
+from kubernetes.client import (
+    V1Container,
+    V1Node,
+    V1NodeCondition,
+    V1NodeStatus,
+    V1ObjectMeta,
+    V1Pod,
+    V1PodSpec,
+    V1ResourceRequirements,
+)
+
+from tests.helpers import create_ctfd, destroy_ctfd, gen_user
+
+PLUGIN = "CTFd.plugins.ctfd-k8s"
+
+GIB = 2 ** 30
+
+
+def gen_node(name, cpu="4", memory="8Gi", ready="True"):
+    return V1Node(
+        metadata=V1ObjectMeta(name=name),
+        status=V1NodeStatus(
+            allocatable={"cpu": cpu, "memory": memory},
+            conditions=[V1NodeCondition(type="Ready", status=ready)],
+        ),
+    )
+
+
+def gen_pod(name, requests, node_name=None, labels=None, priority=0, init=None):
+    def container(requests):
+        return V1Container(
+            name=name, resources=V1ResourceRequirements(requests=requests)
+        )
+
+    return V1Pod(
+        metadata=V1ObjectMeta(name=name, namespace="kube-system", labels=labels),
+        spec=V1PodSpec(
+            containers=[container(r) for r in requests],
+            init_containers=[container(init)] if init else None,
+            node_name=node_name,
+            priority=priority,
+        ),
+    )
+
+
+class PodApi:
+    def __init__(self, pods):
+        self.pods = pods
+
+    def list_pod_for_all_namespaces(self, field_selector):
+        assert field_selector == "status.phase!=Succeeded,status.phase!=Failed"
+        return SimpleNamespace(items=self.pods)
+
+
+def test_reserved_capacity_counts_other_workloads():
+    """Test that what other pods request is taken off the capacity left for instances"""
+    app = create_ctfd()
+    with app.app_context():
+        importlib.import_module(PLUGIN + ".models")
+        app.db.create_all()
+        capacity = importlib.import_module(PLUGIN + ".utils.capacity")
+        Capacity = capacity.Capacity
+        KubernetesInformer = capacity.KubernetesInformer
+        KubernetesUtils = capacity.KubernetesUtils
+        apis = KubernetesUtils._apis
+        KubernetesUtils._apis = {
+            "v1": PodApi(
+                [
+                    # two containers, a larger init container for memory only
+                    gen_pod(
+                        "dns",
+                        [{"cpu": "100m", "memory": "70Mi"}, {"cpu": "100m"}],
+                        "node1",
+                        init={"cpu": "50m", "memory": "1Gi"},
+                    ),
+                    # not scheduled yet, but it will be
+                    gen_pod("web", [{"cpu": "1", "memory": "1Gi"}]),
+                    # counted from its row
+                    gen_pod("chal", [{"cpu": "2"}], "node1", labels={"chal-id": "x"}),
+                    # a balloon makes way for instances
+                    gen_pod("balloon", [{"cpu": "2"}], "node1", priority=-10),
+                    # on a node which doesn't count towards the total
+                    gen_pod("cordoned", [{"cpu": "2"}], "node2"),
+                ]
+            )
+        }
+        try:
+            KubernetesInformer.nodes.replace(
+                [gen_node("node1"), gen_node("node2", ready="False")]
+            )
+            assert Capacity.refresh_reserved() == (Decimal("1.2"), 2 * GIB)
+            assert Capacity.get_used() == (Decimal("1.2"), 2 * GIB)
+        finally:
+            KubernetesUtils._apis = apis
+            KubernetesInformer.nodes.replace([])
+    destroy_ctfd(app)
+
+
+def test_admit_queued_in_order_while_it_fits():
+    """Test that queued launches are admitted first come first served until the cluster is full"""
+    app = create_ctfd()
+    with app.app_context():
+        models = importlib.import_module(PLUGIN + ".models")
+        ContainerStatus = models.ContainerStatus
+        app.db.create_all()
+        small = models.DynamicKubernetesChallenge(
+            name="small",
+            category="web",
+            value=100,
+            type="dynamic_kubernetes",
+            cpu_limit=1,
+            memory_limit="1g",
+        )
+        huge = models.DynamicKubernetesChallenge(
+            name="huge",
+            category="web",
+            value=100,
+            type="dynamic_kubernetes",
+            cpu_limit=8,
+            memory_limit="1g",
+        )
+        app.db.session.add_all([small, huge])
+        app.db.session.commit()
+
+        control = importlib.import_module(PLUGIN + ".utils.control")
+        DBContainer = control.DBContainer
+        Capacity = control.Capacity
+        ProvisionQueue = control.ProvisionQueue
+        KubernetesInformer = importlib.import_module(
+            PLUGIN + ".utils.informer"
+        ).KubernetesInformer
+        Capacity.init(app)
+        Quota = importlib.import_module(PLUGIN + ".utils.quota").Quota
+        Quota.init(app)
+        # 4 cpus, of which other workloads take 1.5
+        app.cache.set(Capacity.reserved_key, (Decimal("1.5"), Decimal(0)), timeout=0)
+        queued = []
+        for i, challenge in enumerate([huge, small, small, small]):
+            user = gen_user(
+                app.db, name="user%d" % i, email="user%d@examplectf.com" % i
+            )
+            queued.append(
+                DBContainer.create_container_record(
+                    user.id, challenge.id, status=ContainerStatus.QUEUED
+                ).id
+            )
+        submitted = []
+
+        submit = ProvisionQueue.submit
+        ProvisionQueue.submit = staticmethod(lambda func, *args: submitted.append(args))
+        try:
+            KubernetesInformer.nodes.replace([gen_node("node1")])
+            assert Capacity.check(huge) == Capacity.NEVER
+            assert Capacity.check(small) == Capacity.FITS
+
+            control.ControlUtil.admit_queued()
+            statuses = [
+                DBContainer.get_container_by_id(container_id).status
+                for container_id in queued
+            ]
+            assert statuses == [
+                ContainerStatus.FAILED,
+                ContainerStatus.PENDING,
+                ContainerStatus.PENDING,
+                ContainerStatus.QUEUED,
+            ]
+            assert submitted == [(queued[1],), (queued[2],)]
+            assert Capacity.check(small) == Capacity.FULL
+        finally:
+            ProvisionQueue.submit = submit
+            KubernetesInformer.nodes.replace([])
+    destroy_ctfd(app)
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import importlib
+
+from tests.helpers import create_ctfd, destroy_ctfd
+
+PLUGIN = "CTFd.plugins.ctfd-k8s"
+
+
+def test_metrics_render():
+    """Test that metrics keep their precision, buckets go by bound and failure reasons are fixed"""
+    app = create_ctfd()
+    with app.app_context():
+        metrics = importlib.import_module(PLUGIN + ".utils.metrics")
+        Metrics = metrics.Metrics
+        Metrics.init(app)
+        Metrics.provider.metrics.pop(Metrics.key, None)
+        try:
+            Metrics.observe(metrics.PHASE, 0.3, phase="apply")
+            Metrics.failure("timeout")
+            Metrics.failure("Traceback (most recent call last): ...")
+            lines = Metrics.render(
+                [("ctfd_kubernetes_instances", {"status": "ready"}, 1234567)]
+            ).splitlines()
+
+            assert 'ctfd_kubernetes_instances{status="ready"} 1234567' in lines
+            assert 'ctfd_kubernetes_failures_total{reason="timeout"} 1' in lines
+            assert 'ctfd_kubernetes_failures_total{reason="other"} 1' in lines
+            buckets = [
+                line.split('le="')[1].split('"')[0]
+                for line in lines
+                if line.startswith(metrics.PHASE + "_bucket")
+            ]
+            assert buckets == [str(bound) for bound in metrics.BUCKETS[3:]] + ["+Inf"]
+            assert 'ctfd_kubernetes_phase_seconds_sum{phase="apply"} 0.3' in lines
+        finally:
+            Metrics.provider.metrics.pop(Metrics.key, None)
+    destroy_ctfd(app)
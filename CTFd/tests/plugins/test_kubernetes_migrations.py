@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import glob
+import importlib.util
+import os
+
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from alembic.script import ScriptDirectory
+from sqlalchemy import create_engine
+
+from CTFd.plugins.migrations import get_columns_for_table
+
+MIGRATIONS = os.path.join(
+    os.path.dirname(__file__), "../../CTFd/plugins/ctfd-k8s/migrations"
+)
+
+
+def load_migration(revision):
+    (path,) = glob.glob(os.path.join(MIGRATIONS, revision + "_*.py"))
+    spec = importlib.util.spec_from_file_location(revision, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_migrations():
+    config = Config()
+    config.set_main_option("script_location", MIGRATIONS)
+    config.set_main_option("version_locations", MIGRATIONS)
+    script = ScriptDirectory.from_config(config)
+    # a single chain, one revision per feature
+    assert len(script.get_heads()) == 1
+    revisions = reversed(list(script.walk_revisions("base", "heads")))
+    return [load_migration(revision.revision) for revision in revisions]
+
+
+def test_lifecycle_columns_are_added_to_existing_tables():
+    """Test that upgrading adds the newer columns to tables created by an older release"""
+    migrations = load_migrations()
+    assert migrations[0].revision == "41469411f27a"
+    engine = create_engine("sqlite://")
+    with engine.connect() as conn:
+        conn.execute(
+            "CREATE TABLE kubernetes_container (id INTEGER PRIMARY KEY, status INTEGER)"
+        )
+        conn.execute("INSERT INTO kubernetes_container (id, status) VALUES (1, 1)")
+        conn.execute(
+            "CREATE TABLE dynamic_kubernetes_challenge (id INTEGER PRIMARY KEY, shared INTEGER)"
+        )
+        op = Operations(MigrationContext.configure(conn))
+
+        for migration in migrations:
+            migration.upgrade(op=op)
+        # tables already up to date are left alone
+        for migration in migrations:
+            migration.upgrade(op=op)
+
+        assert get_columns_for_table(op, "kubernetes_container", names_only=True) == [
+            "id",
+            "status",
+            "message",
+            "status_time",
+            "namespace",
+            "shared",
+        ]
+        assert get_columns_for_table(
+            op, "dynamic_kubernetes_challenge", names_only=True
+        ) == [
+            "id",
+            "shared",
+            "warm_pool_size",
+            "max_instances",
+            "shared_users_per_replica",
+            "shared_max_replicas",
+        ]
+        row = conn.execute(
+            "SELECT shared, namespace FROM kubernetes_container"
+        ).fetchone()
+        assert tuple(row) == (0, None)
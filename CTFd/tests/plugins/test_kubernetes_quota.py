@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import importlib
+
+from tests.helpers import create_ctfd, destroy_ctfd, gen_team, gen_user
+
+PLUGIN = "CTFd.plugins.ctfd-k8s"
+
+CONFIG = """
+apiVersion: v1
+kind: Pod
+metadata:
+  name: chal-{short_id}
+  labels:
+    chal-id: "{id}"
+spec:
+  containers:
+    - name: chal
+      image: chal
+      env:
+        - name: FLAG
+          value: "{flag}"
+"""
+
+
+class FakeRouter:
+    kinds = []
+
+    def unregister(self, container):
+        return True, "Unregistered"
+
+
+def load_plugin(app):
+    models = importlib.import_module(PLUGIN + ".models")
+    app.db.create_all()
+    challenge = models.DynamicKubernetesChallenge(
+        name="chal",
+        category="web",
+        value=100,
+        type="dynamic_kubernetes",
+        kubernetes_config=CONFIG,
+    )
+    app.db.session.add(challenge)
+    app.db.session.commit()
+    quota = importlib.import_module(PLUGIN + ".utils.quota")
+    quota.Quota.init(app)
+    quota.Quota.provider.reset_quota(quota.Quota.key, {})
+    capacity = importlib.import_module(PLUGIN + ".utils.capacity")
+    capacity.Capacity.init(app)
+    return challenge.id, quota.Quota
+
+
+def launch(user_id, challenge_id):
+    db = importlib.import_module(PLUGIN + ".utils.db")
+    Quota = importlib.import_module(PLUGIN + ".utils.quota").Quota
+    ok, reservation = Quota.reserve(user_id, challenge_id)
+    assert ok
+    container = db.DBContainer.create_container_record(user_id, challenge_id)
+    Quota.settle(reservation)
+    return container
+
+
+def test_quota_reserve_and_reconcile():
+    """Test that reservations respect the limits and survive a reconcile before their row exists"""
+    app = create_ctfd()
+    with app.app_context():
+        challenge_id, Quota = load_plugin(app)
+        models = importlib.import_module(PLUGIN + ".models")
+        challenge = models.DynamicKubernetesChallenge.query.get(challenge_id)
+        challenge.max_instances = 2
+        app.db.session.commit()
+        users = [
+            gen_user(app.db, name="user%d" % i, email="user%d@examplectf.com" % i)
+            for i in range(3)
+        ]
+        field = "challenge:%d" % challenge_id
+
+        launch(users[0].id, challenge_id)
+        # reserved, but the row isn't committed yet
+        ok, reservation = Quota.reserve(users[1].id, challenge_id)
+        assert ok
+        ok, msg = Quota.reserve(users[2].id, challenge_id)
+        assert not ok
+        assert msg == "Max container count for this challenge exceed."
+
+        assert Quota.reconcile() == {"global": 1, field: 1}
+        assert Quota.get_usage() == {"global": 2, field: 2}
+        assert Quota.reserve(users[2].id, challenge_id)[0] is False
+
+        Quota.release_reservation(reservation)
+        assert Quota.get_usage() == {"global": 1, field: 1}
+        Quota.reconcile()
+        assert Quota.get_usage() == {"global": 1, field: 1}
+
+        # counters which drifted are put right from the rows
+        Quota.provider.reset_quota(Quota.key, {"global": 7, field: 7})
+        Quota.reconcile()
+        assert Quota.get_usage() == {"global": 1, field: 1}
+    destroy_ctfd(app)
+
+
+def test_destroy_container_releases_quota():
+    """Test that destroying an instance gives its quota slots back"""
+    app = create_ctfd()
+    with app.app_context():
+        challenge_id, Quota = load_plugin(app)
+        control = importlib.import_module(PLUGIN + ".utils.control")
+        KubernetesUtils = control.KubernetesUtils
+        Router = control.Router
+        user = gen_user(app.db)
+        container = launch(user.id, challenge_id)
+        assert Quota.get_usage() == {"global": 1, "challenge:%d" % challenge_id: 1}
+
+        remove_container = KubernetesUtils.remove_container
+        KubernetesUtils.remove_container = staticmethod(lambda container, kinds: None)
+        Router._name, Router._router = "k8s", FakeRouter()
+        try:
+            ok, msg = control.ControlUtil.destroy_container(container)
+            assert ok, msg
+            assert Quota.get_usage() == {"global": 0, "challenge:%d" % challenge_id: 0}
+        finally:
+            KubernetesUtils.remove_container = remove_container
+            Router.reset()
+    destroy_ctfd(app)
+
+
+def test_reaper_releases_quota():
+    """Test that reaped instances give their quota slots back, team slot included"""
+    app = create_ctfd(user_mode="teams")
+    with app.app_context():
+        challenge_id, Quota = load_plugin(app)
+        reaper = importlib.import_module(PLUGIN + ".utils.reaper")
+        KubernetesUtils = reaper.KubernetesUtils
+        Router = reaper.Router
+        team = gen_team(app.db, member_count=2)
+        containers = [launch(member.id, challenge_id) for member in team.members]
+        container_ids = sorted(c.id for c in containers)
+        team_field = "team:%d" % team.id
+        assert Quota.get_usage()[team_field] == 2
+
+        delete_batch = KubernetesUtils.delete_batch
+        KubernetesUtils.delete_batch = staticmethod(
+            lambda namespace, kinds, members: [
+                container_id for container_id, _ in members
+            ]
+        )
+        Router._name, Router._router = "k8s", FakeRouter()
+        try:
+            removed = reaper.Reaper.remove(containers)
+            assert sorted(removed) == container_ids
+            assert Quota.get_usage() == {
+                "global": 0,
+                "challenge:%d" % challenge_id: 0,
+                team_field: 0,
+            }
+        finally:
+            KubernetesUtils.delete_batch = delete_batch
+            Router.reset()
+    destroy_ctfd(app)
+
+
+def test_bulk_destroy_counts_removed_instances():
+    """Test that a bulk destroy reports the instances it removed and releases their slots"""
+    app = create_ctfd()
+    with app.app_context():
+        challenge_id, Quota = load_plugin(app)
+        bulk = importlib.import_module(PLUGIN + ".utils.bulk")
+        reaper = importlib.import_module(PLUGIN + ".utils.reaper")
+        KubernetesUtils = reaper.KubernetesUtils
+        Router = reaper.Router
+        users = [
+            gen_user(app.db, name="user%d" % i, email="user%d@examplectf.com" % i)
+            for i in range(3)
+        ]
+        containers = [launch(user.id, challenge_id) for user in users]
+        job = {
+            "id": "job",
+            "action": "destroy",
+            "total": 3,
+            "done": 0,
+            "succeeded": 0,
+            "finished": False,
+        }
+        bulk.BulkOperation._save(job)
+
+        delete_batch = KubernetesUtils.delete_batch
+        # the instance of the last user fails to go away
+        KubernetesUtils.delete_batch = staticmethod(
+            lambda namespace, kinds, members: [
+                container_id
+                for container_id, _ in members
+                if container_id != containers[-1].id
+            ]
+        )
+        Router._name, Router._router = "k8s", FakeRouter()
+        try:
+            bulk.BulkOperation._run("job", [c.id for c in containers])
+            job = bulk.BulkOperation.get("job")
+            assert job["finished"]
+            assert job["done"] == 3
+            assert job["succeeded"] == 2
+            assert Quota.get_usage()["global"] == 1
+        finally:
+            KubernetesUtils.delete_batch = delete_batch
+            Router.reset()
+    destroy_ctfd(app)
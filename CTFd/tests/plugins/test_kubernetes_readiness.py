@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import importlib
+
+from kubernetes.client import (
+    V1Node,
+    V1NodeAddress,
+    V1NodeStatus,
+    V1ObjectMeta,
+    V1Pod,
+    V1PodSpec,
+    V1PodStatus,
+)
+
+from tests.helpers import create_ctfd, destroy_ctfd
+
+PLUGIN = "CTFd.plugins.ctfd-k8s"
+
+
+def gen_pod(name, phase, node_name=None, chal_id="chal"):
+    return V1Pod(
+        metadata=V1ObjectMeta(
+            name=name, namespace="default", labels={"chal-id": chal_id}
+        ),
+        spec=V1PodSpec(containers=[], node_name=node_name),
+        status=V1PodStatus(phase=phase),
+    )
+
+
+def gen_node(name, *addresses):
+    return V1Node(
+        metadata=V1ObjectMeta(name=name),
+        status=V1NodeStatus(
+            addresses=[
+                V1NodeAddress(type=type_, address=address)
+                for type_, address in addresses
+            ]
+        ),
+    )
+
+
+def test_pod_state_waits_for_other_replicas():
+    """Test that one exited replica only fails an instance if no other replica can become ready"""
+    app = create_ctfd()
+    with app.app_context():
+        informer = importlib.import_module(PLUGIN + ".utils.informer")
+        readiness = importlib.import_module(PLUGIN + ".utils.readiness")
+        pods = informer.KubernetesInformer.pods
+        nodes = informer.KubernetesInformer.nodes
+        pod_state = readiness.ReadinessTracker.pod_state
+        try:
+            nodes.replace([gen_node("node1", ("ExternalIP", "203.0.113.1"))])
+
+            pods.replace([gen_pod("a", "Failed", "node1")])
+            assert pod_state("chal") == "failed"
+
+            pods.replace([gen_pod("a", "Failed", "node1"), gen_pod("b", "Pending")])
+            assert pod_state("chal") is None
+
+            pods.replace(
+                [gen_pod("a", "Failed", "node1"), gen_pod("b", "Running", "node1")]
+            )
+            assert pod_state("chal") == "ready"
+        finally:
+            pods.replace([])
+            nodes.replace([])
+    destroy_ctfd(app)
+
+
+def test_pod_state_depends_on_router():
+    """Test that only routers reaching instances on their node wait for an ExternalIP"""
+    app = create_ctfd()
+    with app.app_context():
+        informer = importlib.import_module(PLUGIN + ".utils.informer")
+        readiness = importlib.import_module(PLUGIN + ".utils.readiness")
+        routers = importlib.import_module(PLUGIN + ".utils.routers")
+        pods = informer.KubernetesInformer.pods
+        nodes = informer.KubernetesInformer.nodes
+        pod_state = readiness.ReadinessTracker.pod_state
+        try:
+            nodes.replace([gen_node("node1", ("InternalIP", "10.0.0.1"))])
+            pods.replace([gen_pod("a", "Running", "node1")])
+
+            assert pod_state("chal", routers.K8sRouter.needs_node_address) is None
+            assert (
+                pod_state("chal", routers.IngressRouter.needs_node_address) == "ready"
+            )
+            assert (
+                pod_state("chal", routers.GatewayRouter.needs_node_address) == "ready"
+            )
+        finally:
+            pods.replace([])
+            nodes.replace([])
+    destroy_ctfd(app)
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import importlib
+from types import SimpleNamespace
+
+from tests.helpers import create_ctfd, destroy_ctfd
+
+PLUGIN = "CTFd.plugins.ctfd-k8s"
+
+
+def test_inject_resources_lowers_larger_requests():
+    """Test that requests a template declares never end up above the injected limits"""
+    app = create_ctfd()
+    with app.app_context():
+        resources = importlib.import_module(PLUGIN + ".utils.resources")
+        challenge = SimpleNamespace(cpu_limit=0.5, memory_limit="128m")
+        documents = [
+            {
+                "kind": "Deployment",
+                "spec": {
+                    "template": {
+                        "spec": {
+                            "containers": [
+                                {
+                                    "name": "web",
+                                    "resources": {
+                                        "requests": {"cpu": "2", "memory": "64Mi"}
+                                    },
+                                },
+                                {"name": "db"},
+                            ]
+                        }
+                    }
+                },
+            }
+        ]
+
+        resources.inject_resources(documents, challenge)
+        web, db = documents[0]["spec"]["template"]["spec"]["containers"]
+        assert web["resources"] == {
+            "limits": {"cpu": "250m", "memory": "67108864"},
+            "requests": {"cpu": "250m", "memory": "64Mi"},
+        }
+        assert db["resources"]["requests"] == db["resources"]["limits"]
+    destroy_ctfd(app)
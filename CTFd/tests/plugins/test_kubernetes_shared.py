@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hmac
+import importlib
+from hashlib import sha256
+
+from tests.helpers import create_ctfd, destroy_ctfd
+
+PLUGIN = "CTFd.plugins.ctfd-k8s"
+
+
+def test_shared_tokens_are_not_derived_from_the_deployment_key():
+    """Test that the key given to a shared deployment checks flags but can't produce tokens"""
+    app = create_ctfd()
+    with app.app_context():
+        SharedInstance = importlib.import_module(
+            PLUGIN + ".utils.shared"
+        ).SharedInstance
+        key = SharedInstance.get_key(1).encode()
+        token = SharedInstance.token_for(1, 2)
+
+        assert token != hmac.new(key, b"token:2", sha256).hexdigest()[:24]
+        assert token != SharedInstance.token_for(1, 3)
+        assert token != SharedInstance.token_for(2, 2)
+        # what the deployment works out on its own from the token
+        flag = "flag{" + hmac.new(key, token.encode(), sha256).hexdigest()[:32] + "}"
+        assert SharedInstance.flag_for(1, 2) == flag
+    destroy_ctfd(app)
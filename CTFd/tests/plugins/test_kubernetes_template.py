@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import importlib
+from types import SimpleNamespace
+
+import pytest
+
+from tests.helpers import create_ctfd, destroy_ctfd
+
+PLUGIN = "CTFd.plugins.ctfd-k8s"
+
+CONFIG = """
+apiVersion: v1
+kind: Pod
+metadata:
+  name: chal-{short_id}
+  labels:
+    chal-id: "{id}"
+spec:
+  containers:
+    - name: chal
+      image: chal
+      env:
+        - name: FLAG
+          value: "{flag}"
+        - name: GREETING
+          value: "{{ not a placeholder }}"
+---
+apiVersion: v1
+kind: Service
+metadata:
+  name: chal-{short_id}
+  labels:
+    chal-id: "{id}"
+spec:
+  selector:
+    chal-id: "{id}"
+  ports:
+    - port: 1337
+"""
+
+
+def test_compiled_template_render():
+    """Test that a compiled template renders every placeholder without sharing state between renders"""
+    app = create_ctfd()
+    with app.app_context():
+        template = importlib.import_module(PLUGIN + ".utils.template")
+        compiled = template.CompiledTemplate(CONFIG)
+        assert compiled.kinds == [("v1", "Pod"), ("v1", "Service")]
+        assert compiled.can_relabel
+        assert not compiled.can_share
+
+        pod, service = compiled.render(id="a-1", short_id="1", flag="flag{a}")
+        assert pod["metadata"] == {"name": "chal-1", "labels": {"chal-id": "a-1"}}
+        assert pod["spec"]["containers"][0]["env"] == [
+            {"name": "FLAG", "value": "flag{a}"},
+            {"name": "GREETING", "value": "{ not a placeholder }"},
+        ]
+        assert service["spec"]["selector"] == {"chal-id": "a-1"}
+        assert service["spec"]["ports"] == [{"port": 1337}]
+
+        pod, _ = compiled.render(id="b-2", short_id="2", flag="flag{b}")
+        assert pod["metadata"]["name"] == "chal-2"
+        assert compiled.documents[0]["metadata"]["name"] == "chal-__ctfd_k8s_short_id__"
+
+        assert compiled.relabel_patches(id="c-1", short_id="1", flag="flag{a}") == [
+            ("v1", "Pod", "chal-1", {"metadata": {"labels": {"chal-id": "c-1"}}}),
+            (
+                "v1",
+                "Service",
+                "chal-1",
+                {
+                    "metadata": {"labels": {"chal-id": "c-1"}},
+                    "spec": {"selector": {"chal-id": "c-1"}},
+                },
+            ),
+        ]
+    destroy_ctfd(app)
+
+
+def test_compiled_template_errors():
+    """Test that broken challenge configs are rejected when they are compiled"""
+    app = create_ctfd()
+    with app.app_context():
+        template = importlib.import_module(PLUGIN + ".utils.template")
+        KubernetesError = importlib.import_module(
+            PLUGIN + ".utils.exceptions"
+        ).KubernetesError
+        broken = {
+            "": "The challenge config is empty",
+            CONFIG.replace("{flag}", "{token}"): "Invalid placeholder",
+            CONFIG.replace('chal-id: "{id}"', "chal-id: fixed"): "chal-id as label",
+            CONFIG.replace(
+                "image: chal", "{flag}: chal"
+            ): "Placeholders are only allowed in values",
+            CONFIG.replace("kind: Service", "kind: Nonsense"): "Unsupported kind",
+            "apiVersion: v1\nkind: Pod\n": "must have metadata.name",
+            "- a\n- b\n": "apiVersion and kind",
+        }
+        for source, message in broken.items():
+            with pytest.raises(KubernetesError) as e:
+                template.CompiledTemplate(source)
+            assert message in str(e.value)
+    destroy_ctfd(app)
+
+
+def test_template_cache_follows_the_source():
+    """Test that the template cache compiles once per source and recompiles on changes"""
+    app = create_ctfd()
+    with app.app_context():
+        TemplateCache = importlib.import_module(
+            PLUGIN + ".utils.template"
+        ).TemplateCache
+        challenge = SimpleNamespace(id=-1, kubernetes_config=CONFIG)
+        try:
+            compiled = TemplateCache.get(challenge)
+            assert TemplateCache.get(challenge) is compiled
+
+            challenge.kubernetes_config = CONFIG.split("---")[0]
+            recompiled = TemplateCache.get(challenge)
+            assert recompiled is not compiled
+            assert recompiled.kinds == [("v1", "Pod")]
+
+            TemplateCache.invalidate(-1)
+            assert TemplateCache.get(challenge) is not recompiled
+        finally:
+            TemplateCache.invalidate(-1)
+    destroy_ctfd(app)
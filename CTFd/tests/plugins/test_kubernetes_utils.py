@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import importlib
+from types import SimpleNamespace
+
+from kubernetes.client.rest import ApiException
+
+from tests.helpers import create_ctfd, destroy_ctfd
+
+PLUGIN = "CTFd.plugins.ctfd-k8s"
+
+
+class OldCoreApi:
+    # a cluster before Kubernetes 1.23, where Services have no deletecollection
+    def __init__(self):
+        self.deleted = []
+
+    def delete_collection_namespaced_service(self, namespace, label_selector):
+        raise ApiException(status=405, reason="Method Not Allowed")
+
+    def list_namespaced_service(self, namespace, label_selector):
+        assert label_selector == "chal-id in (a,b)"
+        return SimpleNamespace(
+            items=[
+                SimpleNamespace(metadata=SimpleNamespace(name=name)) for name in "ab"
+            ]
+        )
+
+    def delete_namespaced_service(self, name, namespace):
+        self.deleted.append((namespace, name))
+
+    def delete_collection_namespaced_pod(self, namespace, label_selector):
+        self.deleted.append((namespace, "pods"))
+
+
+def test_delete_kinds_falls_back_to_deleting_each_service():
+    """Test that Services are deleted one by one where deletecollection isn't supported"""
+    app = create_ctfd()
+    with app.app_context():
+        kubernetes = importlib.import_module(PLUGIN + ".utils.kubernetes")
+        KubernetesUtils = kubernetes.KubernetesUtils
+        api = OldCoreApi()
+        apis = KubernetesUtils._apis
+        KubernetesUtils._apis = {"v1": api}
+        try:
+            removed = KubernetesUtils.delete_batch(
+                "ns", [("v1", "Pod"), ("v1", "Service")], [(1, "a"), (2, "b")]
+            )
+            assert removed == [1, 2]
+            assert api.deleted == [("ns", "pods"), ("ns", "a"), ("ns", "b")]
+        finally:
+            KubernetesUtils._apis = apis
+    destroy_ctfd(app)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import importlib
+
+from tests.helpers import create_ctfd, destroy_ctfd, gen_user
+
+PLUGIN = "CTFd.plugins.ctfd-k8s"
+
+
+class FakeRouter:
+    kinds = []
+
+    def unregister(self, container):
+        return True, "Unregistered"
+
+
+def gen_pool(app, size, *statuses):
+    models = importlib.import_module(PLUGIN + ".models")
+    app.db.create_all()
+    challenge = models.DynamicKubernetesChallenge(
+        name="chal",
+        category="web",
+        value=100,
+        type="dynamic_kubernetes",
+        warm_pool_size=size,
+    )
+    app.db.session.add(challenge)
+    app.db.session.commit()
+    DBContainer = importlib.import_module(PLUGIN + ".utils.db").DBContainer
+    pool = [
+        DBContainer.create_container_record(None, challenge.id, status=status).id
+        for status in statuses
+    ]
+    return challenge.id, pool
+
+
+def test_claim_warm_container():
+    """Test that only ready warm instances are claimed, each of them once"""
+    app = create_ctfd()
+    with app.app_context():
+        ContainerStatus = importlib.import_module(PLUGIN + ".models").ContainerStatus
+        DBContainer = importlib.import_module(PLUGIN + ".utils.db").DBContainer
+        challenge_id, (pending, ready) = gen_pool(
+            app, 2, ContainerStatus.PENDING, ContainerStatus.READY
+        )
+        first = gen_user(app.db, name="first", email="first@examplectf.com")
+        second = gen_user(app.db, name="second", email="second@examplectf.com")
+
+        container = DBContainer.claim_warm_container(first.id, challenge_id)
+        assert container.id == ready
+        assert container.user_id == first.id
+        assert DBContainer.claim_warm_container(second.id, challenge_id) is None
+        assert [c.id for c in DBContainer.get_warm_containers(challenge_id)] == [
+            pending
+        ]
+    destroy_ctfd(app)
+
+
+def test_drain_and_claim_exclude_each_other():
+    """Test that a warm instance is either drained by a shrinking pool or claimed, never both"""
+    app = create_ctfd()
+    with app.app_context():
+        ContainerStatus = importlib.import_module(PLUGIN + ".models").ContainerStatus
+        DBContainer = importlib.import_module(PLUGIN + ".utils.db").DBContainer
+        challenge_id, (drained, claimed) = gen_pool(
+            app, 0, ContainerStatus.READY, ContainerStatus.READY
+        )
+        user = gen_user(app.db)
+
+        assert DBContainer.drain_warm_container(drained)
+        container = DBContainer.claim_warm_container(user.id, challenge_id)
+        assert container.id == claimed
+        assert not DBContainer.drain_warm_container(claimed)
+        assert DBContainer.claim_warm_container(user.id, challenge_id) is None
+
+        container = DBContainer.get_container_by_id(drained)
+        app.db.session.refresh(container)
+        assert container.status == ContainerStatus.DRAINING
+    destroy_ctfd(app)
+
+
+def test_replenish_warm_pool_shrinks_from_the_newest():
+    """Test that a pool larger than its size drains and tears down its newest instances"""
+    app = create_ctfd()
+    with app.app_context():
+        ContainerStatus = importlib.import_module(PLUGIN + ".models").ContainerStatus
+        control = importlib.import_module(PLUGIN + ".utils.control")
+        KubernetesUtils = control.KubernetesUtils
+        Router = control.Router
+        challenge_id, pool = gen_pool(
+            app, 1, ContainerStatus.READY, ContainerStatus.READY, ContainerStatus.READY
+        )
+        removed = []
+
+        remove_container = KubernetesUtils.remove_container
+        KubernetesUtils.remove_container = staticmethod(
+            lambda container, kinds: removed.append(container.id)
+        )
+        Router._name, Router._router = "k8s", FakeRouter()
+        try:
+            control.ControlUtil.replenish_warm_pool(challenge_id)
+            assert removed == pool[:0:-1]
+            assert [
+                c.id for c in control.DBContainer.get_warm_containers(challenge_id)
+            ] == pool[:1]
+        finally:
+            KubernetesUtils.remove_container = remove_container
+            Router.reset()
+    destroy_ctfd(app)
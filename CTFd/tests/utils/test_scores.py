@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import datetime
+
+from freezegun import freeze_time
+
+from CTFd.cache import clear_standings
+from CTFd.models import Challenges, Solves, Users
+from CTFd.utils import set_config
+from CTFd.utils.scores import (
+    get_standings,
+    get_team_standings,
+    get_timelines,
+    get_user_places,
+    get_user_standings,
+)
+from CTFd.utils.scores.engine import get_engine
+from CTFd.utils.scores.snapshots import (
+    diff_snapshot,
+    get_frozen_snapshot,
+    get_snapshot,
+    get_snapshot_times,
+    record_snapshot,
+)
+from tests.helpers import (
+    create_ctfd,
+    destroy_ctfd,
+    gen_award,
+    gen_challenge,
+    gen_solve,
+    gen_team,
+    register_user,
+)
+
+
+def test_engine_standings_ordering():
+    """Test that the scoreboard engine orders by score and breaks ties by who got there first"""
+    app = create_ctfd()
+    with app.app_context():
+        register_user(app, name="user1", email="user1@examplectf.com")
+        register_user(app, name="user2", email="user2@examplectf.com")
+        register_user(app, name="user3", email="user3@examplectf.com")
+        gen_challenge(app.db, value=100)
+        gen_challenge(app.db, value=200)
+        gen_challenge(app.db, value=0)
+
+        gen_solve(app.db, user_id=2, challenge_id=1)
+        gen_solve(app.db, user_id=3, challenge_id=1)
+        # Zero value solves don't count towards tie breaks
+        gen_solve(app.db, user_id=2, challenge_id=3)
+        gen_award(app.db, user_id=4, value=50)
+
+        standings = get_standings()
+        assert [(s.account_id, s.name, s.score) for s in standings] == [
+            (2, "user1", 100),
+            (3, "user2", 100),
+            (4, "user3", 50),
+        ]
+        assert standings[0]._fields == ("account_id", "oauth_id", "name", "score")
+
+        gen_solve(app.db, user_id=3, challenge_id=2)
+        assert [s.account_id for s in get_standings()] == [3, 2, 4]
+        assert [s.account_id for s in get_standings(count=1)] == [3]
+    destroy_ctfd(app)
+
+
+def test_engine_standings_hidden_banned_and_admin():
+    """Test that the public standings leave out hidden and banned accounts but admin standings don't"""
+    app = create_ctfd()
+    with app.app_context():
+        register_user(app, name="user1", email="user1@examplectf.com")
+        register_user(app, name="user2", email="user2@examplectf.com")
+        gen_challenge(app.db, value=100)
+        gen_solve(app.db, user_id=2, challenge_id=1)
+        gen_solve(app.db, user_id=3, challenge_id=1)
+
+        user = Users.query.filter_by(id=2).first()
+        user.banned = True
+        app.db.session.commit()
+        clear_standings()
+
+        assert [s.account_id for s in get_standings()] == [3]
+        standings = get_standings(admin=True)
+        assert [(s.account_id, s.banned) for s in standings] == [(2, True), (3, False)]
+        assert standings[0]._fields == (
+            "account_id",
+            "oauth_id",
+            "name",
+            "hidden",
+            "banned",
+            "score",
+        )
+        standings = get_standings(admin=True, fields=[Users.email])
+        assert standings[0].email == "user1@examplectf.com"
+    destroy_ctfd(app)
+
+
+def test_engine_catches_up_without_rebuilding():
+    """Test that new solves, awards and challenge values are applied without a full rebuild"""
+    app = create_ctfd()
+    with app.app_context():
+        register_user(app, name="user1", email="user1@examplectf.com")
+        register_user(app, name="user2", email="user2@examplectf.com")
+        gen_challenge(app.db, value=100)
+        gen_challenge(app.db, value=200)
+        gen_solve(app.db, user_id=2, challenge_id=1)
+        gen_solve(app.db, user_id=3, challenge_id=2)
+
+        assert [s.account_id for s in get_standings()] == [3, 2]
+        engine = get_engine()
+        built = engine.built
+
+        solve = Solves(user_id=2, challenge_id=2, ip="127.0.0.1", provided="flag")
+        app.db.session.add(solve)
+        app.db.session.commit()
+        # The database isn't looked at again until the standings version moves
+        assert [score for _, score in engine.ranked("users")] == [200, 100]
+        clear_standings(rebuild=False)
+        assert [(s.account_id, s.score) for s in get_standings()] == [
+            (2, 300),
+            (3, 200),
+        ]
+
+        # Challenge values can change without the solves changing (e.g. dynamic challenges)
+        challenge = Challenges.query.filter_by(id=1).first()
+        challenge.value = 10
+        app.db.session.commit()
+        clear_standings(rebuild=False)
+        assert [(s.account_id, s.score) for s in get_standings()] == [
+            (2, 210),
+            (3, 200),
+        ]
+        assert engine.built == built
+
+        # Deleted rows are noticed and trigger a rebuild
+        app.db.session.delete(solve)
+        app.db.session.commit()
+        clear_standings(rebuild=False)
+        assert [(s.account_id, s.score) for s in get_standings()] == [
+            (3, 200),
+            (2, 10),
+        ]
+        assert engine.built != built
+    destroy_ctfd(app)
+
+
+def test_engine_standings_freeze():
+    """Test that the public standings only count solves before the freeze"""
+    app = create_ctfd()
+    with app.app_context():
+        register_user(app, name="user1", email="user1@examplectf.com")
+        register_user(app, name="user2", email="user2@examplectf.com")
+        gen_challenge(app.db, value=100)
+        gen_challenge(app.db, value=200)
+        gen_solve(app.db, user_id=2, challenge_id=1)
+
+        freeze = datetime.datetime.utcnow() + datetime.timedelta(seconds=1)
+        set_config(
+            "freeze", int((freeze - datetime.datetime(1970, 1, 1)).total_seconds())
+        )
+        gen_solve(app.db, user_id=3, challenge_id=2)
+        solve = Solves.query.filter_by(user_id=3).first()
+        solve.date = freeze + datetime.timedelta(minutes=5)
+        app.db.session.commit()
+        clear_standings()
+
+        assert [(s.account_id, s.score) for s in get_standings()] == [(2, 100)]
+        assert [(s.account_id, s.score) for s in get_standings(admin=True)] == [
+            (3, 200),
+            (2, 100),
+        ]
+    destroy_ctfd(app)
+
+
+def test_engine_team_and_user_standings():
+    """Test that team standings count team solves and user standings list each member's team"""
+    app = create_ctfd(user_mode="teams")
+    with app.app_context():
+        gen_team(app.db, name="team1", email="team1@examplectf.com")
+        gen_team(app.db, name="team2", email="team2@examplectf.com")
+        gen_challenge(app.db, value=100)
+        gen_challenge(app.db, value=200)
+
+        gen_solve(app.db, user_id=2, team_id=1, challenge_id=1)
+        gen_solve(app.db, user_id=3, team_id=1, challenge_id=2)
+        gen_solve(app.db, user_id=6, team_id=2, challenge_id=2)
+
+        standings = get_standings()
+        assert [(s.account_id, s.score) for s in standings] == [(1, 300), (2, 200)]
+        assert [(s.team_id, s.score) for s in get_team_standings()] == [
+            (1, 300),
+            (2, 200),
+        ]
+        standings = get_user_standings()
+        assert [(s.user_id, s.team_id, s.score) for s in standings] == [
+            (3, 1, 200),
+            (6, 2, 200),
+            (2, 1, 100),
+        ]
+    destroy_ctfd(app)
+
+
+def test_place_index_is_built_once_per_standings_version():
+    """Test that places come from an index which is only rebuilt when the standings change"""
+    app = create_ctfd()
+    with app.app_context():
+        register_user(app, name="user1", email="user1@examplectf.com")
+        register_user(app, name="user2", email="user2@examplectf.com")
+        gen_challenge(app.db, value=100)
+        gen_challenge(app.db, value=200)
+        gen_solve(app.db, user_id=2, challenge_id=1)
+        gen_solve(app.db, user_id=3, challenge_id=2)
+
+        places = get_user_places()
+        assert places == {3: 1, 2: 2}
+        assert get_user_places() is places
+        assert Users.query.filter_by(id=2).first().get_place(numeric=True) == 2
+
+        user = Users.query.filter_by(id=3).first()
+        user.hidden = True
+        app.db.session.commit()
+        clear_standings()
+
+        assert get_user_places() == {2: 1}
+        assert get_user_places(admin=True) == {3: 1, 2: 2}
+        assert Users.query.filter_by(id=3).first().place is None
+        assert Users.query.filter_by(id=2).first().place == "1st"
+    destroy_ctfd(app)
+
+
+def test_timelines_follow_solves_and_awards():
+    """Test that score timelines list solves and awards in date order as they come in"""
+    app = create_ctfd()
+    with app.app_context():
+        register_user(app, name="user1", email="user1@examplectf.com")
+        gen_challenge(app.db, value=100)
+        gen_challenge(app.db, value=200)
+
+        with freeze_time("2017-10-3 03:21:34"):
+            gen_solve(app.db, user_id=2, challenge_id=1)
+        with freeze_time("2017-10-3 03:25:00"):
+            gen_award(app.db, user_id=2, value=5)
+        assert get_timelines([2, 3]) == {
+            2: [
+                (1, 2, None, 100, "2017-10-03T03:21:34Z"),
+                (None, 2, None, 5, "2017-10-03T03:25:00Z"),
+            ],
+            3: [],
+        }
+
+        solve = Solves(
+            user_id=2,
+            challenge_id=2,
+            ip="127.0.0.1",
+            provided="flag",
+            date=datetime.datetime(2017, 10, 3, 3, 30),
+        )
+        app.db.session.add(solve)
+        app.db.session.commit()
+        challenge = Challenges.query.filter_by(id=1).first()
+        challenge.value = 50
+        app.db.session.commit()
+        clear_standings(rebuild=False)
+        assert get_timelines([2])[2] == [
+            (1, 2, None, 50, "2017-10-03T03:21:34Z"),
+            (None, 2, None, 5, "2017-10-03T03:25:00Z"),
+            (2, 2, None, 200, "2017-10-03T03:30:00Z"),
+        ]
+
+        # 2017-10-03T03:28:00
+        set_config("freeze", 1507001280)
+        assert len(get_timelines([2])[2]) == 2
+        assert len(get_timelines([2], admin=True)[2]) == 3
+    destroy_ctfd(app)
+
+
+def test_frozen_snapshot_serves_public_standings():
+    """Test that the public standings come from a snapshot taken once the freeze passed"""
+    app = create_ctfd()
+    with app.app_context():
+        register_user(app, name="user1", email="user1@examplectf.com")
+        register_user(app, name="user2", email="user2@examplectf.com")
+        gen_challenge(app.db, value=100)
+        gen_challenge(app.db, value=200)
+        gen_solve(app.db, user_id=2, challenge_id=1)
+        assert get_frozen_snapshot() is None
+
+        # 2017-10-03T03:28:00
+        set_config("freeze", 1507001280)
+        solve = Solves.query.filter_by(user_id=2).first()
+        solve.date = datetime.datetime(2017, 10, 3, 3, 0)
+        app.db.session.commit()
+        clear_standings()
+
+        assert [(s.account_id, s.score) for s in get_standings()] == [(2, 100)]
+        snapshot = get_frozen_snapshot()
+        assert snapshot["freeze"] == 1507001280
+        assert get_frozen_snapshot() is not None
+
+        # A pre-freeze solve showing up late isn't seen until the standings are cleared
+        solve = Solves(
+            user_id=3,
+            challenge_id=2,
+            ip="127.0.0.1",
+            provided="flag",
+            date=datetime.datetime(2017, 10, 3, 3, 10),
+        )
+        app.db.session.add(solve)
+        app.db.session.commit()
+        clear_standings(rebuild=False)
+        assert [s.account_id for s in get_standings()] == [2]
+        assert get_timelines([3]) == {3: []}
+        assert [s.account_id for s in get_standings(admin=True)] == [3, 2]
+
+        clear_standings()
+        assert [s.account_id for s in get_standings()] == [3, 2]
+        assert len(get_timelines([3])[3]) == 1
+
+        # While someone else is taking it the standings are computed instead
+        clear_standings()
+        app.cache.add("scoreboard_snapshots_lock", True, timeout=60)
+        assert get_frozen_snapshot() is None
+        assert [s.account_id for s in get_standings()] == [3, 2]
+        app.cache.delete("scoreboard_snapshots_lock")
+        assert get_frozen_snapshot() is not None
+    destroy_ctfd(app)
+
+
+def test_snapshot_history_and_diff():
+    """Test that snapshots are kept at the configured interval and can be compared to the live standings"""
+    app = create_ctfd()
+    with app.app_context():
+        register_user(app, name="user1", email="user1@examplectf.com")
+        register_user(app, name="user2", email="user2@examplectf.com")
+        gen_challenge(app.db, value=100)
+        gen_challenge(app.db, value=200)
+        gen_solve(app.db, user_id=2, challenge_id=1)
+
+        assert record_snapshot() is None
+
+        set_config("scoreboard_snapshot_interval", 5)
+        # Serving the standings never records a snapshot
+        get_standings()
+        assert get_snapshot_times() == []
+        with freeze_time("2017-10-3 03:00:00"):
+            assert record_snapshot()["time"] == 1506999600
+        with freeze_time("2017-10-3 03:02:00"):
+            assert record_snapshot() is None
+            # Nor does a run while another one holds the lock
+            app.cache.add("scoreboard_snapshots_lock", True, timeout=60)
+            with freeze_time("2017-10-3 03:10:00"):
+                assert record_snapshot() is None
+            app.cache.delete("scoreboard_snapshots_lock")
+        assert get_snapshot_times() == [1506999600]
+
+        gen_solve(app.db, user_id=3, challenge_id=2)
+        clear_standings()
+        diff = diff_snapshot(get_snapshot(1506999600))
+        assert diff == [
+            {
+                "account_id": 3,
+                "name": "user2",
+                "place": 1,
+                "score": 200,
+                "snapshot_place": None,
+                "snapshot_score": None,
+            },
+            {
+                "account_id": 2,
+                "name": "user1",
+                "place": 2,
+                "score": 100,
+                "snapshot_place": 1,
+                "snapshot_score": 100,
+            },
+        ]
+    destroy_ctfd(app)